@@ -2,8 +2,16 @@ import os
 import argparse
 import re
 import nltk
-import heapq
 import math
+import query_profile
+import boolean_query
+import term_dictionary
+import unified_index
+import phrase_index
+import postings_cache
+import result_pages
+import doc_metadata
+import index_generations
 
 # Calculate the TF-IDF score of a doc for a single query term
 def TFIDF_Score(f, df, N):
@@ -19,13 +27,113 @@ def TFIDF_Score(f, df, N):
     return score
 
 
+# sort key of a match (doc_id, score[, window]): descending score, then
+# ascending window, then doc id
+def match_key(result):
+    return (-result[1], result[2] if len(result) > 2 else -1, result[0])
+
+
+# merge the position lists {term: [positions]} of one document into a single
+# (position, term) list in document order
+def merge_positions(positions):
+    merged = [(pos_index, term) for term, pos_list in positions.items() for pos_index in pos_list]
+    merged.sort()
+    return merged
+
+
+# Smallest window in which the query terms occur in query order in one
+# document (positions: {term: [positions]}), inf if they never do. O(n log n)
+# in the number of positions (see ordered_best_match).
+def ordered_window(query, positions):
+    # Consider the query "a likes b"
+    # "b" should be preceded by "likes"
+    # "likes" should be preceded by "a"
+    # We first generate this mapping
+    query_map = {}
+    for i in range(1, len(query)):
+        query_map[query[i]] = query[i-1]
+
+    min_window = float('inf')
+
+    # This stores the most recent start index for a term
+    mr_start_idx = {}
+
+    # Backbone of the algorithm. O(n) loop
+    for idx, term in merge_positions(positions):
+
+        # Fetch the previous required word
+        previous_query_term = query_map.get(term)
+
+        # Only the first word has no mapping
+        if previous_query_term == None:
+            mr_start_idx[term] = idx
+        else:
+            mr_start_idx[term] = mr_start_idx.get(previous_query_term, -1)
+
+        # Check if the last word of the query was read, and it was assigned a value
+        # besides -1. Then a new sequence has been found.
+        if term == query[-1] and mr_start_idx[term] != -1:
+            min_window = min(min_window, idx - mr_start_idx[term])
+
+    return min_window
+
+
+# Length of the smallest span of one document (positions: {term: [positions]})
+# that contains every term of positions, in any order
+def cover_window(positions):
+    cur_doc = merge_positions(positions)
+
+    # Sliding window over the merged positions
+    min_window = float('inf')
+    counts = {}
+    left = 0
+    for idx, term in cur_doc:
+        counts[term] = counts.get(term, 0) + 1
+        while len(counts) == len(positions):
+            start, first = cur_doc[left]
+            min_window = min(min_window, idx - start + 1)
+            counts[first] -= 1
+            if counts[first] == 0:
+                del counts[first]
+            left += 1
+
+    return min_window
+
+
 class Search:
     # set index name
-    def __init__(self, index_name):
-        self.index_name = index_name
+    def __init__(self, index_name, profiler=None, cache_bytes=None):
+        # the current generation of an index built with generations (leased
+        # while this process runs, see index_generations)
+        self.index_name = index_generations.resolve(index_name, lease=True)
+        # per-query tracing (no-op unless a profiler is supplied)
+        self.profiler = profiler or query_profile.NullProfiler()
+        self.terms = None
+        # reader of a unified index (loaded on first use)
+        self.unified = None
+        # pair index for exact match queries (loaded on first use)
+        self.pairs = None
+        self.pairs_loaded = False
+        # decoded frequencies and positions of each term, shared by all queries
+        # of this Search (without it every query reads the index again)
+        self.cache = None
+        if cache_bytes:
+            self.cache = postings_cache.PostingsCache(self.read_term, cache_bytes)
+        # offset of every term in the positional index (read on first use)
+        self.offsets = None
+        # date, CR categories and citation links of the documents (read on first use)
+        self.metadata = None
+        # sorted ids of every document, the universe of NOT (built on first use)
+        self.universe = None
 
     # fetch documents that are relevant to the query
-    def fetch_relevant(self, query):
+    # (if doc_ids is given, only the postings of those documents are decoded)
+    def fetch_relevant(self, query, doc_ids=None, with_positions=True):
+        if self.cache:
+            return self.fetch_cached(query, doc_ids, with_positions)
+        if unified_index.is_unified(self.index_name):
+            return self.fetch_unified(query, doc_ids, with_positions)
+
         term_docs = {}
         tf = {}
         df = {}
@@ -34,7 +142,9 @@ class Search:
 
         with open('./{}/index.txt'.format(self.index_name), 'rb') as f:
             # iterate over all words
+            decoded = 0
             for line in f.readlines():
+                decoded += len(line)
                 line = line.decode('utf-8')
                 term, rest = line.split('=>')
 
@@ -43,30 +153,193 @@ class Search:
 
                 tf[term] = {}
                 term_docs[term] = {}
-                df[term] = 0
+                # the line starts with the df: term=>df;{[doc;tf;(gaps)]...}
+                df[term] = int(rest[:rest.index(';')])
+
+                # store index (only the postings of doc_ids if given, the
+                # others are skipped before they are decoded)
+                for (doc_id, count, indices) in phrase_index.split_postings(rest, doc_ids):
+                    tf[term][doc_id] = int(count)
 
-                # extract corresponding fields using regex
-                r = re.compile(r'\[([\w\,\-\.]+);(\d+);\(([\d\,]*)\)\]')
+                    if not with_positions:
+                        term_docs[term][doc_id] = None
+                        continue
 
-                # store index
-                for (doc_id, count, indices) in re.findall(r, rest):
                     compressed = [int(i) for i in indices.split(',')]
                     # expand to normal positional indices
                     for i in range(1, len(compressed)):
                         compressed[i] += compressed[i-1]
 
                     term_docs[term][doc_id] = compressed
-                    tf[term][doc_id] = int(count)
-                    df[term] += 1
+
+                self.profiler.count('postings_scanned', df[term])
 
                 # if all relevant indexing have been fetched, break
                 if len(term_docs) == len(query):
                     break
 
+        self.profiler.count('bytes_decoded', decoded)
+
+        self.term_docs = term_docs
+        self.tf = tf
+        self.df = df
+
+    # fetch documents from a unified index. Frequencies come from the postings
+    # stream; positions are decoded only if with_positions is set (otherwise
+    # term_docs maps each document to None)
+    def fetch_unified(self, query, doc_ids=None, with_positions=True):
+        unified = self.unified_reader()
+        self.N = unified.stats['num_docs']
+
+        term_docs = {}
+        tf = {}
+        df = {}
+        for term in query:
+            if term not in unified.index or term in tf:
+                continue
+            tf[term] = unified.index[term]
+            df[term] = len(tf[term])
+            self.profiler.count('postings_scanned', df[term])
+
+            if with_positions:
+                term_docs[term] = unified.positions(term, doc_ids)
+                self.profiler.count('positions_decoded', len(term_docs[term]))
+            else:
+                term_docs[term] = dict.fromkeys(tf[term])
+
         self.term_docs = term_docs
         self.tf = tf
         self.df = df
 
+    # fetch documents through the postings cache (positions of a term are
+    # decoded for all its documents, once, and filtered to doc_ids)
+    def fetch_cached(self, query, doc_ids=None, with_positions=True):
+        if unified_index.is_unified(self.index_name):
+            self.N = self.unified_reader().stats['num_docs']
+        else:
+            with open('./{}/meta.txt'.format(self.index_name), 'r') as f:
+                self.N = int(f.read().split(':')[-1])
+
+        term_docs = {}
+        tf = {}
+        df = {}
+        for term in query:
+            if term in tf:
+                continue
+            entry = self.cache.get(term)
+            if entry is None:
+                continue
+            tf[term], positions = entry
+            df[term] = len(tf[term])
+            self.profiler.count('postings_scanned', df[term])
+
+            if not with_positions:
+                term_docs[term] = dict.fromkeys(tf[term])
+            elif doc_ids is None:
+                term_docs[term] = positions
+            else:
+                term_docs[term] = {d: p for d, p in positions.items() if d in doc_ids}
+
+        self.term_docs = term_docs
+        self.tf = tf
+        self.df = df
+
+    # reader of a unified index (loaded on first use)
+    def unified_reader(self):
+        if self.unified is None:
+            self.unified = unified_index.UnifiedIndex(self.index_name)
+        return self.unified
+
+    # decode ({doc_id: tf}, {doc_id: positions}) of a term, or None if the
+    # term is not in the index (loader of the postings cache)
+    def read_term(self, term):
+        if unified_index.is_unified(self.index_name):
+            unified = self.unified_reader()
+            if term not in unified.index:
+                return None
+            positions = unified.positions(term)
+        else:
+            path = './{}/index.txt'.format(self.index_name)
+            if self.offsets is None:
+                self.offsets = postings_cache.line_offsets(path, b'=>')
+            if term not in self.offsets:
+                return None
+            line = postings_cache.read_line(path, self.offsets[term])
+            self.profiler.count('bytes_decoded', len(line))
+            positions = phrase_index.decode_postings(line.split('=>', 1)[1])
+
+        self.profiler.count('positions_decoded', len(positions))
+        return {d: len(p) for d, p in positions.items()}, positions
+
+    # pair index of the index (None if it has none)
+    def phrase_index(self):
+        if not self.pairs_loaded:
+            self.pairs = phrase_index.load_phrase_index(self.index_name)
+            self.pairs_loaded = True
+        return self.pairs
+
+    # Split a phrase into units (key, offset, is_pair) covering every query
+    # position: indexed pairs where possible, single terms otherwise
+    def phrase_units(self, query):
+        pairs = self.phrase_index()
+        units = []
+        i = 0
+        while i < len(query):
+            if pairs and i + 1 < len(query) and phrase_index.pair_key(query[i], query[i+1]) in pairs:
+                units.append((phrase_index.pair_key(query[i], query[i+1]), i, True))
+                i += 2
+                continue
+            # a last term can still be covered by a pair overlapping the previous one
+            if pairs and i > 0 and phrase_index.pair_key(query[i-1], query[i]) in pairs:
+                units.append((phrase_index.pair_key(query[i-1], query[i]), i-1, True))
+            else:
+                units.append((query[i], i, False))
+            i += 1
+        self.profiler.count('pair_units', sum(1 for u in units if u[2]))
+        return units
+
+    # fetch the postings of a phrase query. Pairs are read from the pair index;
+    # positions of single term units are only decoded for the documents that
+    # contain every pair. tf / df of all query terms are fetched for ranking.
+    def fetch_phrase(self, query, units, doc_ids=None):
+        pair_docs = {}
+        for key, _, is_pair in units:
+            if not is_pair or key in pair_docs:
+                continue
+            pair_docs[key] = self.phrase_index().positions(key, doc_ids)
+            self.profiler.count('pair_postings_scanned', len(pair_docs[key]))
+            doc_ids = set(pair_docs[key]) if doc_ids is None else doc_ids.intersection(pair_docs[key])
+
+        with_positions = not all(is_pair for _, _, is_pair in units)
+        self.fetch_relevant(query, doc_ids, with_positions)
+        self.term_docs.update(pair_docs)
+
+    # Documents containing the exact phrase: every unit occurs at its offset
+    # from a common start position
+    def phrase_match(self, query, units):
+        docs = [set(self.term_docs.get(key, {})) for key, _, _ in units]
+
+        try:
+            doc_set = docs[0].intersection(*docs[1:])
+        except IndexError:
+            doc_set = set()
+
+        result = []
+        for doc_id in doc_set:
+            starts = None
+            for key, offset, _ in units:
+                unit_starts = {p - offset for p in self.term_docs[key][doc_id]}
+                starts = unit_starts if starts is None else starts & unit_starts
+                if not starts:
+                    break
+            if starts:
+                result.append({'doc_id': doc_id})
+
+        if not result:
+            print('No documents contain \"{}\"'.format(' '.join(query)))
+
+        return result
+
     # This algorithm does not account for repeating words in the query
 
     # The algorithm aims at efficiency. It finds the smallest size window that
@@ -90,48 +363,11 @@ class Search:
         # Object to be returned
         result = []
 
-        # Consider the query "a likes b"
-        # "b" should be preceded by "likes"
-        # "likes" should be preceded by "a"
-        # We first generate this mapping
-        query_map = {}
-
-        for i in range(1, len(query)):
-            query_map[query[i]] = query[i-1]
-
         # iterate over valid documents
         for doc_id in doc_set:
             
             # Smallest window in which all words exist (with order preserved)
-            min_window = float('inf')
-
-            # This stores the most recent start index for a term
-            mr_start_idx = {}
-            cur_doc = []
-
-            # Merge the word lists
-            for k in query:
-                cur_doc.extend([(k, pos_index) for pos_index in term_docs[k][doc_id]])
-            
-            # O(n log(n)) to sort the words to as it would in the document
-            cur_doc.sort(key = lambda x: x[1])
-
-            # Backbone of the algorithm. O(n) loop
-            for term, idx in cur_doc:
-
-                # Fetch the previous required word
-                previous_query_term = query_map.get(term)
-
-                # Only the first word has no mapping
-                if previous_query_term == None:
-                    mr_start_idx[term] = idx
-                else:
-                    mr_start_idx[term] = mr_start_idx.get(previous_query_term, -1)
-
-                # Check if the last word of the query was read, and it was assigned a value
-                # besides -1. Then a new sequence has been found.
-                if term == query[-1] and mr_start_idx[term] != -1:
-                    min_window = min(min_window, idx - mr_start_idx[term])
+            min_window = ordered_window(query, {k: term_docs[k][doc_id] for k in query})
             
             # If no limit was given, just add document to result
             # Otherwise add only if min_window <= window_size
@@ -143,6 +379,16 @@ class Search:
 
         return result
 
+    # Length of the smallest span of a document that contains every query term
+    # occurring in it (in any order). Returns None if fewer than two distinct
+    # query terms occur in the document.
+    def min_cover_window(self, query, doc_id):
+        terms = [t for t in set(query) if doc_id in self.term_docs.get(t, {})]
+        if len(terms) < 2:
+            return None
+
+        return cover_window({t: self.term_docs[t][doc_id] for t in terms})
+
     # Return all documents that contain even one of the words
     def best_match(self, query):
         # fetch all relevant documents
@@ -157,56 +403,165 @@ class Search:
 
         return [{'doc_id': d} for d in doc_set]
 
-    def match(self, query_full, matching_mode, window = -1, max_docs = 100):
-        # Tokenize the query
-        query = nltk.regexp_tokenize(query_full, r'(?x)\d[\d.,]*\d|\w[\w-]*\w')
-        query = [x.lower() for x in query]
-        
-        self.fetch_relevant(query)
-
-        if matching_mode == 'EM':
-            docs = self.ordered_best_match(query)
-        if matching_mode == 'BM':
-            docs = self.best_match(query)
-        if matching_mode == 'OBM':
-            docs = self.ordered_best_match(query, window)
-
-        prio_q = []
-        # Now that all the documents have been retrieved, rank according to tf-idf
-        # The documents are sorted by best scores. Documents with equal scores are sorted by minimum window length.
-        for cur in docs:
-            d = cur['doc_id']
-            score = 0
-            for q in query:
-                cur_df = self.df.get(q, 0)
-                if cur_df == 0:
-                    continue
-                score += TFIDF_Score(self.tf.get(q, {}).get(d, 0), cur_df, self.N)
+    # Return the documents that satisfy a boolean (AND / OR / NOT) operator tree
+    def boolean_match(self, tree):
+        stats = boolean_query.Stats()
+        postings = lambda term: sorted(self.term_docs.get(term, {}))
+        doc_set = boolean_query.evaluate(tree, postings, stats, self.all_doc_ids)
+        self.profiler.count('postings_touched', stats.touched)
 
-            # heapq implements min-heap by default
-            heapq.heappush(prio_q, (-score, cur.get('window', -1), d))
-        
-        resultant = []
-        for _ in range(max_docs):
-            if not prio_q:
-                break
-            resultant.append(heapq.heappop(prio_q))
-        resultant = [(d, -score) if w == -1 else (d, -score, w) for score, w, d in resultant]
+        return [{'doc_id': d} for d in doc_set]
 
-        return resultant
+    # Tokenize text the same way the positional index was built
+    # (trailing wildcards such as comput* are expanded to the matching terms)
+    def tokenize(self, text):
+        wildcards = re.findall(term_dictionary.WILDCARD_REGEX, text)
+        text = re.sub(term_dictionary.WILDCARD_REGEX, ' ', text)
+
+        tokens = nltk.regexp_tokenize(text, r'(?x)\d[\d.,]*\d|\w[\w-]*\w')
+        tokens = [x.lower() for x in tokens]
+
+        for w in wildcards:
+            tokens.extend(self.expand(w))
+        return tokens
+
+    # sorted term dictionary of the index (written on first use if missing)
+    def term_dictionary(self):
+        if self.terms is None:
+            path = term_dictionary.term_dictionary_path(self.index_name)
+            self.terms = term_dictionary.load_term_dictionary(path, self.vocabulary)
+        return self.terms
+
+    # all terms of the positional index
+    def vocabulary(self):
+        if unified_index.is_unified(self.index_name):
+            return list(self.unified_reader().index)
+        with open('./{}/index.txt'.format(self.index_name), 'rb') as f:
+            return [line.split(b'=>', 1)[0].decode('utf-8') for line in f if line.strip()]
+
+    # terms matching a trailing wildcard pattern such as comput*
+    def expand(self, pattern):
+        terms = term_dictionary.expand_wildcard(self.term_dictionary(), pattern.lower())
+        self.profiler.count('expanded_terms', len(terms))
+        return terms
+
+    # ranked matches of a query: (doc_id, score) or (doc_id, score, window)
+    # (the max_docs matches after cursor if given, see result_pages; only docs
+    # passing the doc_filter expression if given, see doc_metadata)
+    def match(self, query_full, matching_mode, window = -1, max_docs = 100, cursor = None, doc_filter = None):
+        profiler = self.profiler
+        with profiler.query(query_full, mode=matching_mode):
+            # Tokenize the query
+            with profiler.stage('tokenize'):
+                if matching_mode == 'BOOL':
+                    tree = boolean_query.analyze_tree(boolean_query.parse(query_full), self.tokenize, self.expand)
+                    if tree is None:
+                        return []
+                    # only the terms outside of NOT are used for ranking
+                    query = boolean_query.positive_terms(tree)
+                else:
+                    # phrase modes need every query position to be a single term
+                    if matching_mode in ('EM', 'OBM') and re.search(term_dictionary.WILDCARD_REGEX, query_full):
+                        raise ValueError('Wildcards are only supported in BM and BOOL modes')
+                    query = self.tokenize(query_full)
+                    if matching_mode == 'EM':
+                        units = self.phrase_units(query)
+            
+            # positions are only decoded for the docs passing the filter
+            allowed = self.filter_docs(doc_filter) if doc_filter else None
+
+            # only the phrase modes need positions
+            with_positions = matching_mode in ('EM', 'OBM')
+            with profiler.stage('fetch'):
+                if matching_mode == 'BOOL':
+                    self.fetch_relevant(boolean_query.all_terms(tree), allowed, with_positions)
+                elif matching_mode == 'EM':
+                    self.fetch_phrase(query, units, allowed)
+                else:
+                    self.fetch_relevant(query, allowed, with_positions)
+
+            with profiler.stage('match'):
+                if matching_mode == 'EM':
+                    docs = self.phrase_match(query, units)
+                if matching_mode == 'BM':
+                    docs = self.best_match(query)
+                if matching_mode == 'OBM':
+                    docs = self.ordered_best_match(query, window)
+                if matching_mode == 'BOOL':
+                    docs = self.boolean_match(tree)
+                if allowed is not None:
+                    docs = [cur for cur in docs if cur['doc_id'] in allowed]
+            profiler.count('candidate_docs', len(docs))
+
+            ranked = []
+            # Now that all the documents have been retrieved, rank according to tf-idf
+            # The documents are sorted by best scores. Documents with equal scores are sorted by minimum window length.
+            with profiler.stage('score'):
+                for cur in docs:
+                    d = cur['doc_id']
+                    score = 0
+                    for q in query:
+                        cur_df = self.df.get(q, 0)
+                        if cur_df == 0:
+                            continue
+                        score += TFIDF_Score(self.tf.get(q, {}).get(d, 0), cur_df, self.N)
+
+                    # smallest sort keys first
+                    ranked.append((-score, cur.get('window', -1), d))
+            profiler.count('scored_pairs', len(docs) * len(self.df))
+            
+            with profiler.stage('select'):
+                resultant = result_pages.top(ranked, max_docs, cursor=cursor)
+                resultant = [(d, -score) if w == -1 else (d, -score, w) for score, w, d in resultant]
+
+            return resultant
+
+    # one page of matches and the cursor of the next page (None after the last)
+    def match_page(self, query_full, matching_mode, window = -1, page_size = 100, cursor = None, doc_filter = None):
+        resultant = self.match(query_full, matching_mode, window, page_size, cursor, doc_filter)
+        return resultant, result_pages.next_cursor(resultant, page_size, match_key, cursor)
+
+    # generate all matches of a query, computing one page at a time
+    def iter_matches(self, query_full, matching_mode, window = -1, page_size = 100, doc_filter = None):
+        return result_pages.stream(lambda cursor: self.match_page(query_full, matching_mode, window, page_size, cursor, doc_filter))
+
+    # ids of the docs passing a filter expression such as "date:1970..1975 cat:4.2"
+    def filter_docs(self, doc_filter):
+        with self.profiler.stage('filter'):
+            return self.doc_metadata().filter(doc_filter)
+
+    # metadata columns of the documents (loaded on first use, see doc_metadata)
+    def doc_metadata(self):
+        if self.metadata is None:
+            self.metadata = doc_metadata.load_metadata(self.index_name)
+        return self.metadata
+
+    # sorted ids of every document in the collection (a query such as
+    # "NOT computer" matches the docs missing from the postings of computer)
+    def all_doc_ids(self):
+        if self.universe is None:
+            self.universe = sorted(self.doc_metadata().doc_ids)
+        return self.universe
 
 def main():
     parser = argparse.ArgumentParser(description='Advanced search', formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('mode', help='Search mode (\'EM\', \'BM\', \'OBM\')')
+    parser.add_argument('mode', help='Search mode (\'EM\', \'BM\', \'OBM\', \'BOOL\')')
     parser.add_argument('query', help='Query')
     parser.add_argument('-index', default='positional', help='Name of index (default: \"%(default)s\")')
     parser.add_argument('-window', default=-1, type=int, help='Window size (for ordered best match)')
     parser.add_argument('-limit', default=100, type=int, help='Number of results')
+    parser.add_argument('-cursor', nargs='?', const='', help='Paginate: print the page of -limit results after this cursor (first page without one)\nand the cursor of the next page.')
+    parser.add_argument('-filter', help='Only return documents passing this metadata filter, e.g. \"date:1970..1975 cat:4.2\"\n(date range, CR category, citation link; see doc_metadata.py).')
+    parser.add_argument('-profile', nargs='?', const='profile_trace.jsonl', help='Write a JSON-lines trace per query to this file (default: \"%(const)s\")\nand print stage histograms at the end of the run.')
     args = parser.parse_args()
-    s = Search(args.index)
-    resultant = s.match(args.query, args.mode, args.window, args.limit)
+    profiler = query_profile.get_profiler(args.profile)
+    s = Search(args.index, profiler)
+    resultant, next_cursor = s.match_page(args.query, args.mode, args.window, args.limit, args.cursor or None, args.filter)
     for r in resultant:
         print(" ".join([str(x) for x in r]))
+    if args.cursor is not None:
+        print('next cursor: {}'.format(next_cursor))
+    profiler.report()
 
 
     
@@ -7,6 +7,14 @@ from bs4 import BeautifulSoup
 import sys
 import nltk
 import argparse
+import spelling
+import term_dictionary
+import stem_cache
+import postings_codec
+import doc_reorder
+import doc_metadata
+import citation_prior
+import index_generations
 
 class Indexer:
 	def create_index(self, output_file_name):
@@ -17,65 +25,91 @@ class Indexer:
 		for doc_id in self.doc_ids:
 			sys.stdout.write('.')
 			sys.stdout.flush()
-			# Process the HTML file
-			with open('{}/{}.html'.format(self.html_dir, doc_id), 'rb') as file:
-				raw_html = file.read()
 
-			# Extract main content using BeautifulSoup
-			# (No extra content filtering needed for CACM files)
-			soup = BeautifulSoup(raw_html, 'html.parser')
-			content = soup.pre
+			page_text = self.read_text(doc_id)
 
-			# Extract the raw text from the filtered content
-			page_text = content.get_text()
+			# The trailing block (date, CR categories, citations) is kept as metadata
+			self.metadata[doc_id] = doc_metadata.parse_tail(page_text, doc_id)
 
-			# Transform text and get tokens based on settings
-			page_text = self.case_handler(page_text)
+			self.add_document(doc_id, self.tokenize(page_text))
 
-			tokens = self.get_tokens(page_text)
+		self.write_index(output_file_name)
 
+	# Parse a CACM HTML file and get its tokens based on settings
+	def read_tokens(self, doc_id):
+		return self.tokenize(self.read_text(doc_id))
 
-			# Parse tokens to create index
-			# (For unigram implementation, each token is a term)
-			# The tokens are read from the end to facilitate ignoring numers towards the end
-			word_occured = False
+	# Get the raw text of a CACM HTML file
+	def read_text(self, doc_id):
+		# Process the HTML file
+		with open('{}/{}.html'.format(self.html_dir, doc_id), 'rb') as file:
+			raw_html = file.read()
 
-			for term in reversed(tokens):
-				# Make sure all tokens are represented as strings
-				term = str(term)
+		# Extract main content using BeautifulSoup
+		# (No extra content filtering needed for CACM files)
+		soup = BeautifulSoup(raw_html, 'html.parser')
+		content = soup.pre
 
-				# Check if a word has been reached while traversing from the end of the document
-				# continue if not
-				try:
-					int(term)
-				except ValueError:
-					word_occured = True
+		# Extract the raw text from the filtered content
+		return content.get_text()
 
-				if not word_occured:
-					continue
+	# Transform text and get tokens based on settings
+	def tokenize(self, page_text):
+		page_text = self.case_handler(page_text)
 
-				# skip processing the token if it exists in the stopword list
-				if term in self.stopwords:
-					continue
+		return self.get_tokens(page_text)
 
+	# Add the tokens of a document to the index
+	# (stats['num_docs'] must be set before documents are added)
+	def add_document(self, doc_id, tokens):
 
-				# Increment counters (this ensures discounting of stopwords in statistics)
-				self.stats['corpus_len'] += 1
-				self.stats['doc_lengths'][doc_id] = self.stats['doc_lengths'].get(doc_id, 0) + 1
+		# Parse tokens to create index
+		# (For unigram implementation, each token is a term)
+		# The tokens are read from the end to facilitate ignoring numers towards the end
+		word_occured = False
 
-				
-				# Update the index as necessary
-				if not term in self.index:
-					self.index[term] = {}
+		for term in reversed(tokens):
+			# Make sure all tokens are represented as strings
+			term = str(term)
 
-				posting_list = self.index[term]
-				posting_list[doc_id] = posting_list.get(doc_id, 0) + 1
+			# Check if a word has been reached while traversing from the end of the document
+			# continue if not
+			try:
+				int(term)
+			except ValueError:
+				word_occured = True
 
-			C = self.stats['corpus_len']
-			N = self.stats['num_docs']
+			if not word_occured:
+				continue
 
-			self.stats['avdl'] = C/N
+			# skip processing the token if it exists in the stopword list
+			if term in self.stopwords:
+				continue
 
+			# reduce the token to its stem (surface forms are stemmed once, see stem_cache)
+			if self.stemmer:
+				term = self.stemmer.stem(term)
+
+
+			# Increment counters (this ensures discounting of stopwords in statistics)
+			self.stats['corpus_len'] += 1
+			self.stats['doc_lengths'][doc_id] = self.stats['doc_lengths'].get(doc_id, 0) + 1
+
+			
+			# Update the index as necessary
+			if not term in self.index:
+				self.index[term] = {}
+
+			posting_list = self.index[term]
+			posting_list[doc_id] = posting_list.get(doc_id, 0) + 1
+
+		C = self.stats['corpus_len']
+		N = self.stats['num_docs']
+
+		self.stats['avdl'] = C/N
+
+	# Write the index, stats and auxiliary files
+	def write_index(self, output_file_name):
 		with open('{}.txt'.format(output_file_name), 'w') as index_file:
 			for t, d in self.index.items():
 				index_file.write(t + ': ' + str(len(d)) + ', ')
@@ -85,10 +119,37 @@ class Indexer:
 		with open("{}_stats.txt".format(output_file_name), 'w') as stats_file:
 			stats_file.write(str(self.stats))
 
-	def __init__(self, html_dir, case_folding, handle_punctuation, stopped):
+		if self.stemmer:
+			self.stemmer.save()
+
+		# Write the character n-gram index over the vocabulary (for spelling correction)
+		grams = spelling.build_ngram_index(self.index.keys())
+		spelling.write_ngram_index(grams, spelling.ngram_index_path(output_file_name))
+
+		# Write the sorted, front-coded term dictionary (for prefix and wildcard queries)
+		term_dictionary.write_term_dictionary(self.index.keys(), term_dictionary.term_dictionary_path(output_file_name))
+
+		# Write the metadata of the documents (for filtered search), and the
+		# citation graph with its static priors
+		if self.metadata:
+			doc_metadata.write_metadata(self.metadata, doc_metadata.metadata_path(output_file_name))
+			citation_prior.write_prior(self.metadata, output_file_name)
+
+		# Write a compressed copy of the postings with the chosen codec
+		# (docs numbered by content similarity if reordering is enabled)
+		if self.codec:
+			docs = doc_reorder.bisection_order(self.index) if self.reorder else None
+			postings_codec.write_codec_index(postings_codec.codec_index_path(output_file_name), self.codec, self.index, docs=docs)
+
+	def __init__(self, html_dir, case_folding, handle_punctuation, stopped, stemmed=False, codec=None, reorder=False):
 
 		self.html_dir = html_dir
 
+		# postings codec of the compressed copy of the index (none if not set)
+		self.codec = codec
+		# reassign the doc numbers of the compressed copy (see doc_reorder)
+		self.reorder = reorder
+
 		# Pull all the file names (docID) from the HTML directory into a list
 		self.doc_ids = [f.split('.')[0] for f in listdir(html_dir) if f]
 
@@ -112,9 +173,17 @@ class Indexer:
 			with open('test-collection/common_words') as f:
 				self.stopwords = set(list(f.read().split('\n')))
 
+		self.stemmer = None
+		# If stemming is enabled, stem tokens through the persistent stem cache
+		if stemmed:
+			self.stemmer = stem_cache.StemCache()
+
 		# Initialize index objects
 		self.index = {}
 
+		# Date, CR categories and citation links of each document (see doc_metadata)
+		self.metadata = {}
+
 		# Track the following stats for retrieval models
 		# N : Total number of documents
 		# dl : Length (# tokens) of each document
@@ -127,7 +196,8 @@ class Indexer:
 			'doc_lengths': {},
 			'case_folding': case_folding,
 			'handle_punctuation': handle_punctuation,
-			'stopped': stopped
+			'stopped': stopped,
+			'stemmed': stemmed
 			}
 
 
@@ -139,11 +209,20 @@ def main():
 	parser.add_argument("-disable_fc", action='store_true', help="Disable fold cases.")
 	parser.add_argument("-disable_hp", action='store_true', help="Disable handle punctuations.")
 	parser.add_argument("-stopped", action='store_true', help="Stopping.")
+	parser.add_argument("-stemmed", action='store_true', help="Stemming (Porter, with a persistent stem cache).")
+	parser.add_argument("-generation", action='store_true', help="Write a new generation of the index and publish it atomically\n(see index_generations.py) instead of overwriting it in place.")
+	parser.add_argument("-codec", choices=sorted(postings_codec.CODECS), help="Also write the postings compressed with this codec ([output_name]_codec.txt / .bin).")
+	parser.add_argument("-reorder", action='store_true', help="Number the docs of the compressed copy by content similarity\n(recursive graph bisection, see doc_reorder.py).")
 	args = parser.parse_args()
 	print("args:", args)
 
-	idxr = Indexer(args.input_folder, not args.disable_fc, not args.disable_hp, args.stopped)
-	idxr.create_index(args.output_name)
+	idxr = Indexer(args.input_folder, not args.disable_fc, not args.disable_hp, args.stopped, args.stemmed, args.codec, args.reorder)
+	if args.generation:
+		path = index_generations.stage(args.output_name)
+		idxr.create_index(path)
+		print('\npublished generation', index_generations.publish(args.output_name, path))
+	else:
+		idxr.create_index(args.output_name)
 
 
 if __name__ == "__main__":
@@ -23,14 +23,18 @@ k2 = 100
 b = 0.75
 
 # Check number of arguments
-if len(sys.argv) != 2:
+if len(sys.argv) not in (2, 5):
     print('To use this program:')
-    print('\tpython3 baseline_search_BM25.py [query_file]')
+    print('\tpython3 baseline_search_BM25.py [query_file] [k1 k2 b (optional)]')
     exit(1)
 
 # Parse query string from command line
 query_file_loc = str(sys.argv[1])
 
+# Override the retrieval parameters if given
+if len(sys.argv) == 5:
+    k1, k2, b = (float(x) for x in sys.argv[2:5])
+
 
 # Calculate the BM25 score of a doc for a single query term
 def BM25_Score(qf, f, n, N, dl, avdl):
@@ -21,14 +21,18 @@ handle_punctuation = True
 A = 0.35
 
 # Check number of arguments
-if len(sys.argv) != 2:
+if len(sys.argv) not in (2, 3):
     print('To use this program:')
-    print('\tpython3 baseline_search_JM.py [query_file]')
+    print('\tpython3 baseline_search_JM.py [query_file] [lambda (optional)]')
     exit(1)
 
 # Parse query string from command line
 query_file_loc = str(sys.argv[1])
 
+# Override the smoothing parameter if given
+if len(sys.argv) == 3:
+    A = float(sys.argv[2])
+
 
 # Calculate the JM score of a doc for a single query term
 def JM_Score(fqd, cq, D, C):
@@ -0,0 +1,289 @@
+import re
+from bisect import bisect_left
+
+# Boolean query language
+#
+#   expr   := and_expr (OR and_expr)*
+#   and_expr := unary ([AND] unary)*      (adjacent terms are AND-ed)
+#   unary  := NOT unary | '(' expr ')' | term
+#
+# Operators must be written in upper case, so "and"/"or"/"not" in lower case
+# are ordinary terms. The query is parsed into a tree of tuples:
+#   ('TERM', text), ('AND', [nodes]), ('OR', [nodes]), ('NOT', node)
+
+OPERATORS = ['AND', 'OR', 'NOT']
+
+
+# split a raw query into parentheses, operators and terms
+def lex(query):
+    return re.findall(r'\(|\)|[^\s()]+', query)
+
+
+# parse a raw boolean query into an operator tree
+def parse(query):
+    tokens = lex(query)
+    if not tokens:
+        raise ValueError('Empty boolean query')
+    pos, node = parse_or(tokens, 0)
+    if pos != len(tokens):
+        raise ValueError('Unexpected "{}" in boolean query'.format(tokens[pos]))
+    return node
+
+
+def parse_or(tokens, pos):
+    pos, node = parse_and(tokens, pos)
+    children = [node]
+    while pos < len(tokens) and tokens[pos] == 'OR':
+        pos, node = parse_and(tokens, pos + 1)
+        children.append(node)
+    return pos, children[0] if len(children) == 1 else ('OR', children)
+
+
+def parse_and(tokens, pos):
+    pos, node = parse_unary(tokens, pos)
+    children = [node]
+    while pos < len(tokens) and tokens[pos] not in ('OR', ')'):
+        if tokens[pos] == 'AND':
+            pos += 1
+        pos, node = parse_unary(tokens, pos)
+        children.append(node)
+    return pos, children[0] if len(children) == 1 else ('AND', children)
+
+
+def parse_unary(tokens, pos):
+    if pos >= len(tokens):
+        raise ValueError('Boolean query ends unexpectedly')
+    token = tokens[pos]
+    if token == 'NOT':
+        pos, node = parse_unary(tokens, pos + 1)
+        return pos, ('NOT', node)
+    if token == '(':
+        pos, node = parse_or(tokens, pos + 1)
+        if pos >= len(tokens) or tokens[pos] != ')':
+            raise ValueError('Missing ")" in boolean query')
+        return pos + 1, node
+    if token in OPERATORS or token == ')':
+        raise ValueError('Unexpected "{}" in boolean query'.format(token))
+    return pos + 1, ('TERM', token)
+
+
+# rewrite the raw term leaves with analyze(text) -> list of index terms
+# (case folding, tokenizing, stopping). A leaf that yields several terms
+# becomes their conjunction, a leaf that yields none is removed.
+# If expand(pattern) is given, a leaf with a trailing wildcard (comput*)
+# becomes the disjunction of the terms it expands to.
+def analyze_tree(node, analyze, expand=None):
+    kind = node[0]
+    if kind == 'TERM' and expand and node[1].endswith('*'):
+        terms = expand(node[1])
+        if not terms:
+            # nothing matches the pattern
+            return ('TERM', node[1])
+        if len(terms) == 1:
+            return ('TERM', terms[0])
+        return ('OR', [('TERM', t) for t in terms])
+    if kind == 'TERM':
+        terms = analyze(node[1])
+        if not terms:
+            return None
+        if len(terms) == 1:
+            return ('TERM', terms[0])
+        return ('AND', [('TERM', t) for t in terms])
+    if kind == 'NOT':
+        child = analyze_tree(node[1], analyze, expand)
+        return ('NOT', child) if child else None
+
+    children = [c for c in (analyze_tree(c, analyze, expand) for c in node[1]) if c]
+    if not children:
+        return None
+    return children[0] if len(children) == 1 else (kind, children)
+
+
+# terms that contribute to ranking (every term that is not under a NOT)
+def positive_terms(node):
+    kind = node[0]
+    if kind == 'TERM':
+        return [node[1]]
+    if kind == 'NOT':
+        return []
+    terms = []
+    for c in node[1]:
+        for t in positive_terms(c):
+            if t not in terms:
+                terms.append(t)
+    return terms
+
+
+# every term of the tree, including the excluded ones
+def all_terms(node):
+    if node[0] == 'TERM':
+        return [node[1]]
+    if node[0] == 'NOT':
+        return all_terms(node[1])
+    terms = []
+    for c in node[1]:
+        for t in all_terms(c):
+            if t not in terms:
+                terms.append(t)
+    return terms
+
+
+# Counts the postings actually visited while evaluating a tree
+class Stats:
+    def __init__(self):
+        self.touched = 0
+
+
+# Iterator over a sorted list of doc ids with skipping
+class PostingsIterator:
+    def __init__(self, docs, stats):
+        self.docs = docs
+        self.stats = stats
+        self.pos = 0
+        if docs:
+            stats.touched += 1
+
+    def doc(self):
+        return self.docs[self.pos] if self.pos < len(self.docs) else None
+
+    def cost(self):
+        return len(self.docs)
+
+    def next(self):
+        self.pos += 1
+        if self.pos < len(self.docs):
+            self.stats.touched += 1
+        return self.doc()
+
+    # move to the first doc >= target (galloping search then binary search)
+    def advance(self, target):
+        docs = self.docs
+        if self.pos >= len(docs) or docs[self.pos] >= target:
+            return self.doc()
+        step = 1
+        hi = self.pos + 1
+        while hi < len(docs) and docs[hi] < target:
+            self.stats.touched += 1
+            self.pos = hi
+            step *= 2
+            hi = self.pos + step
+        self.pos = bisect_left(docs, target, self.pos, min(hi, len(docs)))
+        if self.pos < len(docs):
+            self.stats.touched += 1
+        return self.doc()
+
+
+# Conjunction of iterators, minus the docs of the excluded iterators.
+# Children are evaluated rarest first: the rarest list leads and the
+# others skip forward to its candidates.
+class AndIterator:
+    def __init__(self, positives, negatives):
+        self.positives = sorted(positives, key=lambda x: x.cost())
+        self.negatives = negatives
+        self.current = None
+        self.align(self.positives[0].doc())
+
+    def doc(self):
+        return self.current
+
+    def cost(self):
+        return self.positives[0].cost()
+
+    def next(self):
+        if self.current is None:
+            return None
+        return self.align(self.positives[0].next())
+
+    def advance(self, target):
+        if self.current is None or self.current >= target:
+            return self.current
+        return self.align(self.positives[0].advance(target))
+
+    # find the next doc >= target present in every positive and no negative
+    def align(self, target):
+        lead = self.positives[0]
+        while target is not None:
+            for it in self.positives[1:]:
+                d = it.advance(target)
+                if d is None:
+                    target = None
+                    break
+                if d != target:
+                    target = lead.advance(d)
+                    break
+            else:
+                if any(n.advance(target) == target for n in self.negatives):
+                    target = lead.next()
+                    continue
+                break
+        self.current = target
+        return target
+
+
+# Disjunction of iterators
+class OrIterator:
+    def __init__(self, children):
+        self.children = children
+        self.current = self.smallest()
+
+    def smallest(self):
+        docs = [d for d in (c.doc() for c in self.children) if d is not None]
+        return min(docs) if docs else None
+
+    def doc(self):
+        return self.current
+
+    def cost(self):
+        return sum(c.cost() for c in self.children)
+
+    def next(self):
+        if self.current is None:
+            return None
+        for c in self.children:
+            if c.doc() == self.current:
+                c.next()
+        self.current = self.smallest()
+        return self.current
+
+    def advance(self, target):
+        if self.current is None or self.current >= target:
+            return self.current
+        for c in self.children:
+            c.advance(target)
+        self.current = self.smallest()
+        return self.current
+
+
+# Compile a tree into an iterator. postings(term) returns the sorted doc ids
+# of a term, universe() the sorted ids of all docs (only needed when a NOT
+# is not combined with any positive term).
+def compile_tree(node, postings, stats, universe=None):
+    kind = node[0]
+    if kind == 'TERM':
+        return PostingsIterator(postings(node[1]), stats)
+    if kind == 'OR':
+        return OrIterator([compile_tree(c, postings, stats, universe) for c in node[1]])
+
+    if kind == 'NOT':
+        children = [node]
+    else:
+        children = node[1]
+
+    positives = [compile_tree(c, postings, stats, universe) for c in children if c[0] != 'NOT']
+    negatives = [compile_tree(c[1], postings, stats, universe) for c in children if c[0] == 'NOT']
+    if not positives:
+        if universe is None:
+            raise ValueError('NOT must be combined with a positive term')
+        positives = [PostingsIterator(universe(), stats)]
+    return AndIterator(positives, negatives)
+
+
+# Evaluate a tree and return the sorted list of matching doc ids
+def evaluate(node, postings, stats, universe=None):
+    it = compile_tree(node, postings, stats, universe)
+    result = []
+    d = it.doc()
+    while d is not None:
+        result.append(d)
+        d = it.next()
+    return result
@@ -0,0 +1,158 @@
+import os
+import math
+import argparse
+import numpy as np
+import doc_metadata
+
+# Citation graph prior
+#
+# The citation data of the CACM documents (see doc_metadata) lists every direct
+# citation as a type 5 link in both documents, without its direction; the
+# later document (by publication date, then doc id) is taken to cite the
+# earlier one. The graph is stored in CSR form over the sorted doc ids
+# ([index]_graph.npz or [index]/graph.npz):
+#
+#   indptr[i]:indptr[i+1]   rows of indices holding the docs cited by doc i
+#
+# From it a query independent score of every document is computed once, at
+# index time, with vectorized power iteration, and written to [index]_prior.txt
+# (or [index]/prior.txt):
+#
+#   doc_id<TAB>pagerank<TAB>indegree
+#
+# index_search adds weight * log(N * p(d)) to the score of every candidate
+# (a document prior; p is the PageRank, or the add-one smoothed in-degree
+# share). Its largest value is a static upper bound: candidates that cannot
+# reach the top k with it are dropped before their prior is looked up.
+
+# Link type of a direct citation in the CACM citation data
+CITATION_LINK = 5
+
+# PageRank damping factor
+DAMPING = 0.85
+
+PRIORS = ['pagerank', 'indegree']
+
+# Default weight of the prior in index_search
+PRIOR_WEIGHT = 0.5
+
+
+# path of the citation graph / prior of an index (positional and unified
+# indexes are folders)
+def graph_path(index_name):
+    if os.path.isdir(index_name):
+        return os.path.join(index_name, 'graph.npz')
+    return '{}_graph.npz'.format(index_name)
+
+def prior_path(index_name):
+    if os.path.isdir(index_name):
+        return os.path.join(index_name, 'prior.txt')
+    return '{}_prior.txt'.format(index_name)
+
+
+# sorted doc ids and the CSR (indptr, indices) citation graph of
+# {doc_id: metadata fields}
+def build_graph(metadata):
+    doc_ids = sorted(metadata)
+    rows = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+    order = lambda d: (metadata[d]['date'], d)
+
+    edges = set()
+    for doc_id, fields in metadata.items():
+        for other, link_type in fields['links']:
+            if link_type != CITATION_LINK or other not in rows:
+                continue
+            citing, cited = (doc_id, other) if order(doc_id) > order(other) else (other, doc_id)
+            edges.add((rows[citing], rows[cited]))
+
+    edges = np.array(sorted(edges), dtype=np.int64).reshape(-1, 2)
+    indptr = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edges[:, 0], minlength=len(doc_ids)), out=indptr[1:])
+    return doc_ids, indptr, edges[:, 1].copy()
+
+
+# PageRank of every node of a CSR graph (the rank of nodes without out links
+# is spread over all nodes)
+def pagerank(indptr, indices, damping = DAMPING, tol = 1e-10, max_iter = 100):
+    n = len(indptr) - 1
+    out_degree = np.diff(indptr)
+    sources = np.repeat(np.arange(n), out_degree)
+    dangling = out_degree == 0
+
+    rank = np.full(n, 1 / n)
+    for _ in range(max_iter):
+        share = np.where(dangling, 0, rank / np.maximum(out_degree, 1))
+        new_rank = np.bincount(indices, weights=share[sources], minlength=n)
+        new_rank = damping * (new_rank + rank[dangling].sum() / n) + (1 - damping) / n
+        done = np.abs(new_rank - rank).sum() < tol
+        rank = new_rank
+        if done:
+            break
+    return rank
+
+
+# number of citations of every node of a CSR graph
+def indegree(indptr, indices):
+    return np.bincount(indices, minlength=len(indptr) - 1)
+
+
+# build the graph of {doc_id: metadata fields} and write it with its priors
+def write_prior(metadata, index_name):
+    doc_ids, indptr, indices = build_graph(metadata)
+    np.savez(graph_path(index_name), doc_ids=np.array(doc_ids), indptr=indptr, indices=indices)
+
+    ranks = pagerank(indptr, indices)
+    degrees = indegree(indptr, indices)
+    with open(prior_path(index_name), 'w') as f:
+        for doc_id, rank, degree in zip(doc_ids, ranks, degrees):
+            f.write('{}\t{!r}\t{}\n'.format(doc_id, float(rank), int(degree)))
+
+
+# {doc_id: p(d)} of a prior, written first from the index metadata if the
+# index predates it
+def load_prior(index_name, method = 'pagerank'):
+    if method not in PRIORS:
+        raise ValueError('Unknown prior: {} ({})'.format(method, ', '.join(PRIORS)))
+
+    path = prior_path(index_name)
+    if not os.path.exists(path):
+        write_prior(doc_metadata.read_metadata(doc_metadata.ensure_metadata(index_name)), index_name)
+
+    ranks = {}
+    degrees = {}
+    with open(path, 'r') as f:
+        for l in f:
+            doc_id, rank, degree = l.rstrip('\n').split('\t')
+            ranks[doc_id] = float(rank)
+            degrees[doc_id] = int(degree)
+
+    if method == 'pagerank':
+        return ranks
+    # add-one smoothed share of the citations
+    total = sum(degrees.values()) + len(degrees)
+    return {doc_id: (degree + 1) / total for doc_id, degree in degrees.items()}
+
+
+# weight * log(N * p(d)) of every document (0 for a document without a prior,
+# i.e. one as likely as the average)
+def prior_scores(prior, doc_ids, weight):
+    N = len(prior)
+    return {doc_id: weight * math.log(N * prior[doc_id]) if doc_id in prior else 0 for doc_id in doc_ids}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Citation graph prior', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('index_name', help='Index the graph and prior are written for (e.g. index_stopped)')
+    parser.add_argument('-top', type=int, default=10, help='Print the documents with the highest prior (default: \"%(default)s\")')
+    parser.add_argument('-method', choices=PRIORS, default='pagerank', help='Prior to print (default: \"%(default)s\")')
+    args = parser.parse_args()
+    print("args:", args)
+
+    write_prior(doc_metadata.read_metadata(doc_metadata.ensure_metadata(args.index_name)), args.index_name)
+
+    prior = load_prior(args.index_name, args.method)
+    for doc_id in sorted(prior, key = lambda d: -prior[d])[:args.top]:
+        print('{} {:.6f}'.format(doc_id, prior[doc_id] * len(prior)))
+
+if __name__ == '__main__':
+    main()
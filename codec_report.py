@@ -0,0 +1,156 @@
+import os
+import re
+import time
+import argparse
+import nltk
+import numpy as np
+import index_pruning
+import phrase_index
+import unified_index
+import postings_codec
+import doc_reorder
+
+# Postings codec report
+#
+# Compresses existing indexes with every codec of postings_codec and compares
+# bytes per posting / position and decode throughput against the text index,
+# or writes the compressed copy of an index with one codec (without reindexing).
+# Every codec is reported twice: with docs numbered by name, and numbered by
+# content similarity (+bp, see doc_reorder), with the time to evaluate the
+# queries of a query log on each.
+
+# Default query log for the query timings
+QUERY_LOG = 'processed_queries.txt'
+
+
+# postings {term: {doc_id: tf}}, positions {term: {doc_id: [positions]}} (or None)
+# and the path of the text file they were read from
+def read_source(index_name):
+    if unified_index.is_unified(index_name):
+        unified = unified_index.UnifiedIndex(index_name)
+        positions = {term: unified.positions(term) for term in unified.index}
+        return unified_index.read_postings(index_name), positions, os.path.join(index_name, 'postings.txt')
+
+    if os.path.isdir(index_name):
+        index = {}
+        positions = {}
+        path = os.path.join(index_name, 'index.txt')
+        with open(path, 'rb') as f:
+            for line in f:
+                term, rest = line.decode('utf-8').rstrip('\n').split('=>', 1)
+                positions[term] = phrase_index.decode_postings(rest)
+                index[term] = {d: len(p) for d, p in positions[term].items()}
+        return index, positions, path
+
+    _, index = index_pruning.read_index(index_name)
+    return index, None, '{}.txt'.format(index_name)
+
+
+# time the text parse of an index (postings per second)
+def text_throughput(index_name, postings):
+    start = time.perf_counter()
+    read_source(index_name)
+    return postings / (time.perf_counter() - start)
+
+
+# best time (of repeat runs) to decode the postings, and the positions, of terms
+def decode_time(codec_index, terms, with_positions, repeat = 3):
+    postings_time = float('inf')
+    positions_time = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decoded = [codec_index.postings(term) for term in terms]
+        postings_time = min(postings_time, time.perf_counter() - start)
+
+        if with_positions:
+            start = time.perf_counter()
+            for term, (_, tfs) in zip(terms, decoded):
+                codec_index.positions(term, tfs)
+            positions_time = min(positions_time, time.perf_counter() - start)
+    return postings_time, positions_time
+
+
+# terms of every query of a query log (one query per line, optionally
+# prefixed with its id as in processed_queries.txt)
+def read_query_terms(query_log):
+    queries = []
+    with open(query_log, 'r') as f:
+        for l in f:
+            l = re.sub(r'^\s*\d+:', ' ', l)
+            queries.append([x.lower() for x in nltk.regexp_tokenize(l, r'(?x)\d[\d.,]*\d|\w[\w-]*\w')])
+    return queries
+
+
+# best time (of repeat runs) per query to decode the postings of its terms and
+# intersect them (shortest list first)
+def query_time(codec_index, queries, repeat = 3):
+    queries = [sorted((t for t in set(q) if t in codec_index), key = lambda t: codec_index.entries[t][0]) for q in queries]
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for terms in queries:
+            lists = [codec_index.postings(term)[0] for term in terms]
+            if lists:
+                matches = lists[0]
+                for numbers in lists[1:]:
+                    matches = np.intersect1d(matches, numbers, assume_unique=True)
+        best = min(best, time.perf_counter() - start)
+    return best / max(len(queries), 1)
+
+
+# compare the codecs on an index: bytes per posting (doc gap + tf), bytes per
+# position, decode throughput and query time. Most terms have short lists, where
+# the time per term dominates; "long/s" only counts terms with at least BLOCK_SIZE postings.
+def report(index_name, codec_names, repeat = 3, query_log = QUERY_LOG):
+    index, positions, path = read_source(index_name)
+    queries = read_query_terms(query_log)
+    postings = sum(len(freqs) for freqs in index.values())
+    num_positions = sum(sum(freqs.values()) for freqs in index.values()) if positions is not None else 0
+    long_terms = [term for term, freqs in index.items() if len(freqs) >= postings_codec.BLOCK_SIZE]
+    long_postings = sum(len(index[term]) for term in long_terms)
+
+    print('\n{}: {} terms, {} postings, {} positions'.format(index_name, len(index), postings, num_positions))
+    print('{:<8} {:>10} {:>10} {:>10} {:>12} {:>12} {:>12} {:>9}'.format('codec', 'bytes', 'B/posting', 'B/position', 'postings/s', 'long/s', 'positions/s', 'ms/query'))
+    print('{:<8} {:>10} {:>10.2f} {:>10} {:>12.0f} {:>12} {:>12} {:>9}'.format(
+        'text', os.path.getsize(path), os.path.getsize(path) / postings, '-', text_throughput(index_name, postings), '-', '-', '-'))
+
+    # doc tables: by name, and by recursive graph bisection
+    orders = [('', None), ('+bp', doc_reorder.bisection_order(index))]
+    for codec_name in codec_names:
+        for suffix, order in orders:
+            docs, entries, data = postings_codec.encode_index(postings_codec.CODECS[codec_name], index, positions, order)
+            codec_index = postings_codec.CodecIndex(codec_name, docs, entries, data)
+            posting_bytes = sum(e[3] + e[4] for e in entries)
+            position_bytes = sum(e[5] for e in entries)
+
+            postings_time, positions_time = decode_time(codec_index, list(index), positions is not None, repeat)
+            long_time, _ = decode_time(codec_index, long_terms, False, repeat)
+
+            print('{:<8} {:>10} {:>10.2f} {:>10} {:>12.0f} {:>12.0f} {:>12} {:>9.3f}'.format(
+                codec_name + suffix, len(data), posting_bytes / postings,
+                '{:.2f}'.format(position_bytes / num_positions) if positions is not None else '-',
+                postings / postings_time, long_postings / long_time,
+                '{:.0f}'.format(num_positions / positions_time) if positions is not None else '-',
+                1000 * query_time(codec_index, queries, repeat)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Postings compression codecs', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('command', choices=['write', 'report'], help='write: compress an index with one codec\nreport: compare the codecs on indexes')
+    parser.add_argument('index_names', nargs='+', help='Frequency index names (e.g. index_baseline) or positional / unified index folders')
+    parser.add_argument('-codec', choices=sorted(postings_codec.CODECS), default='pfor', help='Codec to write with (default: \"%(default)s\")')
+    parser.add_argument('-reorder', action='store_true', help='write: number the docs by content similarity (see doc_reorder.py)')
+    parser.add_argument('-queries', default=QUERY_LOG, help='report: query log to time (default: \"%(default)s\")')
+    args = parser.parse_args()
+    print("args:", args)
+
+    for index_name in args.index_names:
+        if args.command == 'write':
+            index, positions, _ = read_source(index_name)
+            docs = doc_reorder.bisection_order(index) if args.reorder else None
+            postings_codec.write_codec_index(postings_codec.codec_index_path(index_name), args.codec, index, positions, docs)
+        else:
+            report(index_name, sorted(postings_codec.CODECS), query_log = args.queries)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import os
+import re
+import calendar
+import argparse
+import numpy as np
+
+# Document metadata
+#
+# Every CACM document ends with a block that the indexers leave out of the
+# term statistics:
+#
+#   CACM July, 1966                       publication date
+#   Coffman, E. G.                        authors (and keywords)
+#   4.22 4.34 4.45 6.21                   CR categories
+#   CA660704 JB March 2, 1978  9:45 PM    record line
+#   1604	5	1410                        citation data: doc, link type, this doc
+#
+# The indexers parse it into structured fields and write them next to the
+# index, as [index]_metadata.txt (or [index]/metadata.txt), one line per doc:
+#
+#   doc_id<TAB>yyyymm<TAB>category category ...<TAB>doc:type,doc:type,...
+#
+# At search time the fields are held as columns over the sorted doc ids: the
+# dates as one integer array, every CR category and every linked doc as a
+# bitset (np.packbits, 1 bit per doc). A filter expression is evaluated on the
+# bitsets, and only the docs that pass are scored.
+#
+# Filter expressions are clauses separated by spaces, all of which must hold;
+# a clause lists one or more values separated by commas, any of which may
+# match, and is negated by a leading '-':
+#
+#   date:1970..1975    published in a date range (yyyy or yyyy-mm, either end
+#                      may be left open: date:1975.., or a single date:1975-03)
+#   cat:4.2            CR category 4.2 or below it (4.2, 4.22, ...); cat:4 is
+#                      every category of section 4
+#   link:1410          the citation data of the doc mentions CACM-1410
+#
+#   e.g. "date:1970..1975 cat:4.2,4.3 -link:1410"
+
+# Corpus the metadata of an index is read from if the index predates it
+CORPUS = 'test-collection/cacm'
+
+MONTHS = {m.lower(): i for i, m in enumerate(calendar.month_name) if m}
+
+# record line, e.g. CA660704 JB March 2, 1978 (CA + yymm of the issue)
+RECORD_REGEX = re.compile(r'^CA(\d\d)(\d\d)\w*', re.M)
+# publication date line, e.g. CACM July, 1966 or June, 1969
+DATE_REGEX = re.compile(r'^(?:CACM\s+)?([A-Za-z]+),?\s*(\d{4})\s*$', re.M)
+# a line of CR categories, e.g. 3.73, 3.74, 5.0
+CATEGORY_REGEX = re.compile(r'^\s*\d+\.\d+(?:[\s,;]+\d+\.\d+)*[\s,;]*$')
+# a citation triple
+CITATION_REGEX = re.compile(r'^(\d+)\s+(\d+)\s+(\d+)\s*$', re.M)
+
+
+# doc id of a CACM document number
+def cacm_doc_id(number):
+    return 'CACM-{:04d}'.format(int(number))
+
+
+# publication date (yyyymm, 0 if unknown), CR categories and citation links
+# [(doc_id, link type)] of a document's text
+def parse_tail(text, doc_id=None):
+    records = list(RECORD_REGEX.finditer(text))
+    if not records:
+        return {'date': 0, 'categories': [], 'links': []}
+    record = records[-1]
+    head, rest = text[:record.start()], text[record.end():]
+
+    # the last date line before the record line; the record code otherwise
+    date = 0
+    tail_start = 0
+    for m in DATE_REGEX.finditer(head):
+        if m.group(1).lower() in MONTHS:
+            date = int(m.group(2)) * 100 + MONTHS[m.group(1).lower()]
+            tail_start = m.end()
+    if not date:
+        date = (1900 + int(record.group(1))) * 100 + int(record.group(2))
+
+    categories = []
+    for line in head[tail_start:].split('\n'):
+        if CATEGORY_REGEX.match(line):
+            for code in re.findall(r'\d+\.\d+', line):
+                if code not in categories:
+                    categories.append(code)
+
+    links = []
+    for other, link_type, _ in CITATION_REGEX.findall(rest):
+        link = (cacm_doc_id(other), int(link_type))
+        if link[0] != doc_id and link not in links:
+            links.append(link)
+
+    return {'date': date, 'categories': categories, 'links': links}
+
+
+# path of the metadata of an index (positional and unified indexes are folders)
+def metadata_path(index_name):
+    if os.path.isdir(index_name):
+        return os.path.join(index_name, 'metadata.txt')
+    return '{}_metadata.txt'.format(index_name)
+
+
+# write {doc_id: fields}
+def write_metadata(metadata, path):
+    with open(path, 'w') as f:
+        for doc_id, fields in sorted(metadata.items()):
+            links = ','.join('{}:{}'.format(d, t) for d, t in fields['links'])
+            f.write('{}\t{}\t{}\t{}\n'.format(doc_id, fields['date'], ' '.join(fields['categories']), links))
+
+
+# read {doc_id: fields} written by write_metadata
+def read_metadata(path):
+    metadata = {}
+    with open(path, 'r') as f:
+        for l in f:
+            doc_id, date, codes, linked = l.rstrip('\n').split('\t')
+            links = []
+            for link in filter(None, linked.split(',')):
+                other, link_type = link.rsplit(':', 1)
+                links.append((other, int(link_type)))
+            metadata[doc_id] = {'date': int(date), 'categories': codes.split(), 'links': links}
+    return metadata
+
+
+# {doc_id: fields} of every document of a corpus
+def read_corpus_metadata(html_dir = CORPUS):
+    metadata = {}
+    for file_name in os.listdir(html_dir):
+        if not file_name.endswith('.html'):
+            continue
+        doc_id = file_name.split('.')[0]
+        with open(os.path.join(html_dir, file_name), 'rb') as f:
+            metadata[doc_id] = parse_tail(f.read().decode('utf-8', 'ignore'), doc_id)
+    return metadata
+
+
+class DocMetadata:
+    # read the metadata file into columns
+    def __init__(self, path):
+        self.doc_ids = []
+        dates = []
+        categories = {}
+        links = {}
+        with open(path, 'r') as f:
+            for i, l in enumerate(f):
+                doc_id, date, codes, linked = l.rstrip('\n').split('\t')
+                self.doc_ids.append(doc_id)
+                dates.append(int(date))
+                for code in codes.split():
+                    categories.setdefault(code, []).append(i)
+                for link in filter(None, linked.split(',')):
+                    links.setdefault(link.rsplit(':', 1)[0], []).append(i)
+
+        self.num_docs = len(self.doc_ids)
+        self.dates = np.array(dates, dtype=np.int32)
+        self.categories = {code: self.bitset(rows) for code, rows in categories.items()}
+        self.links = {doc_id: self.bitset(rows) for doc_id, rows in links.items()}
+        self.filters = {}
+
+    # packed bitset of the given rows
+    def bitset(self, rows):
+        mask = np.zeros(self.num_docs, dtype=bool)
+        mask[rows] = True
+        return np.packbits(mask)
+
+    def empty(self):
+        return np.zeros((self.num_docs + 7) // 8, dtype=np.uint8)
+
+    # bitset of a single clause value
+    def match(self, field, value):
+        if field == 'date':
+            low, _, high = value.partition('..') if '..' in value else (value, None, value)
+            low = parse_date(low, 1) if low else 0
+            high = parse_date(high, 12) if high else 999999
+            return np.packbits((self.dates >= low) & (self.dates <= high) & (self.dates > 0))
+
+        if field == 'cat':
+            prefix = value if '.' in value else value + '.'
+            result = self.empty()
+            for code, bits in self.categories.items():
+                if code == value or code.startswith(prefix):
+                    result |= bits
+            return result
+
+        if field == 'link':
+            doc_id = value if value.upper().startswith('CACM-') else cacm_doc_id(value)
+            return self.links.get(doc_id.upper(), self.empty())
+
+        raise ValueError('Unknown filter field: {} (date, cat, link)'.format(field))
+
+    # set of the doc ids that pass a filter expression
+    def filter(self, expression):
+        allowed = self.filters.get(expression)
+        if allowed is not None:
+            return allowed
+
+        result = np.packbits(np.ones(self.num_docs, dtype=bool))
+        for clause in expression.split():
+            negate = clause.startswith('-')
+            field, sep, values = clause.lstrip('-').partition(':')
+            if not sep or not values:
+                raise ValueError('Invalid filter clause: {} (expected field:value)'.format(clause))
+
+            bits = self.empty()
+            for value in values.split(','):
+                bits |= self.match(field, value)
+            result &= ~bits if negate else bits
+
+        rows = np.flatnonzero(np.unpackbits(result, count=self.num_docs))
+        allowed = set(self.doc_ids[i] for i in rows)
+        self.filters[expression] = allowed
+        return allowed
+
+
+# yyyymm of yyyy or yyyy-mm (month is used for a bare year)
+def parse_date(value, month):
+    try:
+        if '-' in value:
+            year, m = value.split('-', 1)
+            return int(year) * 100 + int(m)
+        return int(value) * 100 + month
+    except ValueError:
+        raise ValueError('Invalid date: {} (expected yyyy or yyyy-mm)'.format(value))
+
+
+# path of the metadata of an index, written first from the corpus if the index
+# predates it
+def ensure_metadata(index_name, html_dir = CORPUS):
+    path = metadata_path(index_name)
+    if not os.path.exists(path):
+        write_metadata(read_corpus_metadata(html_dir), path)
+    return path
+
+
+# metadata columns of an index
+def load_metadata(index_name, html_dir = CORPUS):
+    return DocMetadata(ensure_metadata(index_name, html_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Document metadata', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('index_name', help='Index the metadata is written for (e.g. index_stopped, positional)')
+    parser.add_argument('-corpus', default=CORPUS, help='CACM corpus folder (default: \"%(default)s\")')
+    parser.add_argument('-filter', help='Print the number of docs passing this filter expression')
+    args = parser.parse_args()
+    print("args:", args)
+
+    metadata = read_corpus_metadata(args.corpus)
+    write_metadata(metadata, metadata_path(args.index_name))
+    print('{} docs written to {}'.format(len(metadata), metadata_path(args.index_name)))
+
+    if args.filter:
+        print('{} docs pass "{}"'.format(len(DocMetadata(metadata_path(args.index_name)).filter(args.filter)), args.filter))
+
+if __name__ == '__main__':
+    main()
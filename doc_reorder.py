@@ -0,0 +1,144 @@
+import time
+import argparse
+import numpy as np
+
+# Doc id reassignment by recursive graph bisection
+#
+# Postings store doc numbers as gaps, so the size of a compressed index depends
+# on which doc gets which number. Numbering docs by name spreads the docs of a
+# term evenly over the collection; numbering docs with similar content next to
+# each other turns most gaps of a term into small ones.
+#
+# bisection_order computes such a numbering over the doc-term graph: the docs
+# are split into two halves, and pairs of docs are swapped between the halves
+# while that lowers the estimated cost of coding the gaps of every term,
+#
+#   sum over terms of  d1 log2(n1 / (d1 + 1)) + d2 log2(n2 / (d2 + 1))
+#
+# (d1, d2: docs of the term in each half of n1, n2 docs), then each half is
+# split the same way, down to LEAF_SIZE docs. The move gains of all docs of a
+# half are computed at once from the term degrees (np.bincount).
+#
+# The order is used as the doc table of a compressed index (postings_codec),
+# which maps the internal doc numbers back to the CACM doc names when
+# index_search -codec decodes the postings (postings_cache.CodecPostings).
+
+# Docs of a partition that is not split any further
+LEAF_SIZE = 16
+
+# Maximum swap rounds per bisection
+ITERATIONS = 20
+
+
+# cost of coding the gaps of terms with degrees d in a partition of n docs
+def gap_cost(d, n):
+    return d * np.log2(n / (d + 1))
+
+
+class DocTermGraph:
+    # doc -> terms of postings {term: {doc_id: tf}}; terms in a single doc do
+    # not influence the order and are left out
+    def __init__(self, index):
+        self.docs = sorted(set(d for freqs in index.values() for d in freqs))
+        rows = {d: i for i, d in enumerate(self.docs)}
+        doc_rows, term_rows = [], []
+        terms = [term for term, freqs in index.items() if len(freqs) > 1]
+        for t, term in enumerate(terms):
+            doc_rows.extend(rows[d] for d in index[term])
+            term_rows.extend([t] * len(index[term]))
+        doc_rows = np.array(doc_rows, dtype=np.int64)
+        order = np.argsort(doc_rows, kind='stable')
+
+        self.num_terms = len(terms)
+        self.terms = np.array(term_rows, dtype=np.int64)[order]
+        self.indptr = np.searchsorted(doc_rows[order], np.arange(len(self.docs) + 1))
+
+    # terms of the docs of a partition, and the position in it of their doc
+    def edges(self, part):
+        lens = self.indptr[part + 1] - self.indptr[part]
+        owners = np.repeat(np.arange(len(part)), lens)
+        starts = np.repeat(self.indptr[part] - (np.cumsum(lens) - lens), lens)
+        return self.terms[starts + np.arange(len(owners))], owners
+
+    # number of docs of the partition every term occurs in
+    def degrees(self, terms):
+        return np.bincount(terms, minlength=self.num_terms)
+
+    # cost decrease of moving every doc of a half to the other half
+    def move_gains(self, terms, owners, size, d_from, n_from, d_to, n_to):
+        d_from, d_to = d_from[terms], d_to[terms]
+        before = gap_cost(d_from, n_from) + gap_cost(d_to, n_to)
+        after = gap_cost(d_from - 1, n_from) + gap_cost(d_to + 1, n_to)
+        return np.bincount(owners, weights=before - after, minlength=size)
+
+    # swap docs between two halves while it lowers the cost
+    def refine(self, left, right, iterations):
+        for _ in range(iterations):
+            left_terms, left_owners = self.edges(left)
+            right_terms, right_owners = self.edges(right)
+            d_left, d_right = self.degrees(left_terms), self.degrees(right_terms)
+
+            left_gains = self.move_gains(left_terms, left_owners, len(left), d_left, len(left), d_right, len(right))
+            right_gains = self.move_gains(right_terms, right_owners, len(right), d_right, len(right), d_left, len(left))
+
+            # best candidates of both sides, paired in order of gain
+            left_order = np.argsort(-left_gains, kind='stable')
+            right_order = np.argsort(-right_gains, kind='stable')
+            m = min(len(left), len(right))
+            swaps = int(np.sum(left_gains[left_order[:m]] + right_gains[right_order[:m]] > 0))
+            if not swaps:
+                break
+            moving = left[left_order[:swaps]].copy()
+            left[left_order[:swaps]] = right[right_order[:swaps]]
+            right[right_order[:swaps]] = moving
+
+    # doc rows of a partition in bisection order
+    def bisect(self, part, leaf_size, iterations):
+        if len(part) <= leaf_size:
+            return np.sort(part)
+        half = len(part) // 2
+        left, right = part[:half].copy(), part[half:].copy()
+        self.refine(left, right, iterations)
+        return np.concatenate((self.bisect(left, leaf_size, iterations), self.bisect(right, leaf_size, iterations)))
+
+
+# doc ids of postings {term: {doc_id: tf}} in recursive graph bisection order
+def bisection_order(index, leaf_size = LEAF_SIZE, iterations = ITERATIONS):
+    graph = DocTermGraph(index)
+    order = graph.bisect(np.arange(len(graph.docs)), leaf_size, iterations)
+    return [graph.docs[i] for i in order]
+
+
+# average log2 of the doc gaps of the postings under a doc order (a codec
+# independent estimate of the bits per doc gap)
+def log_gap_bits(index, docs):
+    numbers = {d: i for i, d in enumerate(docs)}
+    total = 0.0
+    postings = 0
+    for freqs in index.values():
+        gaps = np.diff(np.sort([numbers[d] for d in freqs]), prepend=-1)
+        total += float(np.log2(gaps).sum())
+        postings += len(gaps)
+    return total / postings
+
+
+def main():
+    import index_pruning
+
+    parser = argparse.ArgumentParser(description='Doc id reassignment (recursive graph bisection)', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('index_names', nargs='+', help='Frequency index names (e.g. index_baseline index_stopped)')
+    parser.add_argument('-leaf_size', type=int, default=LEAF_SIZE, help='Docs of a partition that is not split (default: \"%(default)s\")')
+    parser.add_argument('-iterations', type=int, default=ITERATIONS, help='Swap rounds per bisection (default: \"%(default)s\")')
+    args = parser.parse_args()
+    print("args:", args)
+
+    for index_name in args.index_names:
+        _, index = index_pruning.read_index(index_name)
+        start = time.perf_counter()
+        docs = bisection_order(index, args.leaf_size, args.iterations)
+        elapsed = time.perf_counter() - start
+        print('{}: log2 gap {:.2f} bits by name, {:.2f} bits reordered ({:.1f}s)'.format(
+            index_name, log_gap_bits(index, sorted(docs)), log_gap_bits(index, docs), elapsed))
+
+if __name__ == '__main__':
+    main()
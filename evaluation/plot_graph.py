@@ -2,15 +2,18 @@
 # by: Will Enright
 
 import matplotlib.pyplot as plt
-from os import listdir
+from os import listdir, path
 import ast
 import sys
 
 # Set location of graph data
 graph_data_dir = "graph_data/"
 
-# Get all the graph data files
-files = sorted([f for f in listdir(graph_data_dir)])
+# Get the graph data files given after the output file, or all of them
+if len(sys.argv) > 2:
+	files = sys.argv[2:]
+else:
+	files = sorted([graph_data_dir + f for f in listdir(graph_data_dir)])
 
 # Initialize plot features
 plt.suptitle("Precision-Recall Curve for All Runs")
@@ -21,10 +24,10 @@ plt.axis([0.0,1.0,0.0,1.0])
 # Walk over each file to plot the line it represents
 for file in files:
 	# Extract a name for the run from the filename
-	run_name = file.split('.')[0].split('_',1)[1]
+	run_name = path.basename(file).split('.')[0].split('_',1)[1]
 
 	# Open the file and load the dictionary of points
-	with open(graph_data_dir + file, 'r') as data:
+	with open(file, 'r') as data:
 		coords = ast.literal_eval(data.read())
 
 		# Extract x and y axis
@@ -35,5 +38,9 @@ for file in files:
 	plt.plot(x_axis,y_axis,label=run_name)
 
 # Generate the graph
+# (saved to the file given on the command line, shown otherwise)
 plt.legend()
-plt.show()
\ No newline at end of file
+if len(sys.argv) > 1:
+	plt.savefig(sys.argv[1])
+else:
+	plt.show()
\ No newline at end of file
@@ -0,0 +1,336 @@
+import os
+import ast
+import time
+import shutil
+import atexit
+import argparse
+import threading
+from contextlib import contextmanager
+
+# Index generations
+#
+# An index can be built as a series of immutable generations instead of being
+# overwritten in place:
+#
+#   [index_name].generations/
+#       CURRENT            name of the published generation
+#       000001/            one generation: the index files ([index_name].txt,
+#       000002/              _stats.txt, ... or the index folder) and
+#                            manifest.txt (generation, creation time, file sizes)
+#       staging-*/         a generation being written
+#       leases/            [generation].[pid] of every process using a generation
+#
+# A build writes into a staging folder, renames it to the next generation
+# number and then replaces CURRENT (os.replace, atomic), so a reader sees
+# either the old or the new generation, never a partly written one. Index and
+# Search resolve an index name to its current generation when it has
+# generations, and lease it for the life of the process. IndexHolder keeps an
+# Index loaded and reloads it when a new generation is published: queries
+# started before the swap finish on the old generation, whose lease is then
+# released. collect_garbage removes generations that are neither current,
+# nor among the newest kept, nor leased by a live process.
+
+# Number of generations kept besides the current one
+KEEP = 1
+
+MANIFEST = 'manifest.txt'
+
+
+# folder holding the generations of an index
+def generations_dir(index_name):
+    return '{}.generations'.format(os.path.normpath(index_name))
+
+
+# name of a generation folder
+def generation_name(generation):
+    return '{:06d}'.format(generation)
+
+
+# numbers of the published generations, oldest first
+def generations(index_name):
+    root = generations_dir(index_name)
+    if not os.path.isdir(root):
+        return []
+    return sorted(int(name) for name in os.listdir(root) if name.isdigit())
+
+
+# number of the published generation (None if the index has no generations)
+def current_generation(index_name):
+    try:
+        with open(os.path.join(generations_dir(index_name), 'CURRENT'), 'r') as f:
+            return int(f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+# path of the index in a generation
+def generation_path(index_name, generation):
+    return os.path.join(generations_dir(index_name), generation_name(generation), os.path.basename(os.path.normpath(index_name)))
+
+
+# path of the current generation of an index (the index name itself if it
+# has no generations). With lease, the generation is leased by this process
+# until it exits, so collect_garbage cannot remove it while it is being read.
+def resolve(index_name, lease=False):
+    while True:
+        generation = current_generation(index_name)
+        if generation is None:
+            return index_name
+        if not lease:
+            return generation_path(index_name, generation)
+
+        take_lease(index_name, generation)
+        # gc may have removed the generation between reading CURRENT and
+        # taking the lease; then read the newer CURRENT
+        if os.path.isdir(os.path.join(generations_dir(index_name), generation_name(generation))):
+            return generation_path(index_name, generation)
+        release_lease(index_name, generation)
+
+
+# start a new generation; returns the path to write the index to
+def stage(index_name):
+    root = generations_dir(index_name)
+    staging = os.path.join(root, 'staging-{}-{}'.format(os.getpid(), int(time.time() * 1000)))
+    os.makedirs(staging)
+    return os.path.join(staging, os.path.basename(os.path.normpath(index_name)))
+
+
+# sizes of the files of a generation folder, by path relative to it
+def file_sizes(folder):
+    sizes = {}
+    for path, _, files in os.walk(folder):
+        for name in files:
+            full = os.path.join(path, name)
+            if os.path.relpath(full, folder) != MANIFEST:
+                sizes[os.path.relpath(full, folder)] = os.path.getsize(full)
+    return sizes
+
+
+# publish the index written to a staged path: write its manifest, rename the
+# staging folder to the next generation and point CURRENT to it
+def publish(index_name, staged_path):
+    staging = os.path.dirname(staged_path)
+    root = generations_dir(index_name)
+
+    manifest = {'created': time.time(), 'index': os.path.basename(staged_path), 'files': file_sizes(staging)}
+    while True:
+        generation = max(generations(index_name), default=0) + 1
+        manifest['generation'] = generation
+        with open(os.path.join(staging, MANIFEST), 'w') as f:
+            f.write(str(manifest))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            # fails if another build took the number first
+            os.rename(staging, os.path.join(root, generation_name(generation)))
+            break
+        except OSError:
+            if not os.path.isdir(staging):
+                raise
+
+    pointer = os.path.join(root, 'CURRENT.{}'.format(os.getpid()))
+    with open(pointer, 'w') as f:
+        f.write(generation_name(generation))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, os.path.join(root, 'CURRENT'))
+    return generation
+
+
+# read the manifest of a generation and check that its files are complete
+def verify(index_name, generation):
+    folder = os.path.join(generations_dir(index_name), generation_name(generation))
+    with open(os.path.join(folder, MANIFEST), 'r') as f:
+        manifest = ast.literal_eval(f.read())
+    for path, size in manifest['files'].items():
+        full = os.path.join(folder, path)
+        if not os.path.exists(full) or os.path.getsize(full) != size:
+            raise ValueError('Generation {} of {} is incomplete: {}'.format(generation, index_name, path))
+    return manifest
+
+
+def lease_path(index_name, generation, pid=None):
+    return os.path.join(generations_dir(index_name), 'leases', '{}.{}'.format(generation_name(generation), pid or os.getpid()))
+
+# leases taken by this process: lease path -> number of holders (the lease file
+# is removed when the last one releases it)
+lease_counts = {}
+lease_lock = threading.Lock()
+
+# mark a generation as used by this process
+def take_lease(index_name, generation):
+    path = lease_path(index_name, generation)
+    with lease_lock:
+        if not lease_counts.get(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w'):
+                pass
+        lease_counts[path] = lease_counts.get(path, 0) + 1
+
+def release_lease(index_name, generation):
+    path = lease_path(index_name, generation)
+    with lease_lock:
+        if lease_counts.get(path, 0) > 1:
+            lease_counts[path] -= 1
+            return
+        lease_counts.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# remove the lease files of this process when it exits (a later process with
+# the same pid would otherwise keep them alive)
+@atexit.register
+def release_all_leases():
+    with lease_lock:
+        for path in lease_counts:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        lease_counts.clear()
+
+
+# True if a process is running
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# generations leased by live processes (leases of dead ones are removed)
+def leased(index_name):
+    folder = os.path.join(generations_dir(index_name), 'leases')
+    if not os.path.isdir(folder):
+        return set()
+    result = set()
+    for name in os.listdir(folder):
+        generation, pid = name.split('.')
+        if alive(int(pid)):
+            result.add(int(generation))
+        else:
+            os.remove(os.path.join(folder, name))
+    return result
+
+
+# remove the generations that are not current, not among the keep newest
+# others and not leased; returns the removed generation numbers
+def collect_garbage(index_name, keep = KEEP):
+    current = current_generation(index_name)
+    if current is None:
+        return []
+    older = [g for g in generations(index_name) if g < current]
+    protected = set(older[-keep:] if keep else []) | leased(index_name) | {current}
+
+    removed = []
+    for generation in older:
+        if generation not in protected:
+            shutil.rmtree(os.path.join(generations_dir(index_name), generation_name(generation)))
+            removed.append(generation)
+    return removed
+
+
+class IndexHolder:
+    # keep the current generation of an index loaded with load(path), e.g.
+    # lambda path: index_search.Index(path, output_file, mode)
+    # (the holder leases and releases the generations it loads itself)
+    def __init__(self, index_name, load):
+        self.index_name = index_name
+        self.load = load
+        # guards the in-flight counts and the active generation (queries run
+        # outside of it)
+        self.lock = threading.Lock()
+        # serializes reloads (a generation is loaded outside of self.lock)
+        self.reload_lock = threading.Lock()
+        # (generation, loaded index)
+        self.active = None
+        # generation -> queries in flight
+        self.users = {}
+        self.reload()
+
+    # the loaded index for the duration of a query:
+    #   with holder.acquire() as index: index.search(...)
+    @contextmanager
+    def acquire(self):
+        with self.lock:
+            generation, index = self.active
+            self.users[generation] = self.users.get(generation, 0) + 1
+        try:
+            yield index
+        finally:
+            with self.lock:
+                self.users[generation] -= 1
+                if not self.users[generation] and generation != self.active[0]:
+                    del self.users[generation]
+                    # a plain index (no generations) holds no lease
+                    if generation is not None:
+                        release_lease(self.index_name, generation)
+
+    # load the current generation if it changed; the previous one stays in
+    # use until its queries finish. Returns True if a new generation was loaded.
+    def reload(self):
+        with self.reload_lock:
+            generation = current_generation(self.index_name)
+            if self.active and generation == self.active[0]:
+                return False
+
+            if generation is not None:
+                take_lease(self.index_name, generation)
+                try:
+                    verify(self.index_name, generation)
+                    index = self.load(generation_path(self.index_name, generation))
+                except Exception:
+                    release_lease(self.index_name, generation)
+                    raise
+            else:
+                index = self.load(self.index_name)
+
+            with self.lock:
+                old = self.active
+                self.active = (generation, index)
+                # the lease of the old generation goes with its last query
+                # (never when the same generation was loaded again)
+                if old and old[0] is not None and old[0] != generation and not self.users.get(old[0]):
+                    self.users.pop(old[0], None)
+                    release_lease(self.index_name, old[0])
+            return True
+
+    # reload every interval seconds in a daemon thread
+    def watch(self, interval = 1.0):
+        def run():
+            while True:
+                time.sleep(interval)
+                self.reload()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index generations', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('command', choices=['list', 'gc'], help='list: show the generations of an index\ngc: remove unused old generations')
+    parser.add_argument('index_name', help='Name of the index (e.g. index_stopped)')
+    parser.add_argument('-keep', type=int, default=KEEP, help='Generations kept besides the current one (default: \"%(default)s\")')
+    args = parser.parse_args()
+
+    if args.command == 'gc':
+        print('removed:', collect_garbage(args.index_name, args.keep))
+        return
+
+    current = current_generation(args.index_name)
+    in_use = leased(args.index_name)
+    for generation in generations(args.index_name):
+        manifest = verify(args.index_name, generation)
+        print('{} {} {} files, {} bytes{}{}'.format(generation_name(generation),
+              time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest['created'])),
+              len(manifest['files']), sum(manifest['files'].values()),
+              ' (current)' if generation == current else '', ' (leased)' if generation in in_use else ''))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import ast
+import math
+import time
+import os
+import argparse
+import index_search
+import run_metrics
+
+# Static index pruning
+#
+# Drops the postings that contribute least to ranking and writes a smaller
+# index in the usual format. The impact of a posting is its BM25 score (for
+# a single query term) under the statistics of the original index.
+#
+#   term : for every term keep its (1 - ratio) highest impact postings
+#          (term-based pruning, after Carmel et al.)
+#   doc  : for every document keep its (1 - ratio) highest impact terms
+#          (document-centric pruning, after Buttcher & Clarke)
+#
+# The pruned stats keep the original document lengths and store the original
+# df / cf of every term, so index_search.Index scores surviving postings
+# exactly as the full index would.
+
+
+# read the stats and postings of an index
+def read_index(index_name):
+    with open("{}_stats.txt".format(index_name), 'r') as stats_file:
+        stats = ast.literal_eval(stats_file.read())
+
+    index = {}
+    with open("{}.txt".format(index_name), 'r') as index_file:
+        for l in index_file:
+            if not l.strip():
+                continue
+            [term, freqs] = l.split(":", 1)
+            index[term] = ast.literal_eval(freqs.split(",", 1)[1].strip())
+    return stats, index
+
+
+# BM25 impact of every posting
+def posting_impacts(stats, index):
+    impacts = {}
+    N = stats['num_docs']
+    avdl = stats['avdl']
+    for term, freqs in index.items():
+        n = len(freqs)
+        impacts[term] = {d: index_search.BM25_Score(1, f, n, N, stats['doc_lengths'][d], avdl) for d, f in freqs.items()}
+    return impacts
+
+
+# number of items kept out of count at the given pruning ratio (at least one)
+def keep_count(count, ratio):
+    return max(1, int(math.ceil(count * (1 - ratio))))
+
+
+# term-based pruning: keep the highest impact postings of each term
+def prune_terms(index, impacts, ratio):
+    pruned = {}
+    for term, freqs in index.items():
+        ranked = sorted(freqs, key = lambda d: -impacts[term][d])
+        pruned[term] = {d: freqs[d] for d in ranked[:keep_count(len(ranked), ratio)]}
+    return pruned
+
+
+# document-centric pruning: keep the highest impact terms of each document
+def prune_docs(index, impacts, ratio):
+    doc_terms = {}
+    for term, freqs in index.items():
+        for d in freqs:
+            doc_terms.setdefault(d, []).append(term)
+
+    pruned = {}
+    for d, terms in doc_terms.items():
+        terms.sort(key = lambda t: -impacts[t][d])
+        for t in terms[:keep_count(len(terms), ratio)]:
+            pruned.setdefault(t, {})[d] = index[t][d]
+    return pruned
+
+
+# write a pruned index and its stats (with the original df / cf)
+def write_pruned(index, pruned, stats, output_name, method, ratio):
+    with open('{}.txt'.format(output_name), 'w') as index_file:
+        for t, d in pruned.items():
+            index_file.write(t + ': ' + str(len(d)) + ', ')
+            index_file.write(str(d) + '\n')
+
+    pruned_stats = dict(stats)
+    pruned_stats['df'] = {t: len(d) for t, d in index.items()}
+    pruned_stats['cf'] = {t: sum(d.values()) for t, d in index.items()}
+    pruned_stats['pruning'] = {'method': method, 'ratio': ratio}
+    with open("{}_stats.txt".format(output_name), 'w') as stats_file:
+        stats_file.write(str(pruned_stats))
+
+
+# postings, size, latency and effectiveness of an index on a query set
+def measure(index_name, mode, queries, relevant_docs):
+    index = index_search.Index(index_name, None, mode)
+
+    start = time.perf_counter()
+    results = {}
+    for query_num, query in queries:
+        results[query_num] = [d for d, _ in index.search(query_num, query, 100)]
+    latency = (time.perf_counter() - start) * 1000 / max(1, len(queries))
+
+    measures = run_metrics.evaluate(results, relevant_docs)
+    measures['postings'] = sum(len(d) for d in index.index.values())
+    measures['index bytes'] = os.path.getsize('{}.txt'.format(index_name))
+    measures['ms/query'] = latency
+    return measures
+
+
+# print the original and pruned measures side by side
+def report(original, pruned):
+    print('{:<12} {:>14} {:>14} {:>9}'.format('', 'original', 'pruned', 'change'))
+    for key in ['postings', 'index bytes', 'ms/query', 'MAP', 'MRR', 'P@5', 'P@20']:
+        a, b = original[key], pruned[key]
+        change = '{:+.1f}%'.format((b - a) / a * 100) if a else '-'
+        fmt = '{:<12} {:>14} {:>14} {:>9}' if isinstance(a, int) else '{:<12} {:>14.4f} {:>14.4f} {:>9}'
+        print(fmt.format(key, a, b, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Static index pruning', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('index_name', help='Name of the index to prune')
+    parser.add_argument('output_name', help='Name for the pruned index')
+    parser.add_argument('-method', default='term', choices=['term', 'doc'], help='term: term-based pruning\ndoc: document-centric pruning (default: \"%(default)s\")')
+    parser.add_argument('-ratio', type=float, default=0.5, help='Fraction of postings to drop (default: \"%(default)s\")')
+    parser.add_argument('-mode', default='BM25', help='Scoring mode for the report (BM25, TF-IDF, JM, Dirichlet) (default: \"%(default)s\")')
+    parser.add_argument('-queries', default='test-collection/cacm.query.txt', help='Query file for the report (default: \"%(default)s\")')
+    parser.add_argument('-rel', default=run_metrics.RELEVANCY_FILE, help='Relevance judgments for the report (default: \"%(default)s\")')
+    parser.add_argument('-no_report', action='store_true', help='Only write the pruned index.')
+    args = parser.parse_args()
+    print("args:", args)
+
+    stats, index = read_index(args.index_name)
+    impacts = posting_impacts(stats, index)
+
+    if args.method == 'term':
+        pruned = prune_terms(index, impacts, args.ratio)
+    else:
+        pruned = prune_docs(index, impacts, args.ratio)
+
+    write_pruned(index, pruned, stats, args.output_name, args.method, args.ratio)
+
+    if args.no_report:
+        return
+
+    queries = index_search.read_queries(args.queries)
+    relevant_docs = run_metrics.read_relevance(args.rel)
+    report(measure(args.index_name, args.mode, queries, relevant_docs),
+           measure(args.output_name, args.mode, queries, relevant_docs))
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,23 @@ import sys
 import nltk
 import os
 import argparse
+import heapq
 from bs4 import BeautifulSoup
+import query_profile
+import index_snapshot
+import boolean_query
+import spelling
+import term_dictionary
+import stem_cache
+import unified_index
+import postings_cache
+import result_pages
+import doc_metadata
+import citation_prior
+import index_generations
+import lsi_index
+import query_planner
+import re
 
 # used to parse (query_id:query) pair 
 def querypair(q):
@@ -14,6 +30,24 @@ def querypair(q):
     else:
         raise argparse.ArgumentTypeError('[Query ID]:[Query] pair expected')
 
+# parse (query_id, query_text) pairs from a CACM query file
+def read_queries(query_file_loc):
+    with open(query_file_loc, 'rb') as query_file:
+        raw_html = query_file.read()
+
+    querylist = []
+    soup = BeautifulSoup(raw_html, 'html.parser')
+    for raw_q in soup.find_all("doc"):
+        # Extract query number
+        heading = raw_q.find('docno')
+        query_num = int(heading.get_text().strip())
+        heading.decompose()
+
+        # Extract the raw query text
+        querylist.append((query_num, raw_q.get_text().strip()))
+
+    return querylist
+
 # Calculate the BM25 score of a doc for a single query term
 def BM25_Score(qf, f, n, N, dl, avdl, k1 = 1.2, k2 = 100, b = 0.75):
 	# (Sum over query terms)
@@ -46,6 +80,47 @@ def JM_Score(fqd, cq, D, C, A = 0.35):
 	score = math.log(((1-A) * fqd / D) + (A * cq / C))
 	return score
 
+# Calculate the Dirichlet smoothed score of a doc for a single query term
+def Dirichlet_Score(fqd, cq, D, C, mu = 500):
+
+	# (Add across query terms when logged)
+	# log( (fqd + mu * cq / |C|) / (|D| + mu) )
+
+	score = math.log((fqd + mu * cq / C) / (D + mu))
+	return score
+
+# The query likelihood scores above split into
+#   background (f = 0 score, given to every candidate doc)
+#   + doc norm (doc length part of the background, per query term)
+#   + match (only for the docs in the term's postings)
+# so only postings have to be traversed.
+
+# JM background: log(A * cq / |C|)
+def JM_Background(cq, C, A = 0.35):
+	return math.log(A * cq / C)
+
+# JM match: log(1 + (1-A) * fqd * |C| / (A * cq * |D|))
+def JM_Match(fqd, cq, D, C, A = 0.35):
+	return math.log(1 + ((1-A) * fqd * C) / (A * cq * D))
+
+# Dirichlet background: log(mu * cq / |C|)
+def Dirichlet_Background(cq, C, mu = 500):
+	return math.log(mu * cq / C)
+
+# Dirichlet doc norm: -log(|D| + mu)
+def Dirichlet_Norm(D, mu = 500):
+	return -math.log(D + mu)
+
+# Dirichlet match: log(1 + fqd * |C| / (mu * cq))
+def Dirichlet_Match(fqd, cq, D, C, mu = 500):
+	return math.log(1 + (fqd * C) / (mu * cq))
+
+# background, match and doc norm functions of the query likelihood modes
+LM_SCORERS = {
+    'JM': (JM_Background, JM_Match, None),
+    'Dirichlet': (Dirichlet_Background, Dirichlet_Match, Dirichlet_Norm)
+    }
+
 # Calculate the TF-IDF score of a doc for a single query term
 def TFIDF_Score(f, df, N):
 	# (Sum over query terms)
@@ -64,20 +139,150 @@ def TFIDF_Score(f, df, N):
     return score
 
 
+# sort key of a (doc_id, score) result: descending score, then doc id
+def rank_key(result):
+    return (-result[1], result[0])
+
+
+
 class Index:
     # precompute required metrics for scoring
-    def __init__(self, index_name, output_file, mode):
+    def __init__(self, index_name, output_file, mode, profiler=None, use_snapshot=True, correct_spelling=False, cache_bytes=None, use_codec=False):
+        # per-query tracing (no-op unless a profiler is supplied)
+        self.profiler = profiler or query_profile.NullProfiler()
+        # load from / save to the warm-start snapshot next to the index
+        self.use_snapshot = use_snapshot
+        # rewrite query terms missing from the index to their best correction
+        self.correct_spelling = correct_spelling
+        # read postings from disk on demand through a cache of this many bytes
+        # instead of loading the whole index
+        self.cache_bytes = cache_bytes
+        # read postings from the compressed copy of the index (postings_codec)
+        # through a cache of cache_bytes (or the default size)
+        self.use_codec = use_codec
+        # the current generation of an index built with generations (leased
+        # while this process runs, see index_generations)
+        index_name = index_generations.resolve(index_name, lease=True)
+        self.index_name = index_name
+        self.spelling = None
+        self.terms = None
+        self.metadata = None
+        # weighted citation prior of every doc and its lowest and highest
+        # value (none unless set_prior is called)
+        self.prior = None
+        self.prior_bounds = None
+        # chooses the evaluation strategy of every query (taat for all
+        # queries unless set_planner is called) and the plan of the last query
+        self.planner = None
+        self.last_plan = None
+
+        with self.profiler.query('load', index=index_name):
+            self.load(index_name)
+
+        self.output_file = output_file
+        # LSI ranks with the latent semantic index only, [mode]+LSI (e.g.
+        # BM25+LSI) fuses the ranking of mode with it (see lsi_index)
+        self.mode, _, dense = mode.partition('+')
+        self.hybrid = dense == 'LSI'
+        # LSI model (loaded on first use) and clusters probed per query
+        self.lsi = None
+        self.probes = lsi_index.PROBES
+
+    # load the stats and inverted lists of an index into memory
+    # (or only the stats and the location of every term's postings if a
+    # cache size is set)
+    def load(self, index_name):
+        # Use the snapshot of the ready-to-use structures if it is up to date
+        snapshot = None
+        if self.use_snapshot and not self.cache_bytes and not self.use_codec:
+            with self.profiler.stage('snapshot'):
+                snapshot = index_snapshot.load_snapshot(index_name)
+
+        if self.use_codec:
+            with self.profiler.stage('parse'):
+                stats = postings_cache.read_stats(index_name)
+                index = postings_cache.CodecPostings(index_name, self.cache_bytes or postings_cache.CACHE_BYTES, self.profiler)
+        elif self.cache_bytes:
+            with self.profiler.stage('parse'):
+                stats = postings_cache.read_stats(index_name)
+                index = postings_cache.DiskPostings(index_name, self.cache_bytes, self.profiler)
+        elif snapshot:
+            stats, index = snapshot
+            self.profiler.count('bytes_decoded', os.path.getsize(index_snapshot.snapshot_path(index_name)))
+        else:
+            stats, index = self.parse(index_name)
+            if self.use_snapshot:
+                index_snapshot.save_snapshot(index_name, (stats, index))
+
+        self.stats = stats
+        self.index = index
+        self.profiler.count('terms', len(index))
+
+        # sorted postings for boolean queries, built on demand
+        self.sorted_doc_ids = {}
+        self.universe = None
+        # collection frequencies, computed once per term
+        self.cf = {}
+
+        self.configure(stats)
+
+    # parse the text stats and index files
+    def parse(self, index_name):
+        if unified_index.is_unified(index_name):
+            return self.parse_unified(index_name)
+
         # Load stats from file
-        with open("{}_stats.txt".format(index_name), 'r') as stats_file:
-            stats = ast.literal_eval(stats_file.read())
-        
+        with self.profiler.stage('stats'):
+            with open("{}_stats.txt".format(index_name), 'r') as stats_file:
+                stats = ast.literal_eval(stats_file.read())
+
+        # Initialize index
+        index = {}
+
+        # Parse the index file and store relevant entries
+        with self.profiler.stage('parse'), open("{}.txt".format(index_name), 'r') as index_file:
+
+            # For each line in index file, process inverted lists
+            for l in index_file:
+
+                # Skip blank lines
+                if not l.strip():
+                    continue
+
+                # EX: mollin: 2, {'carbon_tetrachloride': 1, 'eu': 1}
+                # Parse values from the line
+                [term, freqs] = l.split(":", 1)
+                freqs = ast.literal_eval(freqs.split(",", 1)[1].strip())
+
+                index[term] = freqs
+
+        self.profiler.count('bytes_decoded', os.path.getsize("{}.txt".format(index_name)) + os.path.getsize("{}_stats.txt".format(index_name)))
+
+        return stats, index
+
+    # read the frequency stream of a unified index (positions are not decoded)
+    def parse_unified(self, index_name):
+        with self.profiler.stage('parse'):
+            stats = postings_cache.read_stats(index_name)
+            index = unified_index.read_postings(index_name)
+
+        self.profiler.count('bytes_decoded', sum(os.path.getsize(p) for p in unified_index.source_files(index_name)))
+
+        return stats, index
+
+    # set scoring statistics and text transformations from the index stats
+    def configure(self, stats):
         # Extract statistics 
         self.N = stats['num_docs']
         self.avdl = stats['avdl']
         self.C = stats['corpus_len']
         self.doc_lens = stats['doc_lengths']
 
-        self.output_file = output_file
+        # collection wide df / cf, used instead of the postings of this index
+        # when it only holds part of them (pruned indexes store them in their
+        # stats, shards get them from set_global_stats)
+        self.global_df = stats.get('df')
+        self.global_cf = stats.get('cf')
 
         # extract index metadata (to allow mirroring text transformations)
 
@@ -99,87 +304,437 @@ class Index:
             with open('test-collection/common_words') as f:
                 self.stopwords = set(list(f.read().split('\n')))
 
-        # Initialize index
-        index = {}
-        term_doc_ids = {}
+        self.stemmer = None
+        # If stemming is enabled, stem query tokens through the persistent stem cache
+        if stats.get('stemmed'):
+            self.stemmer = stem_cache.StemCache()
 
-        # Parse the index file and store relevant entries
-        with open("{}.txt".format(index_name), 'r') as index_file:
+    # mirror the transformations done on corpus to the query text
+    def analyze(self, text):
+        # pull out trailing wildcards (e.g. comput*) and expand them separately
+        wildcards = re.findall(term_dictionary.WILDCARD_REGEX, text)
+        text = re.sub(term_dictionary.WILDCARD_REGEX, ' ', text)
 
-            # For each line in index file, process inverted lists
-            for l in index_file:
-
-                # Skip blank lines
-                if not l.strip():
-                    continue
-
-                # EX: mollin: 2, {'carbon_tetrachloride': 1, 'eu': 1}
-                # Parse values from the line
-                [term, freqs] = l.split(":", 1)
-                freqs = ast.literal_eval(freqs.split(",", 1)[1].strip())
-
-                index[term] = freqs
-
-                # store relevant documents for each term
-                tmp = term_doc_ids.get(term, set())
-                tmp.update(freqs.keys())
-                term_doc_ids[term] = tmp
-        
-        self.index = index
-        self.term_doc_ids = term_doc_ids
-        self.mode = mode
-
-    # search for a query and return top results
-    def search(self, query_num, query, limit):
-        # mirror the transformations done on corpus to the query
-        query = self.case_handler(query)
-        query_tokens = self.get_tokens(query)
+        text = self.case_handler(text)
+        tokens = self.get_tokens(text)
         # remove stopwords from query
-        query_tokens = [x for x in query_tokens if not x.lower() in self.stopwords]
-
-        search_docs = set()
-
-        scores = {}
-        # create a list of documents to be processed
+        tokens = [x for x in tokens if not x.lower() in self.stopwords]
+        # mirror stemming done by the indexer
+        if self.stemmer:
+            tokens = [self.stemmer.stem(x) for x in tokens]
+
+        for w in wildcards:
+            tokens.extend(self.expand(w))
+        return tokens
+
+    # sorted term dictionary (written next to the index on first use if missing)
+    def term_dictionary(self):
+        if self.terms is None:
+            self.terms = term_dictionary.load_term_dictionary(term_dictionary.term_dictionary_path(self.index_name), self.index.keys)
+        return self.terms
+
+    # terms matching a trailing wildcard pattern such as comput*
+    def expand(self, pattern):
+        with self.profiler.stage('expand'):
+            terms = term_dictionary.expand_wildcard(self.term_dictionary(), self.case_handler(pattern))
+        self.profiler.count('expanded_terms', len(terms))
+        return terms
+
+    # spelling corrections (term, edit distance) for a term (n-gram index loaded on first use)
+    def suggest(self, term, k=2, limit=5):
+        if self.spelling is None:
+            self.spelling = spelling.load_spelling_index(self.index_name, self.index.keys(), lambda t: len(self.index[t]))
+        return self.spelling.suggest(term, k, limit)
+
+    # replace terms that are not in the index with their closest correction
+    def correct(self, query_tokens):
+        corrected = []
         for q in query_tokens:
-            search_docs.update(self.term_doc_ids.get(q, set()))
+            if not q in self.index:
+                suggestions = self.suggest(q, limit=1)
+                if suggestions:
+                    self.profiler.count('corrected_terms')
+                    q = suggestions[0][0]
+            corrected.append(q)
+        return corrected
+
+    # sorted doc ids of a term (built on first use, from its postings if
+    # already fetched)
+    def sorted_postings(self, term, postings=None):
+        doc_ids = self.sorted_doc_ids.get(term)
+        if doc_ids is None:
+            doc_ids = sorted(postings if postings is not None else self.index.get(term, {}))
+            self.sorted_doc_ids[term] = doc_ids
+        return doc_ids
 
-        # generate scores term at a time
+    # search for a query and return top results
+    # (the limit results after cursor if given, see result_pages; only docs
+    # passing the doc_filter expression if given, see doc_metadata)
+    def search(self, query_num, query, limit, cursor=None, doc_filter=None):
+        profiler = self.profiler
+        with profiler.query(query_num, mode=self.mode):
+            with profiler.stage('tokenize'):
+                query_tokens = self.analyze(query)
+
+            if self.correct_spelling:
+                with profiler.stage('correct'):
+                    query_tokens = self.correct(query_tokens)
+
+            if self.mode == 'LSI' or self.hybrid:
+                dense = self.lsi_scores([query_tokens], doc_filter)[0]
+                if self.mode == 'LSI':
+                    return self.rank(dense, limit, cursor)
+
+            # pruned strategies only return the docs that can reach the top
+            # k (with the prior if set), fusion needs every score
+            if self.planner:
+                plan = self.plan(query_tokens, exhaustive = self.hybrid)
+                if plan.strategy != 'taat':
+                    allowed = self.filter_docs(doc_filter) if doc_filter else None
+                    with profiler.stage(plan.strategy):
+                        scores = query_planner.evaluate(self, self.planner, plan.strategy, query_tokens, limit + result_pages.offset(cursor), allowed)
+                    return self.rank(scores, limit, cursor)
+
+            search_docs = set()
+
+            # create a list of documents to be processed
+            with profiler.stage('lookup'):
+                postings = self.fetch(query_tokens)
+                for term_postings in postings.values():
+                    profiler.count('postings_scanned', len(term_postings))
+                    search_docs.update(term_postings)
+
+            if doc_filter:
+                search_docs &= self.filter_docs(doc_filter)
+            profiler.count('candidate_docs', len(search_docs))
+
+            scores = self.score(query_tokens, search_docs, postings)
+            if self.hybrid:
+                scores = self.fuse(scores, dense)
+
+            return self.rank(scores, limit, cursor)
+
+    # {term: {doc_id: tf}} of the distinct query terms, each read from the
+    # index once (one postings cache request per term and query)
+    def fetch(self, query_tokens):
+        postings = {}
         for q in query_tokens:
+            if q not in postings:
+                postings[q] = self.index.get(q, {})
+        return postings
+
+    # search for a boolean query (AND / OR / NOT, parentheses) and rank only
+    # the documents that match it
+    def boolean_search(self, query_num, query, limit, cursor=None, doc_filter=None):
+        profiler = self.profiler
+        with profiler.query(query_num, mode=self.mode, boolean=True):
+            with profiler.stage('tokenize'):
+                analyze = self.analyze
+                if self.correct_spelling:
+                    analyze = lambda text: self.correct(self.analyze(text))
+                tree = boolean_query.analyze_tree(boolean_query.parse(query), analyze, self.expand)
+            if tree is None:
+                return []
+
+            # evaluate the operator tree over the sorted postings
+            with profiler.stage('lookup'):
+                stats = boolean_query.Stats()
+                search_docs = boolean_query.evaluate(tree, self.sorted_postings, stats, self.all_doc_ids)
+            profiler.count('postings_scanned', stats.touched)
+
+            if doc_filter:
+                search_docs = self.filter_docs(doc_filter).intersection(search_docs)
+            profiler.count('candidate_docs', len(search_docs))
+
+            # the matching docs are ranked exhaustively (no cluster probing)
+            query_tokens = boolean_query.positive_terms(tree)
+            if self.mode == 'LSI' or self.hybrid:
+                dense = self.lsi_doc_scores(query_tokens, search_docs)
+            if self.mode == 'LSI':
+                scores = dense
+            else:
+                scores = self.score(query_tokens, search_docs)
+            if self.hybrid:
+                scores = self.fuse(scores, dense)
+
+            return self.rank(scores, limit, cursor)
+
+    # one page of results and the cursor of the next page (None after the last)
+    def search_page(self, query_num, query, page_size, cursor=None, boolean=False, doc_filter=None):
+        search = self.boolean_search if boolean else self.search
+        results = search(query_num, query, page_size, cursor, doc_filter)
+        return results, result_pages.next_cursor(results, page_size, rank_key, cursor)
+
+    # generate all results of a query, computing one page at a time
+    def iter_results(self, query_num, query, page_size=100, boolean=False, doc_filter=None):
+        return result_pages.stream(lambda cursor: self.search_page(query_num, query, page_size, cursor, boolean, doc_filter))
+
+    # ids of the docs passing a filter expression such as "date:1970..1975 cat:4.2"
+    # (metadata is loaded on first use, see doc_metadata)
+    def filter_docs(self, doc_filter):
+        with self.profiler.stage('filter'):
+            if self.metadata is None:
+                self.metadata = doc_metadata.load_metadata(self.index_name)
+            return self.metadata.filter(doc_filter)
+
+    # LSI model of the index (loaded, or built, on first use)
+    def lsi_model(self):
+        if self.lsi is None:
+            self.lsi = lsi_index.load_lsi(self)
+        return self.lsi
+
+    # {doc_id: cosine} of each query (a list of terms) over the docs of the
+    # clusters it probes; only docs passing doc_filter if given
+    def lsi_scores(self, token_lists, doc_filter=None):
+        with self.profiler.stage('dense'):
+            lsi = self.lsi_model()
+            results = lsi.search(lsi.embed(token_lists), self.probes)
+            self.profiler.count('dense_scored', sum(len(r) for r in results))
+        if doc_filter:
+            allowed = self.filter_docs(doc_filter)
+            results = [{d: s for d, s in r.items() if d in allowed} for r in results]
+        return results
 
-            # skip if not in index
-            if not q in self.index:
-                continue
+    # {doc_id: cosine} of a query for the given docs
+    def lsi_doc_scores(self, query_tokens, doc_ids):
+        with self.profiler.stage('dense'):
+            lsi = self.lsi_model()
+            return lsi.score_docs(lsi.embed([query_tokens])[0], doc_ids)
+
+    # reciprocal rank fusion of a term matching and a dense ranking
+    def fuse(self, sparse, dense):
+        with self.profiler.stage('fuse'):
+            fused = {}
+            for scores in (sparse, dense):
+                for rank, (doc_id, _) in enumerate(result_pages.top(scores.items(), lsi_index.FUSION_DEPTH, rank_key)):
+                    fused[doc_id] = fused.get(doc_id, 0) + 1 / (lsi_index.FUSION_K + rank + 1)
+            return fused
+
+    # sorted ids of every document in the collection (built on first use)
+    def all_doc_ids(self):
+        if self.universe is None:
+            self.universe = sorted(self.doc_lens)
+        return self.universe
+
+    # generate scores term at a time for the given documents. Every doc starts
+    # with the f = 0 score of the query terms (non-zero for JM / Dirichlet);
+    # only the postings of the terms add to it. postings: the postings of the
+    # query terms if already fetched (see fetch)
+    def score(self, query_tokens, search_docs, postings=None):
+        profiler = self.profiler
+        scores = {}
+        if postings is None:
+            postings = self.fetch(query_tokens)
+        with profiler.stage('score'):
+            terms = []
+            background = 0
+            for q in query_tokens:
+
+                # skip if not in index
+                n = self.term_df(q)
+                if not n:
+                    continue
 
-            for doc_id in search_docs:
+                cq = self.term_cf(q, postings[q])
+                terms.append((n, cq, postings[q]))
+                background += self.term_background(n, cq)
 
-                # frequency of term 
-                f = self.index[q].get(doc_id, 0)
-
-                # gather scorer specific metrics and calculate score
-                if self.mode == 'BM25':
-                    n = len(self.index[q])
-                    N = self.N
-                    dl = self.doc_lens[doc_id]
-                    avdl = self.avdl
-                    score = BM25_Score(1,f,n,N,dl,avdl)
-
-                if self.mode == 'JM':
-                    C = self.C
-                    D = self.doc_lens[doc_id]
-                    cq = sum(self.index[q].values())
-                    score = JM_Score(f, cq, D, C)
-
-                if self.mode == 'TF-IDF':
-                    df = len(self.index[q])
-                    N = self.N
-                    score = TFIDF_Score(f, df, N)
-                
-                scores[doc_id] = scores.get(doc_id, 0) + score
+            for doc_id in search_docs:
+                scores[doc_id] = background + len(terms) * self.doc_norm(self.doc_lens[doc_id])
+
+            for n, cq, postings in terms:
+                profiler.count('postings_scanned', len(postings))
+
+                for doc_id, f in postings.items():
+                    if doc_id in scores:
+                        scores[doc_id] += self.term_match(f, n, cq, self.doc_lens[doc_id])
+        return scores
+
+    # score of a single query term for a doc (term has frequency f in the doc,
+    # document frequency n and collection frequency cq; dl is the doc length)
+    def term_score(self, f, n, cq, dl):
+        # gather scorer specific metrics and calculate score
+        if self.mode == 'BM25':
+            return BM25_Score(1,f,n,self.N,dl,self.avdl)
+
+        if self.mode == 'JM':
+            return JM_Score(f, cq, dl, self.C)
+
+        if self.mode == 'Dirichlet':
+            return Dirichlet_Score(f, cq, dl, self.C)
+
+        if self.mode == 'TF-IDF':
+            return TFIDF_Score(f, n, self.N)
+
+    # part of a term's f = 0 score that does not depend on the doc
+    # (0 for BM25 and TF-IDF)
+    def term_background(self, n, cq):
+        if self.mode in LM_SCORERS:
+            return LM_SCORERS[self.mode][0](cq, self.C)
+        return self.term_score(0, n, cq, self.avdl)
+
+    # what a doc containing the term f times adds to the background score
+    def term_match(self, f, n, cq, dl):
+        if self.mode in LM_SCORERS:
+            return LM_SCORERS[self.mode][1](f, cq, dl, self.C)
+        return self.term_score(f, n, cq, dl) - self.term_background(n, cq)
+
+    # part of a term's f = 0 score that depends on the doc length
+    def doc_norm(self, dl):
+        norm = LM_SCORERS.get(self.mode, (None, None, None))[2]
+        return norm(dl) if norm else 0
+
+    # document frequency of a term (collection wide if global stats are set;
+    # from the term table of an on-disk index, without decoding its postings)
+    def term_df(self, term):
+        if self.global_df is not None:
+            return self.global_df.get(term, 0)
+        if isinstance(self.index, postings_cache.DiskPostings):
+            return self.index.df(term)
+        return len(self.index.get(term, {}))
+
+    # collection frequency of a term (collection wide if global stats are set;
+    # from the term table of an on-disk index that stores it, otherwise summed
+    # over postings, the given ones if already fetched)
+    def term_cf(self, term, postings=None):
+        if self.global_cf is not None:
+            return self.global_cf.get(term, 0)
+        cf = self.cf.get(term)
+        if cf is None:
+            if isinstance(self.index, postings_cache.DiskPostings):
+                cf = self.index.cf(term)
+            if cf is None:
+                if postings is None:
+                    postings = self.index.get(term, {})
+                cf = sum(postings.values())
+            self.cf[term] = cf
+        return cf
+
+    # score with statistics of a whole collection instead of this index's own
+    # (used when this index is one shard of a larger collection)
+    def set_global_stats(self, stats):
+        self.N = stats['num_docs']
+        self.avdl = stats['avdl']
+        self.C = stats['corpus_len']
+        self.global_df = stats['df']
+        self.global_cf = stats['cf']
+
+    # search many (query_num, query) pairs at once. The postings of every
+    # distinct term are scored once and added to the accumulator of each query
+    # containing the term, so the cost follows the number of distinct terms.
+    # Returns the top results of each query (in the order of queries).
+    def batch_search(self, queries, limit):
+        profiler = self.profiler
+        with profiler.query('batch', mode=self.mode, queries=len(queries)):
+            # term -> {query position: occurrences of the term in that query}
+            term_queries = {}
+            token_lists = []
+            with profiler.stage('tokenize'):
+                for i, (query_num, query) in enumerate(queries):
+                    query_tokens = self.analyze(query)
+                    if self.correct_spelling:
+                        query_tokens = self.correct(query_tokens)
+                    token_lists.append(query_tokens)
+                    for q in query_tokens:
+                        users = term_queries.setdefault(q, {})
+                        users[i] = users.get(i, 0) + 1
+            profiler.count('distinct_terms', len(term_queries))
+
+            # all queries are embedded and matched against the clusters at once
+            if self.mode == 'LSI' or self.hybrid:
+                dense = self.lsi_scores(token_lists)
+                if self.mode == 'LSI':
+                    return [self.rank(scores, limit) for scores in dense]
+
+            # A document that does not contain a term still receives that
+            # term's f = 0 score (non-zero for JM / Dirichlet) if it is a
+            # candidate for the query. Its doc independent part is added once
+            # per query as a base score, its doc length part (doc_norm) once
+            # per scored query term, and postings add the difference.
+            accumulators = [{} for _ in queries]
+            base = [0] * len(queries)
+            scored_terms = [0] * len(queries)
+
+            with profiler.stage('score'):
+                for q, users in term_queries.items():
+                    n = self.term_df(q)
+                    if not n:
+                        continue
+
+                    postings = self.index.get(q, {})
+                    cq = self.term_cf(q, postings)
+                    zero = self.term_background(n, cq)
+                    profiler.count('postings_scanned', len(postings))
+
+                    for i, m in users.items():
+                        base[i] += m * zero
+                        scored_terms[i] += m
+
+                    for doc_id, f in postings.items():
+                        delta = self.term_match(f, n, cq, self.doc_lens[doc_id])
+                        for i, m in users.items():
+                            acc = accumulators[i]
+                            acc[doc_id] = acc.get(doc_id, 0) + m * delta
+
+            results = []
+            for i, (acc, b, k) in enumerate(zip(accumulators, base, scored_terms)):
+                scores = {doc_id: score + b + k * self.doc_norm(self.doc_lens[doc_id]) for doc_id, score in acc.items()}
+                if self.hybrid:
+                    scores = self.fuse(scores, dense[i])
+                results.append(self.rank(scores, limit))
+            return results
+
+    # run a batch of (query_num, query) pairs and store the results to the output file
+    def batch_search_store(self, queries, limit):
+        results = self.batch_search(queries, limit)
 
-        # sort by descending order of scores
-        results = sorted([(doc_id, score) for doc_id, score in scores.items()], key = lambda x: -x[1])[:limit]
-        return results
+        # write scores to file
+        with self.profiler.query('batch-write'), self.profiler.stage('write'), open(self.output_file, 'a+') as f:
+            for (query_num, _), scores in zip(queries, results):
+                for rank, (doc_id, score) in enumerate(scores):
+                    f.write('Q{} {} {} {}\n'.format(query_num, rank+1, doc_id, score))
+
+    # top limit results (after cursor) by descending score, ties by doc id
+    def rank(self, scores, limit, cursor=None):
+        with self.profiler.stage('sort'):
+            if self.prior is not None:
+                scores = self.add_prior(scores, limit + result_pages.offset(cursor))
+            return result_pages.top(scores.items(), limit, rank_key, cursor)
+
+    # add weight * log(N * p(d)) of a citation prior (pagerank or indegree,
+    # see citation_prior) to every score
+    def set_prior(self, method='pagerank', weight=citation_prior.PRIOR_WEIGHT):
+        prior = citation_prior.load_prior(self.index_name, method)
+        self.prior = citation_prior.prior_scores(prior, self.doc_lens, weight)
+        self.prior_bounds = (min(self.prior.values()), max(self.prior.values()))
+
+    # scores plus the prior of the docs that can still reach the top k. The
+    # k-th best score plus the lowest prior is a lower bound of the k-th best
+    # combined score, and no doc gains more than the highest prior.
+    def add_prior(self, scores, k):
+        low, high = self.prior_bounds
+        if len(scores) > k:
+            threshold = heapq.nlargest(k, scores.values())[-1] + low - high
+            candidates = len(scores)
+            scores = {doc_id: score for doc_id, score in scores.items() if score >= threshold}
+            self.profiler.count('prior_pruned', candidates - len(scores))
+        return {doc_id: score + self.prior[doc_id] for doc_id, score in scores.items()}
+
+    # choose the evaluation strategy of every query by its estimated cost
+    # (see query_planner; costs calibrated for the index and mode if available)
+    def set_planner(self, target_ms=query_planner.LATENCY_TARGET_MS):
+        self.planner = query_planner.Planner(query_planner.load_costs(self.index_name, self.mode), target_ms)
+
+    # plan of a query, logged in its trace
+    def plan(self, query_tokens, exhaustive=False):
+        with self.profiler.stage('plan'):
+            plan = self.planner.plan([self.term_df(q) for q in query_tokens if self.term_df(q)], self.N, exhaustive)
+        self.profiler.annotate(plan=plan.info())
+        self.profiler.count('plan_' + plan.strategy)
+        if not plan.meets_target():
+            self.profiler.count('plan_over_target')
+        self.last_plan = plan
+        return plan
 
     # clean file at beginning
     def new_search_store(self):
@@ -187,32 +742,74 @@ class Index:
             pass
 
     # get search results and store to output file
-    def search_store(self, query_num, query, limit):
-        scores = self.search(query_num, query, limit)
-            
-        # write scores to file
-        with open(self.output_file, 'a+') as f:
-            for rank, (doc_id, score) in enumerate(scores):
-                f.write('Q{} {} {} {}\n'.format(query_num, rank+1, doc_id, score))
+    # (the page after cursor if given; returns the cursor of the next page)
+    def search_store(self, query_num, query, limit, boolean=False, cursor=None, doc_filter=None):
+        with self.profiler.query(query_num, mode=self.mode):
+            scores, next_cursor = self.search_page(query_num, query, limit, cursor, boolean, doc_filter)
+                
+            # write scores to file (ranks continue from the previous pages)
+            first = result_pages.offset(cursor) + 1
+            with self.profiler.stage('write'), open(self.output_file, 'a+') as f:
+                for rank, (doc_id, score) in enumerate(scores):
+                    f.write('Q{} {} {} {}\n'.format(query_num, rank+first, doc_id, score))
+            return next_cursor
 
 def main():
     parser = argparse.ArgumentParser(description='Search', formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('index_name', help='Name of the index')
     parser.add_argument('output_file', help='Output index file.')
     parser.add_argument('-q', type=querypair ,action='append', help='[Query ID]:[Query] pair (e.g. 25:"cow horse moon")')
-    parser.add_argument("-mode", default='TF-IDF', help="Scoring mode (BM25, TF-IDF, JM) (default: \"%(default)s\")")
+    parser.add_argument("-mode", default='TF-IDF', help="Scoring mode (BM25, TF-IDF, JM, Dirichlet, LSI; [mode]+LSI fuses a mode\nwith LSI, e.g. BM25+LSI) (default: \"%(default)s\")")
+    parser.add_argument("-probes", type=int, default=lsi_index.PROBES, help="LSI clusters probed per query (default: \"%(default)s\")")
     parser.add_argument("-limit", type=int, default=100, help="Limit. (default: \"%(default)s\")")
     parser.add_argument('-new', action='store_true', help="Creates a new output file (otherwise appends to existing file).")
+    parser.add_argument('-boolean', action='store_true', help="Parse queries as boolean expressions (AND, OR, NOT, parentheses;\nadjacent terms are AND-ed) and rank only the matching documents.")
+    parser.add_argument('-batch', action='store_true', help="Run all -q queries as one batch (postings of shared terms are scored once).")
+    parser.add_argument('-correct', action='store_true', help="Replace query terms that are not in the index with their closest spelling correction.")
+    parser.add_argument('-cursor', nargs='?', const='', help="Paginate: store the page of -limit results after this cursor (first page without one)\nand print the cursor of the next page of every query.")
+    parser.add_argument('-filter', help="Only rank documents passing this metadata filter, e.g. \"date:1970..1975 cat:4.2,4.3 -link:1410\"\n(date range, CR category, citation link; see doc_metadata.py).")
+    parser.add_argument('-prior', nargs='?', const='pagerank', choices=citation_prior.PRIORS, help="Add a citation graph prior to the scores (default: \"%(const)s\").")
+    parser.add_argument('-prior_weight', type=float, default=citation_prior.PRIOR_WEIGHT, help="Weight of the prior (default: \"%(default)s\")")
+    parser.add_argument('-plan', type=float, nargs='?', const=query_planner.LATENCY_TARGET_MS, help="Evaluate every query with the strategy of lowest estimated cost (taat, daat or\nconjunctive, see query_planner.py) against this latency target in ms (default: \"%(const)s\").\nNeeds costs calibrated for the index and mode (python3 query_planner.py calibrate),\notherwise every query runs taat.")
+    parser.add_argument('-explain', action='store_true', help="Print the plan chosen for every query (with -plan).")
+    parser.add_argument('-no_snapshot', action='store_true', help="Always parse the text index (do not read or write the warm-start snapshot).")
+    parser.add_argument('-cache', type=float, nargs='?', const=postings_cache.CACHE_BYTES / 2**20, help="Read postings from disk on demand through a postings cache of this many MB\n(default: \"%(const)s\") instead of loading the whole index.")
+    parser.add_argument('-codec', action='store_true', help="Read postings from the compressed copy of the index (written with the indexers' -codec)\nthrough the postings cache (size set with -cache).")
+    parser.add_argument('-profile', nargs='?', const='profile_trace.jsonl', help="Write a JSON-lines trace per query to this file (default: \"%(const)s\")\nand print stage histograms at the end of the run.")
     args = parser.parse_args()
     print("args:", args)
 
-    index = Index(args.index_name, args.output_file, args.mode)
+    profiler = query_profile.get_profiler(args.profile)
+
+    cache_bytes = int(args.cache * 2**20) if args.cache else None
+    index = Index(args.index_name, args.output_file, args.mode, profiler, not args.no_snapshot, args.correct, cache_bytes, args.codec)
+    index.probes = args.probes
+    if args.prior:
+        index.set_prior(args.prior, args.prior_weight)
+    if args.plan is not None:
+        index.set_planner(args.plan)
 
     if args.new:
         index.new_search_store()
 
-    for q_id, q in args.q:
-        index.search_store(q_id, q, args.limit)
+    if args.batch and not args.boolean and args.cursor is None and not args.filter:
+        index.batch_search_store(args.q, args.limit)
+    else:
+        for q_id, q in args.q:
+            next_cursor = index.search_store(q_id, q, args.limit, args.boolean, args.cursor or None, args.filter)
+            if args.cursor is not None:
+                print('Q{} next cursor: {}'.format(q_id, next_cursor))
+            if args.explain and index.last_plan:
+                print('Q{} plan: {}'.format(q_id, index.last_plan))
+
+    # keep query forms stemmed during this run for the next one
+    if index.stemmer:
+        index.stemmer.save()
+
+    if cache_bytes or args.codec:
+        index.index.cache.report()
+
+    profiler.report()
 
 if __name__ == '__main__':
     main()
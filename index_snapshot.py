@@ -0,0 +1,61 @@
+import os
+import pickle
+import unified_index
+
+# Bump whenever the layout of the pickled structures changes
+SNAPSHOT_VERSION = 2
+
+
+# path of the snapshot stored next to an index
+def snapshot_path(index_name):
+    return '{}.snapshot'.format(index_name.rstrip('/\\'))
+
+
+# the files an index is loaded from
+def source_files(index_name):
+    if unified_index.is_unified(index_name):
+        return unified_index.source_files(index_name)
+    return ['{}.txt'.format(index_name), '{}_stats.txt'.format(index_name)]
+
+
+# key the snapshot by the size and mtime of every source file it was built from
+def source_key(index_name):
+    key = []
+    for path in source_files(index_name):
+        st = os.stat(path)
+        key.append((os.path.basename(path), st.st_size, st.st_mtime_ns))
+    return key
+
+
+# return the pickled structures if the snapshot exists and matches the sources
+def load_snapshot(index_name):
+    path = snapshot_path(index_name)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+            if header != (SNAPSHOT_VERSION, source_key(index_name)):
+                return None
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        # a stale or damaged snapshot is simply rebuilt
+        return None
+
+
+# write the structures to a temporary file and rename it into place so that
+# concurrent readers never see a partially written snapshot
+def save_snapshot(index_name, data):
+    path = snapshot_path(index_name)
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((SNAPSHOT_VERSION, source_key(index_name)), f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # the snapshot is only an optimization, searching works without it
+        print('Could not write snapshot {}: {}'.format(path, e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
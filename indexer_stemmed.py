@@ -31,6 +31,5 @@ for mode in ['BM25', 'JM', 'TF-IDF']:
 
     indexer.new_search_store()
 
-    # iterate over queries and generate score results
-    for query_id, query in enumerate(querylist):
-        indexer.search_store(query_id+1, query, 100)
\ No newline at end of file
+    # generate score results for all queries in one batch
+    indexer.batch_search_store([(query_id+1, query) for query_id, query in enumerate(querylist)], 100)
\ No newline at end of file
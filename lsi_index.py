@@ -0,0 +1,255 @@
+import os
+import math
+import argparse
+import numpy as np
+import index_snapshot
+
+# Latent semantic index (LSI)
+#
+# The term-document matrix of a frequency index (log(1 + tf) * idf weights) is
+# factored with a truncated randomized SVD, A ~ U S V^T, computed with sparse
+# products over the postings (NumPy only). Every doc is stored as its
+# normalized float32 embedding S V^T (= U^T a), and a query is folded into the
+# same space as U^T q, so the score of a doc is the cosine of the two.
+#
+# The doc embeddings are clustered with spherical k-means and stored grouped
+# by cluster (an inverted file, IVF): a query only scans the docs of the
+# probes clusters whose centroids are closest to it. A batch of queries is
+# matched against the centroids with one matrix product, and against each
+# probed cluster with one product for all the queries probing it.
+#
+# The model is written next to the index as [index]_lsi.npz (or [index]/lsi.npz)
+# with the size and mtime of the index files it was built from, and built on
+# first use if missing or if the index changed since. index_search ranks with it in mode LSI,
+# and fuses it with a term matching mode in mode [mode]+LSI (e.g. BM25+LSI) by
+# reciprocal rank fusion.
+
+# Default number of latent dimensions
+DIMS = 200
+
+# Default number of clusters and clusters probed per query
+CLUSTERS = 64
+PROBES = 8
+
+# Reciprocal rank fusion: sum of 1 / (FUSION_K + rank) over the top
+# FUSION_DEPTH of each ranking
+FUSION_K = 60
+FUSION_DEPTH = 1000
+
+
+# path of the LSI model of an index (positional and unified indexes are folders)
+def lsi_path(index_name):
+    if os.path.isdir(index_name):
+        return os.path.join(index_name, 'lsi.npz')
+    return '{}_lsi.npz'.format(index_name)
+
+
+# key of the index files a model is built from (as for snapshots)
+def source_key(index_name):
+    return repr(index_snapshot.source_key(index_name))
+
+
+# weight of a term occurring tf times in a text, for a term with idf
+def term_weight(tf, idf):
+    return np.log1p(tf) * idf
+
+
+class SparseMatrix:
+    # terms x docs matrix from (row, column, value) triples
+    def __init__(self, shape, rows, cols, vals):
+        self.shape = shape
+        # by row for A X, by column for A^T Y
+        order = np.argsort(rows, kind='stable')
+        self.rows, self.cols, self.vals = rows[order], cols[order], vals[order]
+        self.row_starts = np.searchsorted(self.rows, np.arange(shape[0] + 1))
+        order = np.argsort(cols, kind='stable')
+        self.t_rows, self.t_cols, self.t_vals = rows[order], cols[order], vals[order]
+        self.col_starts = np.searchsorted(self.t_cols, np.arange(shape[1] + 1))
+
+    # sum of the rows of products grouped by starts (empty groups are 0)
+    @staticmethod
+    def reduce(products, starts, n):
+        out = np.zeros((n, products.shape[1]))
+        nonempty = np.flatnonzero(np.diff(starts))
+        out[nonempty] = np.add.reduceat(products, starts[nonempty], axis=0)
+        return out
+
+    # A X
+    def dot(self, X):
+        return self.reduce(self.vals[:, None] * X[self.cols], self.row_starts, self.shape[0])
+
+    # A^T Y
+    def tdot(self, Y):
+        return self.reduce(self.t_vals[:, None] * Y[self.t_rows], self.col_starts, self.shape[1])
+
+
+# rank dims approximation U, S, V^T of a sparse matrix (randomized range finder
+# with power iterations, then an exact SVD of the small projected matrix)
+def truncated_svd(A, dims, oversample = 20, power_iterations = 3, seed = 0):
+    rng = np.random.default_rng(seed)
+    Q, _ = np.linalg.qr(A.dot(rng.standard_normal((A.shape[1], dims + oversample))))
+    for _ in range(power_iterations):
+        Z, _ = np.linalg.qr(A.tdot(Q))
+        Q, _ = np.linalg.qr(A.dot(Z))
+    Ub, S, Vt = np.linalg.svd(A.tdot(Q).T, full_matrices=False)
+    return (Q @ Ub)[:, :dims], S[:dims], Vt[:dims]
+
+
+# rows scaled to unit length
+def normalize(X):
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.where(norms > 0, norms, 1)
+
+
+# spherical k-means of unit rows; returns the centroids and the cluster of
+# every row
+def kmeans(X, clusters, iterations = 20, seed = 0):
+    rng = np.random.default_rng(seed)
+    centroids = X[rng.choice(len(X), clusters, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(X @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, X)
+        # an empty cluster keeps its centroid
+        empty = np.bincount(assignment, minlength=clusters) == 0
+        sums[empty] = centroids[empty]
+        centroids = normalize(sums)
+    return centroids, np.argmax(X @ centroids.T, axis=1)
+
+
+# compute the LSI model of a loaded index_search.Index
+def build_lsi(index, dims = DIMS, clusters = CLUSTERS):
+    terms = sorted(index.index.keys())
+    doc_ids = sorted(index.doc_lens)
+    doc_rows = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+
+    rows, cols, tfs = [], [], []
+    idf = np.zeros(len(terms))
+    for i, term in enumerate(terms):
+        postings = index.index.get(term, {})
+        idf[i] = math.log(index.N / len(postings))
+        for doc_id, tf in postings.items():
+            rows.append(i)
+            cols.append(doc_rows[doc_id])
+            tfs.append(tf)
+    rows, cols = np.array(rows), np.array(cols)
+    A = SparseMatrix((len(terms), len(doc_ids)), rows, cols, term_weight(np.array(tfs), idf[rows]))
+
+    # (the rank of a small matrix is below its smaller side)
+    dims = min(dims, len(terms) - 1, len(doc_ids) - 1)
+    U, S, Vt = truncated_svd(A, dims)
+    docs = normalize(Vt.T * S).astype(np.float32)
+
+    centroids, assignment = kmeans(docs, min(clusters, len(doc_ids)))
+    order = np.argsort(assignment, kind='stable')
+    offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+
+    return {
+        'terms': np.array(terms), 'idf': idf.astype(np.float32), 'U': U.astype(np.float32),
+        'doc_ids': np.array(doc_ids)[order], 'docs': docs[order],
+        'centroids': centroids.astype(np.float32), 'offsets': offsets,
+        'source': np.array(source_key(index.index_name))
+        }
+
+
+def write_lsi(model, path):
+    np.savez(path, **model)
+
+
+class LSIIndex:
+    # docs and their embeddings are stored cluster after cluster: cluster c
+    # holds rows offsets[c]:offsets[c+1]
+    def __init__(self, path):
+        with np.load(path) as model:
+            self.terms = {t: i for i, t in enumerate(model['terms'].tolist())}
+            self.idf = model['idf']
+            self.U = model['U']
+            self.doc_ids = model['doc_ids'].tolist()
+            self.docs = model['docs']
+            self.centroids = model['centroids']
+            self.offsets = model['offsets']
+        self.doc_rows = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+
+    # unit embeddings of queries given as lists of (analyzed) terms
+    def embed(self, queries):
+        Q = np.zeros((len(queries), self.U.shape[1]), dtype=np.float32)
+        for i, tokens in enumerate(queries):
+            counts = {}
+            for t in tokens:
+                if t in self.terms:
+                    counts[self.terms[t]] = counts.get(self.terms[t], 0) + 1
+            if counts:
+                rows = np.array(list(counts))
+                Q[i] = term_weight(np.array(list(counts.values())), self.idf[rows]) @ self.U[rows]
+        return normalize(Q)
+
+    # {doc_id: cosine} of every query over the docs of the clusters it probes
+    # (all docs if probes covers every cluster; none for a query without known
+    # terms, whose embedding is 0)
+    def search(self, Q, probes = PROBES):
+        probes = min(probes, len(self.centroids))
+        nearest = np.argpartition(-(Q @ self.centroids.T), probes - 1, axis=1)[:, :probes]
+        known = np.any(Q != 0, axis=1)
+
+        # cluster -> queries probing it
+        users = {}
+        for i, clusters in enumerate(nearest):
+            if not known[i]:
+                continue
+            for c in clusters:
+                users.setdefault(int(c), []).append(i)
+
+        results = [{} for _ in range(len(Q))]
+        for c, queries in users.items():
+            start, end = self.offsets[c], self.offsets[c + 1]
+            scores = self.docs[start:end] @ Q[queries].T
+            ids = self.doc_ids[start:end]
+            for j, i in enumerate(queries):
+                results[i].update(zip(ids, scores[:, j].tolist()))
+        return results
+
+    # {doc_id: cosine} of a query embedding for the given docs (exhaustive;
+    # none for a query without known terms)
+    def score_docs(self, q, doc_ids):
+        if not np.any(q):
+            return {}
+        doc_ids = [d for d in doc_ids if d in self.doc_rows]
+        scores = self.docs[[self.doc_rows[d] for d in doc_ids]] @ q
+        return dict(zip(doc_ids, scores.tolist()))
+
+
+# key of the index files a written model was built from (None for models
+# written without one)
+def read_source_key(path):
+    with np.load(path) as model:
+        return str(model['source']) if 'source' in model.files else None
+
+
+# LSI model of a loaded index_search.Index, built and written first if the
+# index predates it or changed since it was built
+def load_lsi(index):
+    path = lsi_path(index.index_name)
+    if not os.path.exists(path) or read_source_key(path) != source_key(index.index_name):
+        write_lsi(build_lsi(index), path)
+    return LSIIndex(path)
+
+
+def main():
+    import index_search
+
+    parser = argparse.ArgumentParser(description='Latent semantic index', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('index_name', help='Frequency or unified index (e.g. index_stopped)')
+    parser.add_argument('-dims', type=int, default=DIMS, help='Latent dimensions (default: \"%(default)s\")')
+    parser.add_argument('-clusters', type=int, default=CLUSTERS, help='IVF clusters (default: \"%(default)s\")')
+    args = parser.parse_args()
+    print("args:", args)
+
+    index = index_search.Index(args.index_name, None, 'LSI')
+    model = build_lsi(index, args.dims, args.clusters)
+    write_lsi(model, lsi_path(index.index_name))
+    sizes = np.diff(model['offsets'])
+    print('{} terms x {} docs, {} dims, {} clusters ({} - {} docs) written to {}'.format(
+        len(model['terms']), len(model['doc_ids']), model['U'].shape[1], len(sizes), sizes.min(), sizes.max(), lsi_path(index.index_name)))
+
+if __name__ == '__main__':
+    main()
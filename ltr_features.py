@@ -0,0 +1,187 @@
+import math
+import argparse
+import numpy as np
+import index_search
+import advanced_search
+import run_metrics
+import query_profile
+
+# Learning to rank features
+#
+# One row per (query, candidate doc) pair of a run, one column per feature.
+# All rows are built in one batched pass: the postings of every distinct query
+# term are read once and scored with NumPy for every row of every query that
+# uses the term, and positions are fetched once for all candidates.
+#
+#   bm25, tfidf, jm, dirichlet   retrieval scores (same as index_search)
+#   doc_len                      document length
+#   idf_sum, idf_max, idf_mean   log(N / df) over the distinct query terms
+#   coverage                     fraction of the distinct query terms in the doc
+#   ordered_window               smallest window containing the doc's query terms
+#                                in query order (ordered_best_match), -1 if fewer
+#                                than two of them occur or never in order
+
+FEATURES = ['bm25', 'tfidf', 'jm', 'dirichlet', 'doc_len', 'idf_sum', 'idf_max', 'idf_mean', 'coverage', 'ordered_window']
+COLUMN = {name: i for i, name in enumerate(FEATURES)}
+
+
+# BM25 of a query term for vectors of term frequencies f and doc lengths dl
+# (index_search.BM25_Score with qf = 1)
+def BM25_Scores(f, n, N, dl, avdl, k1 = 1.2, b = 0.75):
+    K = k1 * ((1 - b) + (b * dl / avdl))
+    return math.log(1 / ((n + 0.5) / (N - n + 0.5))) * (k1 + 1) * f / (K + f)
+
+# TF-IDF of a query term for a vector of term frequencies
+def TFIDF_Scores(f, df, N):
+    return f * math.log(N / df)
+
+# JM of a query term for vectors of term frequencies and doc lengths
+def JM_Scores(fqd, cq, D, C, A = 0.35):
+    return np.log(((1-A) * fqd / D) + (A * cq / C))
+
+# Dirichlet of a query term for vectors of term frequencies and doc lengths
+def Dirichlet_Scores(fqd, cq, D, C, mu = 500):
+    return np.log((fqd + mu * cq / C) / (D + mu))
+
+
+class FeatureExtractor:
+    # frequency index for the scores, positional index for the ordered window
+    def __init__(self, index_name, positional_name, profiler=None):
+        self.profiler = profiler or query_profile.NullProfiler()
+        self.index = index_search.Index(index_name, None, 'BM25', self.profiler)
+        self.positional = advanced_search.Search(positional_name, self.profiler)
+
+    # queries: {query_id: text}, candidates: {query_id: [doc ids]}
+    # returns the feature matrix and the query id and doc id of every row
+    def extract(self, queries, candidates):
+        index = self.index
+        profiler = self.profiler
+
+        with profiler.query('features', queries=len(candidates)):
+            qids = []
+            doc_ids = []
+            # query id -> (first row, end row, query terms in the index)
+            query_rows = {}
+            with profiler.stage('tokenize'):
+                for q_id in sorted(candidates):
+                    if q_id not in queries:
+                        continue
+                    terms = [t for t in index.analyze(queries[q_id]) if index.term_df(t)]
+                    query_rows[q_id] = (len(qids), len(qids) + len(candidates[q_id]), terms)
+                    qids.extend([q_id] * len(candidates[q_id]))
+                    doc_ids.extend(candidates[q_id])
+
+            X = np.zeros((len(qids), len(FEATURES)))
+            dl = np.array([index.doc_lens[d] for d in doc_ids], dtype=float)
+            X[:, COLUMN['doc_len']] = dl
+
+            # term -> [(first row, end row, occurrences in the query)]
+            term_rows = {}
+            distinct = np.ones(len(qids))
+            for q_id, (start, end, terms) in query_rows.items():
+                for t in set(terms):
+                    term_rows.setdefault(t, []).append((start, end, terms.count(t)))
+
+                idfs = [math.log(index.N / index.term_df(t)) for t in set(terms)]
+                if idfs:
+                    X[start:end, COLUMN['idf_sum']] = sum(idfs)
+                    X[start:end, COLUMN['idf_max']] = max(idfs)
+                    X[start:end, COLUMN['idf_mean']] = sum(idfs) / len(idfs)
+                    distinct[start:end] = len(idfs)
+
+            # score each distinct term once for all rows of the queries using it
+            with profiler.stage('score'):
+                for t, ranges in term_rows.items():
+                    n = index.term_df(t)
+                    postings = index.index.get(t, {})
+                    cq = index.term_cf(t, postings)
+
+                    rows = np.concatenate([np.arange(start, end) for start, end, _ in ranges])
+                    m = np.concatenate([np.full(end - start, count) for start, end, count in ranges])
+                    f = np.array([postings.get(doc_ids[r], 0) for r in rows], dtype=float)
+                    d = dl[rows]
+                    profiler.count('scored_pairs', len(rows))
+
+                    X[rows, COLUMN['bm25']] += m * BM25_Scores(f, n, index.N, d, index.avdl)
+                    X[rows, COLUMN['tfidf']] += m * TFIDF_Scores(f, n, index.N)
+                    X[rows, COLUMN['jm']] += m * JM_Scores(f, cq, d, index.C)
+                    X[rows, COLUMN['dirichlet']] += m * Dirichlet_Scores(f, cq, d, index.C)
+                    X[rows, COLUMN['coverage']] += f > 0
+
+            X[:, COLUMN['coverage']] /= distinct
+
+            with profiler.stage('positions'):
+                all_terms = list(term_rows)
+                self.positional.fetch_relevant(all_terms, set(doc_ids))
+                term_docs = self.positional.term_docs
+
+            with profiler.stage('window'):
+                for q_id, (start, end, terms) in query_rows.items():
+                    ordered = list(dict.fromkeys(terms))
+                    for r in range(start, end):
+                        X[r, COLUMN['ordered_window']] = ordered_window(ordered, doc_ids[r], term_docs)
+
+            return X, np.array(qids), doc_ids
+
+
+# minimum ordered window (ordered_best_match) of the query terms occurring in a
+# doc, or -1 (term_docs: {term: {doc_id: [positions]}})
+def ordered_window(terms, doc_id, term_docs):
+    present = [t for t in terms if doc_id in term_docs.get(t, {})]
+    if len(present) < 2:
+        return -1
+
+    window = advanced_search.ordered_window(present, {t: term_docs[t][doc_id] for t in present})
+    return -1 if window == float('inf') else window
+
+
+# 1 for the judged relevant (query, doc) pairs, 0 otherwise
+def labels(qids, doc_ids, relevant_docs):
+    return np.array([1 if d in relevant_docs.get(q, ()) else 0 for q, d in zip(qids, doc_ids)])
+
+
+# SVMlight / RankLib format: label qid:Q 1:v 2:v ... # doc_id
+def write_svmlight(path, X, y, qids, doc_ids):
+    with open(path, 'w') as f:
+        for row, label, q_id, doc_id in zip(X, y, qids, doc_ids):
+            values = ' '.join('{}:{:.8g}'.format(i+1, v) for i, v in enumerate(row))
+            f.write('{} qid:{} {} # {}\n'.format(label, q_id, values, doc_id))
+
+
+# NumPy archive with the matrix X, labels y, qid, doc_ids and feature names
+def write_numpy(path, X, y, qids, doc_ids):
+    np.savez(path, X=X, y=y, qid=qids, doc_ids=np.array(doc_ids), features=np.array(FEATURES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Learning to rank feature extraction', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('run_file', help='Run whose results are the candidates (e.g. result_tables/stopped_BM25.txt)')
+    parser.add_argument('output_file', help='Output file (.npz is appended for -format numpy)')
+    parser.add_argument('-queries', default='test-collection/cacm.query.txt', help='CACM query file (default: \"%(default)s\")')
+    parser.add_argument('-index', default='index_stopped', help='Frequency index (default: \"%(default)s\")')
+    parser.add_argument('-positional', default='positional', help='Positional index for the ordered window (default: \"%(default)s\")')
+    parser.add_argument('-k', type=int, default=100, help='Number of candidates per query (default: \"%(default)s\")')
+    parser.add_argument('-rel', default=run_metrics.RELEVANCY_FILE, help='Relevance judgments for the labels (default: \"%(default)s\")')
+    parser.add_argument('-format', choices=['svmlight', 'numpy'], default='svmlight', help='Output format (default: \"%(default)s\")')
+    parser.add_argument('-profile', nargs='?', const='profile_trace.jsonl', help="Write a JSON-lines trace to this file (default: \"%(const)s\")\nand print stage histograms at the end of the run.")
+    args = parser.parse_args()
+    print("args:", args)
+
+    profiler = query_profile.get_profiler(args.profile)
+    extractor = FeatureExtractor(args.index, args.positional, profiler)
+
+    queries = dict(index_search.read_queries(args.queries))
+    candidates = run_metrics.read_run(args.run_file, args.k)
+    X, qids, doc_ids = extractor.extract(queries, candidates)
+    y = labels(qids, doc_ids, run_metrics.read_relevance(args.rel))
+
+    if args.format == 'svmlight':
+        write_svmlight(args.output_file, X, y, qids, doc_ids)
+    else:
+        write_numpy(args.output_file, X, y, qids, doc_ids)
+    print('{} rows, {} features, {} relevant'.format(len(doc_ids), len(FEATURES), int(y.sum())))
+
+    profiler.report()
+
+if __name__ == '__main__':
+    main()
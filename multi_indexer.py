@@ -0,0 +1,93 @@
+# Single pass multi-variant indexer
+#
+# Reads and tokenizes every CACM document once and feeds the token stream to
+# several index writers: any of the baseline, stopped and (Porter) stemmed
+# frequency indexes of baseline_indexer, the positional index of
+# positional_index and the unified index of unified_index. The output of each writer is the same as running its
+# own indexer over the corpus.
+
+import sys
+import argparse
+import baseline_indexer
+import positional_index
+import unified_index
+import postings_codec
+import doc_metadata
+import index_generations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build several index variants in one pass', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('input_folder', help='Folder for which indexes are generated.')
+    parser.add_argument('-baseline', help='Name for the baseline index (e.g. index_baseline)')
+    parser.add_argument('-stopped', help='Name for the stopped index (e.g. index_stopped)')
+    parser.add_argument('-stemmed', help='Name for the stemmed index (e.g. index_porter)')
+    parser.add_argument('-stopped_stemmed', help='Name for the stopped and stemmed index')
+    parser.add_argument('-positional', help='Folder for the positional index (e.g. positional)')
+    parser.add_argument('-unified', help='Folder for the unified positional + frequency index (e.g. unified)')
+    parser.add_argument('-codec', choices=sorted(postings_codec.CODECS), help='Also write compressed postings with this codec for the frequency and positional indexes')
+    parser.add_argument('-reorder', action='store_true', help='Number the docs of the compressed copies by content similarity (see doc_reorder.py)')
+    parser.add_argument('-generation', action='store_true', help='Write a new generation of every index and publish them atomically once all are\nwritten (see index_generations.py) instead of overwriting them in place.')
+    args = parser.parse_args()
+    print("args:", args)
+
+    # index name -> path its new generation is written to
+    staged = {}
+    def target(name):
+        if not args.generation:
+            return name
+        staged[name] = index_generations.stage(name)
+        return staged[name]
+
+    # (output name, stopped, stemmed) of each frequency index variant
+    variants = [(args.baseline, False, False), (args.stopped, True, False),
+                (args.stemmed, False, True), (args.stopped_stemmed, True, True)]
+
+    writers = []
+    for name, stopped, stemmed in variants:
+        if name:
+            writers.append((target(name), baseline_indexer.Indexer(args.input_folder, True, True, stopped, stemmed, args.codec, args.reorder)))
+
+    if args.unified:
+        path = target(args.unified)
+        writers.append((path, unified_index.UnifiedIndexer(args.input_folder, path)))
+
+    positional = None
+    if args.positional:
+        positional = positional_index.InvertedIndexer(args.input_folder, target(args.positional), args.codec, args.reorder)
+
+    if not writers and not positional:
+        parser.error('no index variant requested')
+
+    # all variants use case folding and punctuation handling, so the tokens of
+    # one reader can be shared by every writer
+    reader = baseline_indexer.Indexer(args.input_folder, True, True, False)
+    for _, idxr in writers:
+        idxr.stats['num_docs'] = len(reader.doc_ids)
+
+    for doc_id in reader.doc_ids:
+        sys.stdout.write('.')
+        sys.stdout.flush()
+
+        page_text = reader.read_text(doc_id)
+        tokens = reader.tokenize(page_text)
+        metadata = doc_metadata.parse_tail(page_text, doc_id)
+
+        for _, idxr in writers:
+            idxr.metadata[doc_id] = metadata
+            idxr.add_document(doc_id, tokens)
+        if positional:
+            positional.metadata[doc_id] = metadata
+            positional.add_document('{}.html'.format(doc_id), tokens)
+
+    for name, idxr in writers:
+        idxr.write_index(name)
+    if positional:
+        positional.write_index()
+
+    for name, path in staged.items():
+        print('\n{}: published generation {}'.format(name, index_generations.publish(name, path)))
+
+
+if __name__ == "__main__":
+    main()
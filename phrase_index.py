@@ -0,0 +1,170 @@
+import os
+import re
+import argparse
+import nltk
+import unified_index
+
+# Phrase (next-word) index
+#
+# An auxiliary index of frequent adjacent term pairs, stored next to a
+# positional or unified index as [index]/pairs.txt in the positional index
+# format. The position of a pair is the position of its first term:
+#
+#   operating system=>57;{[CACM-0084;1;(12)][CACM-0104;2;(3,40)]...}
+#
+# Pairs are chosen by document frequency (-min_df) and / or from a query log
+# (every adjacent pair of a logged query that occurs in the collection).
+# Exact match queries use the pair postings instead of merging the (much
+# longer) position lists of both terms.
+
+# Default document frequency a pair needs to be indexed
+MIN_DF = 20
+
+# regex of a positional posting: [doc;count;(delta encoded positions)]
+POSTING_REGEX = re.compile(r'\[([\w\,\-\.]+);(\d+);\(([\d\,]*)\)\]')
+
+
+# key of the pair a b in the pair index
+def pair_key(first, second):
+    return '{} {}'.format(first, second)
+
+
+# path of the pair index of a positional / unified index
+def pair_index_path(index_name):
+    return os.path.join(index_name, 'pairs.txt')
+
+
+# (doc_id, count, delta encoded positions) of each posting of a line. With
+# doc_ids only the postings of those docs are decoded: the others are skipped
+# by their id without running the regex over them.
+def split_postings(rest, doc_ids=None):
+    if doc_ids is None:
+        return POSTING_REGEX.findall(rest)
+    result = []
+    for entry in rest.split('[')[1:]:
+        doc_id, count, indices = entry.split(';', 2)
+        if doc_id in doc_ids:
+            result.append((doc_id, count, indices[1:indices.index(')')]))
+    return result
+
+
+# decode a line of postings into {doc_id: [positions]}
+# (only for the docs in doc_ids if given)
+def decode_postings(rest, doc_ids=None):
+    result = {}
+    for (doc_id, count, indices) in split_postings(rest, doc_ids):
+        positions = [int(i) for i in indices.split(',')]
+        # expand to normal positional indices
+        for i in range(1, len(positions)):
+            positions[i] += positions[i-1]
+        result[doc_id] = positions
+    return result
+
+
+# {doc_id: {position: term}} of every document of a positional or unified index
+def read_documents(index_name):
+    docs = {}
+    if unified_index.is_unified(index_name):
+        unified = unified_index.UnifiedIndex(index_name)
+        for term in unified.index:
+            for doc_id, positions in unified.positions(term).items():
+                doc = docs.setdefault(doc_id, {})
+                for p in positions:
+                    doc[p] = term
+        return docs
+
+    with open(os.path.join(index_name, 'index.txt'), 'rb') as f:
+        for line in f:
+            term, rest = line.decode('utf-8').rstrip('\n').split('=>', 1)
+            for doc_id, positions in decode_postings(rest).items():
+                doc = docs.setdefault(doc_id, {})
+                for p in positions:
+                    doc[p] = term
+    return docs
+
+
+# adjacent term pairs of the queries in a query log (one query per line,
+# optionally prefixed with its id as in processed_queries.txt)
+def read_query_log(query_log):
+    pairs = set()
+    with open(query_log, 'r') as f:
+        for l in f:
+            l = re.sub(r'^\s*\d+:', ' ', l)
+            tokens = [x.lower() for x in nltk.regexp_tokenize(l, r'(?x)\d[\d.,]*\d|\w[\w-]*\w')]
+            for i in range(1, len(tokens)):
+                pairs.add(pair_key(tokens[i-1], tokens[i]))
+    return pairs
+
+
+# collect the positions of every adjacent pair and write the pairs that occur
+# in at least min_df documents or in the query log
+def build_pair_index(index_name, min_df = MIN_DF, query_log = None):
+    logged = read_query_log(query_log) if query_log else set()
+
+    # pair -> {doc_id: [positions]}
+    pairs = {}
+    for doc_id, doc in read_documents(index_name).items():
+        for p in sorted(doc):
+            if p + 1 in doc:
+                pairs.setdefault(pair_key(doc[p], doc[p+1]), {}).setdefault(doc_id, []).append(p)
+
+    written = 0
+    with open(pair_index_path(index_name), 'wb') as f:
+        for key, doclist in pairs.items():
+            if len(doclist) < min_df and key not in logged:
+                continue
+
+            f.write("{}=>{};".format(key, len(doclist)).encode('utf-8'))
+            f.write('{'.encode('utf-8'))
+            for doc_id, idxlist in sorted(doclist.items()):
+                new_list = []
+                prev = 0
+                # compress this list using delta encoding
+                for x in idxlist:
+                    new_list.append(str(x-prev))
+                    prev = x
+                f.write("[{};{};({})]".format(doc_id, len(new_list), ",".join(new_list)).encode('utf-8'))
+            f.write("}\n".encode('utf-8'))
+            written += 1
+
+    return written
+
+
+class PhraseIndex:
+    # keep the raw postings of every pair, positions are decoded on demand
+    def __init__(self, path):
+        self.postings = {}
+        with open(path, 'rb') as f:
+            for line in f:
+                key, rest = line.decode('utf-8').rstrip('\n').split('=>', 1)
+                self.postings[key] = rest
+
+    def __contains__(self, key):
+        return key in self.postings
+
+    # {doc_id: [positions of the first term]} of a pair
+    def positions(self, key, doc_ids=None):
+        return decode_postings(self.postings[key], doc_ids)
+
+
+# pair index of a positional / unified index (None if it has none)
+def load_phrase_index(index_name):
+    path = pair_index_path(index_name)
+    if not os.path.exists(path):
+        return None
+    return PhraseIndex(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Phrase (next-word) index', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('index_name', nargs='?', default='positional', help='Positional or unified index folder (default: \"%(default)s\")')
+    parser.add_argument('-min_df', type=int, default=MIN_DF, help='Index pairs that occur in at least this many documents (default: \"%(default)s\")')
+    parser.add_argument('-queries', help='Query log (one query per line); its adjacent pairs are indexed regardless of -min_df')
+    args = parser.parse_args()
+    print("args:", args)
+
+    written = build_pair_index(args.index_name, args.min_df, args.queries)
+    print('{} pairs written to {}'.format(written, pair_index_path(args.index_name)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+import os
+import ast
+import sys
+import time
+import hashlib
+import argparse
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Experiment pipeline
+#
+# The standard runs of the README (indexes, baseline / stopped / stemmed
+# searches, their evaluation and the precision-recall graph) as a graph of
+# stages. A stage is a command run in a working folder, with the files and
+# folders it reads and the files it writes; a stage that reads the output of
+# another depends on it.
+#
+# The key of a stage is a sha256 of its command (which holds its parameters),
+# the contents of its inputs and the source of its script and of every local
+# module the script imports. The key of every successful run is kept in
+# .pipeline/state.txt; a stage is run again only if its key changed or one of
+# its outputs is missing, so a changed BM25 parameter reruns the BM25 search
+# and its evaluation but no index. Keys are computed once the stages a stage
+# depends on are done: a rebuilt input with the same contents runs nothing
+# downstream. Stages whose inputs are ready run in parallel, one process
+# each; the output of every run goes to .pipeline/logs/[stage].log.
+#
+#   python3 pipeline.py                        run what is out of date
+#   python3 pipeline.py -n                     list what would run
+#   python3 pipeline.py -set bm25.k1=1.5       change a parameter
+#   python3 pipeline.py eval_baseline_BM25     a stage and what it depends on
+
+STATE_DIR = '.pipeline'
+STATE_FILE = os.path.join(STATE_DIR, 'state.txt')
+LOG_DIR = os.path.join(STATE_DIR, 'logs')
+
+# Default parameters (-set [group].[name]=[value] overrides them)
+PARAMS = {
+    'corpus': 'test-collection/cacm',
+    'queries': 'test-collection/cacm.query.txt',
+    'bm25': {'k1': 1.2, 'k2': 100, 'b': 0.75},
+    'jm': {'lambda': 0.35},
+    }
+
+# Default number of stages run at once
+JOBS = os.cpu_count() or 1
+
+
+class Stage:
+    # command: argument list run in cwd (its first .py argument is the script);
+    # inputs / outputs: paths relative to the pipeline folder; shared: files
+    # the stage may rewrite that other stages write too (caches such as
+    # stem_cache.txt), stages sharing one never run at the same time
+    def __init__(self, name, command, inputs, outputs, cwd = '.', shared = ()):
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.cwd = cwd
+        self.shared = shared
+
+    def script(self):
+        for arg in self.command:
+            if arg.endswith('.py'):
+                return os.path.normpath(os.path.join(self.cwd, arg))
+        return None
+
+
+# the stages of the standard runs
+def stages(params = PARAMS):
+    python = sys.executable
+    corpus, queries = params['corpus'], params['queries']
+    index_files = lambda name: ['{}.txt'.format(name), '{}_stats.txt'.format(name)]
+    bm25, jm = params['bm25'], params['jm']
+
+    result = [
+        Stage('index_baseline', [python, 'baseline_indexer.py', corpus, 'index_baseline'],
+              [corpus], index_files('index_baseline')),
+        Stage('index_stopped', [python, 'baseline_indexer.py', corpus, 'index_stopped', '-stopped'],
+              [corpus, 'test-collection/common_words'], index_files('index_stopped')),
+        Stage('search_stemmed', [python, 'indexer_stemmed.py'],
+              ['test-collection/cacm_stem.txt', 'test-collection/cacm_stem.query.txt'],
+              ['tmp'] + index_files('index_stemmed') + ['result_tables/stemmed_{}.txt'.format(m) for m in ['BM25', 'JM', 'TF-IDF']],
+              shared = ['stem_cache.txt']),
+        Stage('search_baseline_BM25', [python, 'baseline_search_BM25.py', queries, str(bm25['k1']), str(bm25['k2']), str(bm25['b'])],
+              index_files('index_baseline') + [queries], ['result_tables/baseline_BM25.txt']),
+        Stage('search_baseline_JM', [python, 'baseline_search_JM.py', queries, str(jm['lambda'])],
+              index_files('index_baseline') + [queries], ['result_tables/baseline_JM.txt']),
+        Stage('search_baseline_TF-IDF', [python, 'baseline_search_TF-IDF.py', queries],
+              index_files('index_baseline') + [queries], ['result_tables/baseline_TF-IDF.txt']),
+        Stage('search_stopped', [python, 'search_stopped.py'],
+              index_files('index_stopped') + ['test-collection/cacm.query.txt'],
+              ['result_tables/stopped_{}.txt'.format(m) for m in ['BM25', 'JM', 'TF-IDF', 'Dirichlet']]),
+        ]
+
+    # evaluation of every run (the Lucene runs are produced by the Java project;
+    # the stemmed runs use their own doc ids and query numbers and are not evaluated)
+    runs = [('baseline_{}'.format(m), 'baseline_{}'.format(m)) for m in ['BM25', 'JM', 'TF-IDF']]
+    runs += [('stopped_{}'.format(m), 'stopped_{}'.format(m)) for m in ['BM25', 'JM', 'TF-IDF', 'Dirichlet']]
+    runs += [('baseline_lucene', 'baseline_Lucene'), ('query-expansion_lucene', 'KLD_query_expansion_Lucene')]
+    graph_data = []
+    for run, table in runs:
+        eval_file = 'eval_{}.txt'.format(run)
+        result.append(Stage('eval_{}'.format(run), [python, 'evaluator.py', '../result_tables/{}.txt'.format(table), eval_file],
+                            ['result_tables/{}.txt'.format(table), 'test-collection/cacm.rel.txt'],
+                            ['evaluation/' + eval_file, 'evaluation/graph_data/' + eval_file], 'evaluation'))
+        graph_data.append('evaluation/graph_data/' + eval_file)
+
+    # only the declared graph data is plotted (graph_data/ also holds the
+    # curves of runs made outside of the pipeline)
+    result.append(Stage('plot', [python, 'plot_graph.py', 'Precision-Recall-Curve.png'] + [os.path.relpath(g, 'evaluation') for g in graph_data],
+                        graph_data, ['evaluation/Precision-Recall-Curve.png'], 'evaluation'))
+    return result
+
+
+# set a parameter from [group].[name]=[value] (value is a Python literal or a string)
+def set_param(params, assignment):
+    name, sep, value = assignment.partition('=')
+    if not sep:
+        raise ValueError('Invalid parameter: {} (expected name=value)'.format(assignment))
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass
+    *groups, key = name.split('.')
+    target = params
+    for group in groups:
+        target = target[group]
+    if key not in target:
+        raise ValueError('Unknown parameter: {}'.format(name))
+    target[key] = value
+
+
+# local modules a script imports, transitively (the script included)
+def code_files(script):
+    folder = os.path.dirname(script)
+    files = []
+    todo = [script]
+    while todo:
+        path = todo.pop()
+        if path in files or not os.path.exists(path):
+            continue
+        files.append(path)
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                todo.append(os.path.join(folder, name.split('.')[0] + '.py'))
+    return sorted(files)
+
+
+class Hasher:
+    # sha256 of files, cached by size and modification time (a stage rewriting
+    # a file changes its mtime)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.digests = {}
+
+    def file(self, path):
+        stat = os.stat(path)
+        with self.lock:
+            cached = self.digests.get(path)
+        if cached and cached[0] == (stat.st_size, stat.st_mtime_ns):
+            return cached[1]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        with self.lock:
+            self.digests[path] = ((stat.st_size, stat.st_mtime_ns), digest)
+        return digest
+
+    # contents of a file, or of every file of a folder (with their names)
+    def path(self, path):
+        if not os.path.isdir(path):
+            return self.file(path) if os.path.exists(path) else 'missing'
+        h = hashlib.sha256()
+        for folder, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(folder, name)
+                h.update('{}\0{}\0'.format(os.path.relpath(full, path), self.file(full)).encode('utf-8'))
+        return h.hexdigest()
+
+    # key of a stage: its command, inputs and code
+    def stage(self, stage):
+        h = hashlib.sha256()
+        # the interpreter path is not part of the key
+        h.update(repr([stage.cwd] + stage.command[1:]).encode('utf-8'))
+        script = stage.script()
+        for path in (code_files(script) if script else []) + stage.inputs:
+            h.update('{}\0{}\0'.format(path, self.path(path)).encode('utf-8'))
+        return h.hexdigest()
+
+
+def read_state():
+    try:
+        with open(STATE_FILE, 'r') as f:
+            return ast.literal_eval(f.read())
+    except FileNotFoundError:
+        return {}
+
+def write_state(state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(STATE_FILE + '.tmp', 'w') as f:
+        f.write(str(state))
+    os.replace(STATE_FILE + '.tmp', STATE_FILE)
+
+
+# the given stages and every stage they depend on
+def select(all_stages, names):
+    by_name = {s.name: s for s in all_stages}
+    producers = {o: s for s in all_stages for o in s.outputs}
+    unknown = [n for n in names if n not in by_name]
+    if unknown:
+        raise ValueError('Unknown stages: {} ({})'.format(', '.join(unknown), ', '.join(by_name)))
+    selected = set()
+    todo = list(names)
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo.extend(producers[i].name for i in by_name[name].inputs if i in producers)
+    return [s for s in all_stages if s.name in selected]
+
+
+# run a stage's command, its output to its log; True if it succeeded
+def execute(stage):
+    os.makedirs(LOG_DIR, exist_ok=True)
+    with open(os.path.join(LOG_DIR, '{}.log'.format(stage.name)), 'w') as log:
+        code = subprocess.call(stage.command, cwd=stage.cwd, stdout=log, stderr=subprocess.STDOUT)
+    return code == 0 and all(os.path.exists(o) for o in stage.outputs)
+
+
+# run the stages that are out of date, jobs at a time; returns {stage: status}
+# (ran, up to date, failed, blocked by a failed dependency; would run with dry_run)
+def run(all_stages, jobs = JOBS, force = (), dry_run = False, out = sys.stdout):
+    state = read_state()
+    hasher = Hasher()
+    producers = {o: s.name for s in all_stages for o in s.outputs}
+    depends = {s.name: {producers[i] for i in s.inputs if i in producers} for s in all_stages}
+    status = {}
+    pending = list(all_stages)
+    running = {}
+
+    def report(stage, message):
+        status[stage.name] = message
+        print('{:<28} {}'.format(stage.name, message), file=out, flush=True)
+
+    # True if a running stage rewrites a shared file of stage
+    def busy(stage):
+        return any(f in other.shared for other, _, _ in running.values() for f in stage.shared)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            # start every stage whose dependencies are done
+            progress = True
+            while progress:
+                progress = False
+                for stage in list(pending):
+                    deps = depends[stage.name]
+                    if not all(d in status for d in deps) or busy(stage):
+                        continue
+                    pending.remove(stage)
+                    progress = True
+                    if any(status[d] in ('failed', 'blocked') for d in deps):
+                        report(stage, 'blocked')
+                        continue
+                    if dry_run and any(status[d] == 'would run' for d in deps):
+                        report(stage, 'would run')
+                        continue
+                    key = hasher.stage(stage)
+                    if stage.name not in force and state.get(stage.name) == key and all(os.path.exists(o) for o in stage.outputs):
+                        report(stage, 'up to date')
+                    elif dry_run:
+                        report(stage, 'would run')
+                    else:
+                        print('{:<28} running'.format(stage.name), file=out, flush=True)
+                        running[pool.submit(execute, stage)] = (stage, key, time.time())
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, key, start = running.pop(future)
+                if future.result():
+                    # the key of the inputs it ran on
+                    state[stage.name] = key
+                    write_state(state)
+                    report(stage, 'ran ({:.1f}s)'.format(time.time() - start))
+                else:
+                    state.pop(stage.name, None)
+                    write_state(state)
+                    report(stage, 'failed (see {})'.format(os.path.join(LOG_DIR, '{}.log'.format(stage.name))))
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Experiment pipeline', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('stages', nargs='*', help='Run only these stages and the stages they depend on (default: all)')
+    parser.add_argument('-n', action='store_true', help='Dry run: list the stages that would run')
+    parser.add_argument('-jobs', type=int, default=JOBS, help='Stages run at once (default: \"%(default)s\")')
+    parser.add_argument('-set', action='append', default=[], help='Override a parameter, e.g. -set bm25.k1=1.5 -set jm.lambda=0.2\n(defaults: {})'.format(PARAMS))
+    parser.add_argument('-force', action='append', default=[], help='Run this stage even if it is up to date')
+    parser.add_argument('-list', action='store_true', help='List the stages with their inputs and outputs')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    params = ast.literal_eval(repr(PARAMS))
+    for assignment in args.set:
+        set_param(params, assignment)
+    all_stages = stages(params)
+
+    if args.list:
+        for stage in all_stages:
+            print('{}\n\tin:  {}\n\tout: {}'.format(stage.name, ' '.join(stage.inputs), ' '.join(stage.outputs)))
+        return
+
+    selected = select(all_stages, args.stages) if args.stages else all_stages
+    status = run(selected, args.jobs, set(args.force), args.n)
+    if any(s in ('failed', 'blocked') for s in status.values()):
+        exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,14 @@ import os
 import argparse
 from bs4 import BeautifulSoup
 import nltk
+import term_dictionary
+import postings_codec
+import doc_reorder
+import doc_metadata
 
 class InvertedIndexer:
     def create_positional_index(self):
 
-        positional_index = {}
-        N = 0
         folder_path = self.corpus_path
 
         # iterate over each document
@@ -18,7 +20,6 @@ class InvertedIndexer:
 
             # current path of doc
             file_path = os.path.join(folder_path, file_name)
-            N += 1
 
             with open(file_path, 'rb') as f:
                 html = f.read()
@@ -26,23 +27,41 @@ class InvertedIndexer:
 
             print('Parsing {}'.format(file_name))
 
+            # keep the trailing block (date, CR categories, citations) as metadata
+            self.metadata[file_name[:-5]] = doc_metadata.parse_tail(soup.get_text(), file_name[:-5])
+
             # tokenize words
             all_words = nltk.regexp_tokenize(soup.get_text(), r'(?x)\d[\d.,]*\d|\w[\w-]*\w')
             all_words = [x.lower() for x in all_words]
-            
-            # remove all numbers towards the end of documents
-            for i in range(len(all_words)-1, -1, -1):
-                try:
-                    int(all_words[i])
-                    all_words.pop()
-                except:
-                    break
-
-            # create positional index for current word
-            for i, word in enumerate(all_words):
-                if not positional_index.get(word):
-                    positional_index[word] = {}
-                positional_index[word][file_name] = positional_index[word].get(file_name, []) + [i]
+
+            self.add_document(file_name, all_words)
+
+        self.write_index()
+
+    # add the (lower cased) tokens of a document to the positional index
+    def add_document(self, file_name, all_words):
+        positional_index = self.positional_index
+        self.N += 1
+
+        # remove all numbers towards the end of documents
+        all_words = list(all_words)
+        for i in range(len(all_words)-1, -1, -1):
+            try:
+                int(all_words[i])
+                all_words.pop()
+            except:
+                break
+
+        # create positional index for current word
+        for i, word in enumerate(all_words):
+            if not positional_index.get(word):
+                positional_index[word] = {}
+            positional_index[word].setdefault(file_name, []).append(i)
+
+    # write the positional index, meta data and term dictionary
+    def write_index(self):
+        positional_index = self.positional_index
+        N = self.N
         
         with open('{}/index.txt'.format(self.index_path), 'wb') as f:
 
@@ -66,13 +85,33 @@ class InvertedIndexer:
         with open('{}/meta.txt'.format(self.index_path), 'w') as f:
             f.write('N:{}'.format(N))
 
-    def __init__(self, corpus_path, index_path):
+        # sorted, front-coded term dictionary (for prefix and wildcard queries)
+        term_dictionary.write_term_dictionary(positional_index.keys(), '{}/terms.txt'.format(self.index_path))
+
+        # date, CR categories and citation links of the documents (for filtered search)
+        if self.metadata:
+            doc_metadata.write_metadata(self.metadata, '{}/metadata.txt'.format(self.index_path))
+
+        # compressed copy of the postings and positions with the chosen codec
+        if self.codec:
+            positions = {term: {docname[:-5]: idxlist for docname, idxlist in doclist.items()} for term, doclist in positional_index.items()}
+            index = {term: {doc_id: len(idxlist) for doc_id, idxlist in doclist.items()} for term, doclist in positions.items()}
+            docs = doc_reorder.bisection_order(index) if self.reorder else None
+            postings_codec.write_codec_index(postings_codec.codec_index_path(self.index_path), self.codec, index, positions, docs)
+
+    def __init__(self, corpus_path, index_path, codec=None, reorder=False):
         self.corpus_path = corpus_path
         self.index_path = index_path
+        self.codec = codec
+        self.reorder = reorder
         if not os.path.exists(self.index_path):
             os.makedirs(self.index_path)
         self.corpus_path_mapping = {}
 
+        self.positional_index = {}
+        self.metadata = {}
+        self.N = 0
+
         for filename in os.listdir(corpus_path):
             if filename.endswith(".html"):
                 self.corpus_path_mapping[filename[:-5]] = os.path.join(corpus_path, filename)
@@ -82,8 +121,10 @@ def main():
     parser = argparse.ArgumentParser(description='Indexer', formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('-corpus', default="./test-collection/cacm/", help='Folder for which index is generated. (default: \"%(default)s\")')
     parser.add_argument('-index', default="positional", help='Name of index (default: \"%(default)s\")')
+    parser.add_argument('-codec', choices=sorted(postings_codec.CODECS), help='Also write the postings and positions compressed with this codec ([index]/codec.txt / .bin)')
+    parser.add_argument('-reorder', action='store_true', help='Number the docs of the compressed copy by content similarity (see doc_reorder.py)')
     args = parser.parse_args()
-    iidx = InvertedIndexer(args.corpus, args.index)
+    iidx = InvertedIndexer(args.corpus, args.index, args.codec, args.reorder)
     iidx.create_positional_index()
 
 if __name__ == '__main__':
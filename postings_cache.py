@@ -0,0 +1,314 @@
+import os
+import sys
+import ast
+from collections import OrderedDict
+import unified_index
+import postings_codec
+
+# Decoded postings cache
+#
+# Sits between an on-disk (or compressed, see CodecPostings) index and the
+# scorers: postings (and positions) are decoded the first time a term is used
+# and kept, keyed by term, within a hard byte budget. Entries are evicted least recently used first.
+# An entry is only admitted if it fits in MAX_ENTRY_FRACTION of the budget
+# and, when it has to push other entries out, if none of them has been
+# requested more often than it (so one long, rarely used list cannot flush the
+# hot terms). Request counts are estimated with a fixed size FrequencySketch
+# that is halved periodically, so they follow recent popularity and do not
+# grow with the number of distinct keys.
+
+# Default byte budget
+CACHE_BYTES = 16 * 1024 * 1024
+
+# Largest entry admitted, as a fraction of the budget
+MAX_ENTRY_FRACTION = 0.25
+
+# Counters per row of the frequency sketch
+SKETCH_WIDTH = 4096
+
+# Rows (independent hashes) of the frequency sketch
+SKETCH_DEPTH = 4
+
+# Requests after which every count of the sketch is halved
+SKETCH_SAMPLE = 10 * SKETCH_WIDTH
+
+
+# approximate in-memory size of decoded postings (dicts / lists of strings
+# and ints, nested)
+def sizeof(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(sizeof(v) for v in value)
+    return size
+
+
+class FrequencySketch:
+    # Approximate request counts of keys in depth x width counters (count-min:
+    # a key increments one counter per row, its estimate is the smallest of
+    # them). All counts are halved every sample requests (TinyLFU aging).
+    def __init__(self, width = SKETCH_WIDTH, depth = SKETCH_DEPTH, sample = SKETCH_SAMPLE):
+        self.width = width
+        self.sample = sample
+        self.table = [[0] * width for _ in range(depth)]
+        self.additions = 0
+
+    # counter of the key in every row
+    def slots(self, key):
+        return [hash((row, key)) % self.width for row in range(len(self.table))]
+
+    def add(self, key):
+        for row, slot in zip(self.table, self.slots(key)):
+            row[slot] += 1
+
+        self.additions += 1
+        if self.additions >= self.sample:
+            for row in self.table:
+                for slot in range(self.width):
+                    row[slot] >>= 1
+            self.additions //= 2
+
+    def estimate(self, key):
+        return min(row[slot] for row, slot in zip(self.table, self.slots(key)))
+
+
+class PostingsCache:
+    # load(key) decodes the value of a key that is not cached
+    def __init__(self, load, budget = CACHE_BYTES, size = sizeof):
+        self.load = load
+        self.budget = budget
+        self.size = size
+
+        # key -> (value, size), least recently used first
+        self.entries = OrderedDict()
+        # estimated number of recent requests of every key
+        self.frequency = FrequencySketch()
+        self.resident_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    # value of a key; every call counts as one access in the admission sketch,
+    # so callers request a key once per use (Index.fetch: once per query term)
+    def get(self, key):
+        self.frequency.add(key)
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        value = self.load(key)
+        # misses of keys the loader does not know are not cached
+        if value is not None:
+            self.admit(key, value)
+        return value
+
+    # add a decoded value if the admission policy allows it
+    def admit(self, key, value):
+        size = self.size(value)
+        if size > self.budget * MAX_ENTRY_FRACTION:
+            self.rejected += 1
+            return
+
+        # least recently used entries that have to go to make room
+        victims = []
+        free = self.budget - self.resident_bytes
+        for victim, (_, victim_size) in self.entries.items():
+            if free >= size:
+                break
+            victims.append(victim)
+            free += victim_size
+
+        frequency = self.frequency.estimate(key)
+        if any(self.frequency.estimate(victim) > frequency for victim in victims):
+            self.rejected += 1
+            return
+
+        for victim in victims:
+            _, victim_size = self.entries.pop(victim)
+            self.resident_bytes -= victim_size
+            self.evictions += 1
+
+        self.entries[key] = (value, size)
+        self.resident_bytes += size
+
+    # fraction of requests answered from the cache
+    def hit_rate(self):
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate(),
+            'resident_bytes': self.resident_bytes,
+            'budget': self.budget,
+            'entries': len(self.entries),
+            'evictions': self.evictions,
+            'rejected': self.rejected
+            }
+
+    # print the cache statistics
+    def report(self, out=sys.stdout):
+        stats = self.stats()
+        out.write('\nPostings cache: {hits} hits, {misses} misses (hit rate {hit_rate:.3f}), '
+                  '{resident_bytes} of {budget} bytes resident in {entries} entries, '
+                  '{evictions} evicted, {rejected} not admitted\n'.format(**stats))
+
+
+# byte offset of the line of every term of a text index file
+# (the term is everything before separator)
+def line_offsets(path, separator):
+    offsets = {}
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                offsets[line.split(separator, 1)[0].decode('utf-8')] = offset
+            offset += len(line)
+    return offsets
+
+
+# read the line at offset
+def read_line(path, offset):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.readline().decode('utf-8')
+
+
+# byte offset of every term's line, its df and its cf (None for a text index,
+# whose lines do not hold it) from a frequency or unified index file
+def term_table(path, unified):
+    offsets, dfs = {}, {}
+    cfs = {} if unified else None
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                if unified:
+                    # EX: mollin<TAB>2<TAB>2<TAB>0<TAB>...
+                    term, df, cf, _ = line.split(b'\t', 3)
+                    cfs[term.decode('utf-8')] = int(cf)
+                else:
+                    # EX: mollin: 2, {...}
+                    term, rest = line.split(b':', 1)
+                    df = rest.split(b',', 1)[0]
+                term = term.decode('utf-8')
+                offsets[term] = offset
+                dfs[term] = int(df)
+            offset += len(line)
+    return offsets, dfs, cfs
+
+
+class DiskPostings:
+    # {term: {doc_id: tf}} of a frequency or unified index, read from disk
+    # one term at a time through a PostingsCache. Only the offset, df (and cf)
+    # of every term's line is kept in memory (they can be passed in by a
+    # reader that already scanned the file).
+    def __init__(self, index_name, budget = CACHE_BYTES, profiler = None, offsets = None, dfs = None, cfs = None):
+        self.profiler = profiler
+        self.unified = unified_index.is_unified(index_name)
+        if self.unified:
+            self.path = os.path.join(index_name, 'postings.txt')
+        else:
+            self.path = '{}.txt'.format(index_name)
+        if offsets is None:
+            offsets, dfs, cfs = term_table(self.path, self.unified)
+        self.offsets = offsets
+        self.dfs = dfs
+        self.cfs = cfs
+        self.cache = PostingsCache(self.decode, budget)
+
+    # document frequency of a term (without decoding its postings)
+    def df(self, term):
+        return self.dfs.get(term, 0)
+
+    # collection frequency of a term, None if the index does not store it
+    def cf(self, term):
+        if self.cfs is None:
+            return None
+        return self.cfs.get(term, 0)
+
+    # decode the postings of a term from its line
+    def decode(self, term):
+        line = read_line(self.path, self.offsets[term])
+        if self.profiler:
+            self.profiler.count('bytes_decoded', len(line))
+
+        if self.unified:
+            # EX: mollin<TAB>2<TAB>2<TAB>0<TAB>eu:1,carbon_tetrachloride:1
+            return unified_index.decode_frequencies(line.rstrip('\n').split('\t')[4])
+
+        # EX: mollin: 2, {'carbon_tetrachloride': 1, 'eu': 1}
+        return ast.literal_eval(line.split(":", 1)[1].split(",", 1)[1].strip())
+
+    def __contains__(self, term):
+        return term in self.offsets
+
+    def __getitem__(self, term):
+        if term not in self.offsets:
+            raise KeyError(term)
+        return self.cache.get(term)
+
+    def get(self, term, default=None):
+        if term not in self.offsets:
+            return default
+        return self.cache.get(term)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def keys(self):
+        return self.offsets.keys()
+
+
+class CodecPostings(DiskPostings):
+    # {term: {doc_id: tf}} of the compressed copy of an index (postings_codec),
+    # held coded in memory and decoded one term at a time through a
+    # PostingsCache. Doc numbers are mapped back to doc ids with the doc table
+    # of the copy, so a copy written with reordered doc numbers (doc_reorder)
+    # ranks the same as the index it was built from.
+    def __init__(self, index_name, budget = CACHE_BYTES, profiler = None):
+        self.profiler = profiler
+        self.codec_index = postings_codec.load_codec_index(postings_codec.codec_index_path(index_name))
+        # the mapping methods of DiskPostings only use the terms of offsets
+        self.offsets = self.codec_index.entries
+        self.cache = PostingsCache(self.decode, budget)
+
+    # df from the dictionary entry of the term
+    def df(self, term):
+        entry = self.codec_index.entries.get(term)
+        return entry[0] if entry else 0
+
+    # cf from the tf stream of the term (the doc gaps are not decoded)
+    def cf(self, term):
+        if term not in self.codec_index.entries:
+            return 0
+        return int(self.codec_index.tfs(term).sum())
+
+    # decode the doc gaps and tfs of a term
+    def decode(self, term):
+        _, _, doc_len, tf_len, _ = self.codec_index.entries[term]
+        if self.profiler:
+            self.profiler.count('bytes_decoded', doc_len + tf_len)
+        return self.codec_index.freqs(term)
+
+
+# read the stats of a frequency or unified index
+def read_stats(index_name):
+    if unified_index.is_unified(index_name):
+        path = os.path.join(index_name, 'stats.txt')
+    else:
+        path = '{}_stats.txt'.format(index_name)
+    with open(path, 'r') as stats_file:
+        return ast.literal_eval(stats_file.read())
@@ -0,0 +1,287 @@
+import os
+import numpy as np
+
+# Postings compression codecs
+#
+# A codec compresses a stream of non-negative integers in blocks of BLOCK_SIZE
+# values and decodes a whole block into a NumPy array at once. Doc ids are
+# stored as gaps between sorted doc numbers, positions as gaps within a doc
+# (as in the positional index), tfs as they are.
+#
+#   vbyte  variable byte: 7 bits per byte, the high bit marks the last byte
+#   ef     Elias-Fano over the prefix sums of the block: low bits packed,
+#          high bits unary coded in a bit vector
+#   pfor   frame of reference (block minimum) + b bit slots, where b covers 90%
+#          of the block; larger values are patched from an exception list
+#
+# A compressed index is written next to the index it was built from:
+#
+#   [base].txt  codec, doc table (doc id of every doc number) and one line per term:
+#               term<TAB>df<TAB>doc bytes<TAB>tf bytes<TAB>position bytes
+#   [base].bin  the doc gap, tf and position streams of every term (in the
+#               order of the dictionary, so offsets are running sums)
+#
+# The indexers write it with -codec; codec_report.py compares the codecs on
+# existing indexes.
+
+# Number of values coded together (and decoded with one NumPy call)
+BLOCK_SIZE = 128
+
+
+# variable byte code of each value
+def vbyte_encode(values):
+    out = bytearray()
+    for v in values:
+        v = int(v)
+        while v >= 128:
+            out.append(v & 127)
+            v >>= 7
+        out.append(v | 128)
+    return bytes(out)
+
+
+# decode n variable byte coded values
+def vbyte_decode(data, n):
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    b = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(b & 128)[:n]
+    b = b[:ends[-1] + 1]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = (np.arange(len(b)) - np.repeat(starts, ends - starts + 1)) * 7
+    return np.add.reduceat((b & 127).astype(np.int64) << shifts, starts)
+
+
+# read one variable byte coded value at pos, return it and the next position
+def read_vbyte(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 127) << shift
+        if byte & 128:
+            return value, pos
+        shift += 7
+
+
+# pack the low width bits of every value
+def pack_bits(values, width):
+    if width == 0:
+        return b''
+    bits = (values[:, None] >> np.arange(width)) & 1
+    return np.packbits(bits.astype(np.uint8).ravel(), bitorder='little').tobytes()
+
+
+# unpack n values of width bits
+def unpack_bits(data, n, width):
+    if width == 0:
+        return np.zeros(n, dtype=np.int64)
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=n * width, bitorder='little')
+    return bits.reshape(n, width).astype(np.int64) @ (1 << np.arange(width, dtype=np.int64))
+
+
+class VByteCodec:
+    name = 'vbyte'
+
+    def encode_block(self, values):
+        return vbyte_encode(values)
+
+    def decode_block(self, data, n):
+        return vbyte_decode(data, n)
+
+
+class EliasFanoCodec:
+    name = 'ef'
+
+    # the prefix sums x of the values are monotone; with l = floor(log2(u / n))
+    # the low l bits of each x are packed and the high bits x >> l are stored
+    # as set bits at (x >> l) + i
+    def encode_block(self, values):
+        x = np.cumsum(values)
+        n = len(x)
+        l = max(0, (int(x[-1] + 1) // n).bit_length() - 1)
+
+        high = x >> l
+        high_bits = np.zeros(int(high[-1]) + n, dtype=np.uint8)
+        high_bits[high + np.arange(n)] = 1
+
+        return bytes([l]) + pack_bits(x & ((1 << l) - 1), l) + np.packbits(high_bits, bitorder='little').tobytes()
+
+    def decode_block(self, data, n):
+        l = data[0]
+        low_len = (n * l + 7) // 8
+        low = unpack_bits(data[1:1 + low_len], n, l)
+        high_bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8, offset=1 + low_len), bitorder='little')
+        high = np.flatnonzero(high_bits)[:n] - np.arange(n)
+        return np.diff((high << l) | low, prepend=0)
+
+
+class PForCodec:
+    name = 'pfor'
+
+    # header: block minimum, slot width b and number of exceptions; then the
+    # packed slots, the exception indexes and their high bits
+    def encode_block(self, values):
+        base = int(values.min())
+        v = values - base
+        width = int(np.sort(v)[int(0.9 * (len(v) - 1))]).bit_length()
+        exceptions = np.flatnonzero(v >> width)
+
+        return (vbyte_encode([base, width, len(exceptions)]) + pack_bits(v & ((1 << width) - 1), width)
+                + vbyte_encode(exceptions) + vbyte_encode(v[exceptions] >> width))
+
+    def decode_block(self, data, n):
+        base, pos = read_vbyte(data, 0)
+        width, pos = read_vbyte(data, pos)
+        count, pos = read_vbyte(data, pos)
+        slots_len = (n * width + 7) // 8
+
+        values = unpack_bits(data[pos:pos + slots_len], n, width)
+        if count:
+            patches = vbyte_decode(data[pos + slots_len:], 2 * count)
+            values[patches[:count]] |= patches[count:] << width
+        return values + base
+
+
+# Available codecs by name
+CODECS = {codec.name: codec for codec in [VByteCodec(), EliasFanoCodec(), PForCodec()]}
+
+
+# code a stream of non-negative integers block by block (each block is
+# prefixed with its length in bytes)
+def encode(codec, values):
+    values = np.asarray(values, dtype=np.int64)
+    out = bytearray()
+    for i in range(0, len(values), BLOCK_SIZE):
+        payload = codec.encode_block(values[i:i + BLOCK_SIZE])
+        out += vbyte_encode([len(payload)])
+        out += payload
+    return bytes(out)
+
+
+# decode a stream of n integers
+def decode(codec, data, n):
+    data = memoryview(data)
+    blocks = []
+    pos = 0
+    for i in range(0, n, BLOCK_SIZE):
+        size, pos = read_vbyte(data, pos)
+        blocks.append(codec.decode_block(data[pos:pos + size], min(BLOCK_SIZE, n - i)))
+        pos += size
+    if not blocks:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(blocks)
+
+
+# base path of the compressed copy of an index
+# (positional and unified indexes are folders)
+def codec_index_path(index_name):
+    if os.path.isdir(index_name):
+        return os.path.join(index_name, 'codec')
+    return '{}_codec'.format(index_name)
+
+
+# compress postings {term: {doc_id: tf}} (and positions {term: {doc_id: [positions]}})
+# with docs numbered in the order of docs (by name if not given, see doc_reorder)
+# returns the doc table, the dictionary entries and the coded streams
+def encode_index(codec, index, positions=None, docs=None):
+    if docs is None:
+        docs = sorted(set(d for freqs in index.values() for d in freqs))
+    doc_numbers = {d: i for i, d in enumerate(docs)}
+
+    entries = []
+    data = bytearray()
+    for term, freqs in index.items():
+        ordered = sorted(freqs, key = lambda d: doc_numbers[d])
+        numbers = np.array([doc_numbers[d] for d in ordered], dtype=np.int64)
+
+        doc_bytes = encode(codec, np.diff(numbers, prepend=0))
+        tf_bytes = encode(codec, [freqs[d] for d in ordered])
+        pos_bytes = b''
+        if positions is not None:
+            deltas = []
+            for d in ordered:
+                prev = 0
+                for x in positions[term][d]:
+                    deltas.append(x - prev)
+                    prev = x
+            pos_bytes = encode(codec, deltas)
+
+        entries.append((term, len(ordered), len(data), len(doc_bytes), len(tf_bytes), len(pos_bytes)))
+        data += doc_bytes + tf_bytes + pos_bytes
+
+    return docs, entries, bytes(data)
+
+
+# compress an index in memory and write it to [base].txt / [base].bin
+def write_codec_index(base, codec_name, index, positions=None, docs=None):
+    docs, entries, data = encode_index(CODECS[codec_name], index, positions, docs)
+
+    with open('{}.bin'.format(base), 'wb') as f:
+        f.write(data)
+    with open('{}.txt'.format(base), 'w') as f:
+        f.write('{}\n'.format(codec_name))
+        f.write(' '.join(docs) + '\n')
+        for term, df, _, doc_len, tf_len, pos_len in entries:
+            f.write('{}\t{}\t{}\t{}\t{}\n'.format(term, df, doc_len, tf_len, pos_len))
+
+
+class CodecIndex:
+    # docs: doc table, entries: dictionary entries, data: coded streams
+    def __init__(self, codec_name, docs, entries, data):
+        self.codec = CODECS[codec_name]
+        self.docs = docs
+        self.entries = {e[0]: e[1:] for e in entries}
+        self.data = memoryview(data)
+
+    def __contains__(self, term):
+        return term in self.entries
+
+    # doc numbers (indexes into docs) and tfs of a term as NumPy arrays
+    def postings(self, term):
+        df, offset, doc_len, tf_len, _ = self.entries[term]
+        gaps = decode(self.codec, self.data[offset:offset + doc_len], df)
+        tfs = decode(self.codec, self.data[offset + doc_len:offset + doc_len + tf_len], df)
+        return np.cumsum(gaps), tfs
+
+    # tfs of a term as a NumPy array (in doc number order)
+    def tfs(self, term):
+        df, offset, doc_len, tf_len, _ = self.entries[term]
+        return decode(self.codec, self.data[offset + doc_len:offset + doc_len + tf_len], df)
+
+    # positions of a term as one NumPy array: the first tfs[0] belong to the
+    # first doc of its postings, the next tfs[1] to the second, ...
+    def positions(self, term, tfs=None):
+        df, offset, doc_len, tf_len, pos_len = self.entries[term]
+        if tfs is None:
+            tfs = self.tfs(term)
+        start = offset + doc_len + tf_len
+        deltas = decode(self.codec, self.data[start:start + pos_len], int(tfs.sum()))
+
+        # undo the delta coding within each doc
+        total = np.cumsum(deltas)
+        firsts = np.cumsum(tfs) - tfs
+        return total - np.repeat(total[firsts] - deltas[firsts], tfs)
+
+    # {doc_id: tf} of a term
+    def freqs(self, term):
+        numbers, tfs = self.postings(term)
+        return {self.docs[i]: int(tf) for i, tf in zip(numbers, tfs)}
+
+
+# read a compressed index written by write_codec_index
+def load_codec_index(base):
+    with open('{}.txt'.format(base), 'r') as f:
+        codec_name = f.readline().strip()
+        docs = f.readline().split()
+        entries = []
+        offset = 0
+        for l in f:
+            term, df, doc_len, tf_len, pos_len = l.rstrip('\n').split('\t')
+            doc_len, tf_len, pos_len = int(doc_len), int(tf_len), int(pos_len)
+            entries.append((term, int(df), offset, doc_len, tf_len, pos_len))
+            offset += doc_len + tf_len + pos_len
+    with open('{}.bin'.format(base), 'rb') as f:
+        data = f.read()
+    return CodecIndex(codec_name, docs, entries, data)
@@ -0,0 +1,366 @@
+import os
+import ast
+import math
+import time
+import heapq
+import argparse
+import numpy as np
+
+# Cost-based query planner
+#
+# index_search scores a query term at a time by default (taat): the postings of
+# every query term are scanned and every doc containing one of them is scored.
+# With a planner set (Index.set_planner) each query is evaluated with the
+# strategy whose estimated cost is lowest:
+#
+#   taat         exhaustive term at a time scoring (every candidate scored)
+#   daat         document at a time over the sorted postings with MaxScore
+#                pruning: the terms whose score upper bounds together cannot
+#                lift a doc over the k-th best score so far are not iterated,
+#                only looked up, and a doc is dropped as soon as its partial
+#                score plus the bounds of its remaining terms falls below it
+#   conjunctive  the docs containing every query term are scored first; their
+#                k-th best score starts daat with a high threshold
+#
+# All three return the same top k (ties broken by doc id): daat and
+# conjunctive only drop docs whose upper bound is below the k-th best score,
+# and the docs they keep are scored with the same sums, in the same order, as
+# taat. The upper bound of a term is its highest score over its postings
+# (computed on first use). With a citation prior set (Index.set_prior) the k-th
+# best score is that of score + prior: a doc is bounded by the highest prior
+# until it is known, and by its own prior from then on.
+#
+# The cost of a strategy is estimated in ms from the statistics of the query
+# terms, as a linear function of
+#
+#   1, postings (sum of df), candidates (estimated size of the union of the
+#   postings), terms, terms x shortest postings list
+#
+# The coefficients are fitted on a query log by "python3 query_planner.py
+# calibrate" and written next to the index as [index]_planner.txt (or
+# [index]/planner.txt) for every scoring mode. The default coefficients only
+# fit index_baseline, so an index (or mode) that has not been calibrated is
+# evaluated with taat only. The chosen plan is logged in the profile trace of
+# the query (and printed with -explain).
+
+STRATEGIES = ['taat', 'daat', 'conjunctive']
+
+# Default latency target (ms); plans estimated over it are counted
+LATENCY_TARGET_MS = 5.0
+
+# Default cost coefficients (ms per unit of each feature; fitted for BM25 on
+# index_baseline, only the taat estimate is used for an uncalibrated index)
+COSTS = {
+    'taat': [0.0, 0.0019, 0.0016, 0.04, 0.0],
+    'daat': [0.0, 0.00025, 0.0004, 0.4, 0.0],
+    'conjunctive': [0.0, 0.00022, 0.00035, 0.4, 0.0],
+    }
+
+# Margin below the threshold for a doc to be dropped (scores summed in a
+# different order may differ in the last bits)
+EPSILON = 1e-9
+
+
+# path of the planner costs of an index (positional and unified indexes are folders)
+def planner_path(index_name):
+    if os.path.isdir(index_name):
+        return os.path.join(index_name, 'planner.txt')
+    return '{}_planner.txt'.format(index_name)
+
+
+# cost features of a query from the df of its scored terms (one per token,
+# repeated terms included) and the number of docs N
+def features(dfs, N):
+    if not dfs:
+        return [1, 0, 0, 0, 0]
+    unique = set(dfs)
+    missing = 1.0
+    for df in unique:
+        missing *= 1 - df / N
+    return [1, sum(dfs), N * (1 - missing), len(dfs), len(dfs) * min(dfs)]
+
+
+class QueryPlan:
+    def __init__(self, strategy, costs, features, target):
+        self.strategy = strategy
+        # estimated ms of every strategy considered
+        self.costs = costs
+        self.features = features
+        self.target = target
+
+    def estimate(self):
+        return self.costs[self.strategy]
+
+    def meets_target(self):
+        return self.estimate() <= self.target
+
+    def info(self):
+        return {'strategy': self.strategy, 'estimate_ms': round(self.estimate(), 4),
+                'postings': self.features[1], 'terms': self.features[3],
+                'over_target': not self.meets_target()}
+
+    def __str__(self):
+        return '{} ({}; {} terms, {} postings{})'.format(
+            self.strategy, ', '.join('{} {:.3f} ms'.format(s, c) for s, c in self.costs.items()),
+            self.features[3], self.features[1], '' if self.meets_target() else ', over target')
+
+
+class Planner:
+    # costs: {strategy: coefficients} of the strategies it may choose
+    def __init__(self, costs = COSTS, target = LATENCY_TARGET_MS):
+        self.costs = costs
+        self.target = target
+        # term -> upper bound of its score for a doc
+        self.bounds = {}
+        # upper bound of the doc length part of a term's score
+        self.norm = None
+
+    # plan of a query from the df of its scored terms; only taat if exhaustive
+    # scores are needed (e.g. to fuse rankings)
+    def plan(self, dfs, N, exhaustive = False):
+        f = features(dfs, N)
+        strategies = ['taat'] if exhaustive or not dfs else [s for s in STRATEGIES if s in self.costs]
+        costs = {s: max(0.0, float(np.dot(self.costs[s], f))) for s in strategies}
+        return QueryPlan(min(strategies, key = lambda s: costs[s]), costs, f, self.target)
+
+    # highest score a term adds to a doc containing it (postings: the term's
+    # postings if already fetched)
+    def bound(self, index, term, n, cq, postings = None):
+        ub = self.bounds.get(term)
+        if ub is None:
+            if postings is None:
+                postings = index.index.get(term, {})
+            ub = max((index.term_match(f, n, cq, index.doc_lens[d]) for d, f in postings.items()), default=0)
+            self.bounds[term] = ub
+        return ub
+
+    # highest doc length part of a term's score (0 for BM25 and TF-IDF)
+    def norm_bound(self, index):
+        if self.norm is None:
+            self.norm = max((index.doc_norm(dl) for dl in set(index.doc_lens.values())), default=0)
+        return self.norm
+
+
+# {doc_id: score} of the docs that can be in the top k of a query, evaluated
+# document at a time with MaxScore pruning (threshold: a known lower bound of
+# the k-th best score, plus prior if the index has one; docs in done are not
+# scored again; fetched: the postings of the query terms if already read, see
+# Index.fetch). The scores are returned without the prior.
+def daat(index, planner, query_tokens, k, allowed = None, threshold = -math.inf, scores = None, done = (), fetched = None):
+    profiler = index.profiler
+    if fetched is None:
+        fetched = index.fetch(query_tokens)
+    # prior of every doc and the highest one (a doc gains at most that much)
+    prior = index.prior
+    high = index.prior_bounds[1] if prior is not None else 0
+    # scored tokens in query order (as in Index.score), and their terms
+    entries = []
+    terms = {}
+    background = 0
+    for q in query_tokens:
+        n = index.term_df(q)
+        if not n:
+            continue
+        cq = index.term_cf(q, fetched[q])
+        entries.append(q)
+        background += index.term_background(n, cq)
+        if q in terms:
+            terms[q][0] += 1
+        else:
+            terms[q] = [1, n, cq]
+
+    # terms by ascending upper bound (a doc without the term gets 0 from it)
+    ordered = []
+    for term, (m, n, cq) in terms.items():
+        postings = fetched[term]
+        ordered.append((m * max(planner.bound(index, term, n, cq, postings), 0), term, m, n, cq, postings, index.sorted_postings(term, postings)))
+    ordered.sort(key = lambda t: (t[0], t[1]))
+    prefix = [0]
+    for t in ordered:
+        prefix.append(prefix[-1] + t[0])
+
+    base_bound = background + len(entries) * planner.norm_bound(index) + high
+
+    scores = scores if scores is not None else {}
+    top = [s + (prior[d] if prior is not None else 0) for d, s in scores.items()]
+    top = [s for s in top if s >= threshold]
+    heapq.heapify(top)
+    while len(top) > k:
+        heapq.heappop(top)
+
+    # terms[:essential] cannot lift a doc over the threshold on their own
+    def first_essential():
+        e = 0
+        while e < len(ordered) and base_bound + prefix[e + 1] + EPSILON < threshold:
+            e += 1
+        return e
+
+    essential = first_essential()
+    pos = [0] * len(ordered)
+    scored = 0
+    while essential < len(ordered):
+        # next doc of the essential lists
+        doc_id = None
+        for i in range(essential, len(ordered)):
+            ids = ordered[i][6]
+            if pos[i] < len(ids) and (doc_id is None or ids[pos[i]] < doc_id):
+                doc_id = ids[pos[i]]
+        if doc_id is None:
+            break
+        for i in range(essential, len(ordered)):
+            ids = ordered[i][6]
+            if pos[i] < len(ids) and ids[pos[i]] == doc_id:
+                pos[i] += 1
+
+        if doc_id in done or (allowed is not None and doc_id not in allowed):
+            continue
+
+        # essential terms first, then the others by descending bound while the
+        # doc can still reach the threshold
+        dl = index.doc_lens[doc_id]
+        lift = prior[doc_id] if prior is not None else 0
+        partial = background + len(entries) * index.doc_norm(dl) + lift
+        matches = {}
+        for i in range(len(ordered) - 1, -1, -1):
+            if i < essential and partial + prefix[i + 1] + EPSILON < threshold:
+                break
+            _, term, m, n, cq, postings, _ = ordered[i]
+            f = postings.get(doc_id)
+            if f:
+                matches[term] = index.term_match(f, n, cq, dl)
+                partial += m * matches[term]
+        else:
+            # the same sums as Index.score, in the same order
+            score = background + len(entries) * index.doc_norm(dl)
+            for q in entries:
+                if q in matches:
+                    score += matches[q]
+            scores[doc_id] = score
+            scored += 1
+
+            score += lift
+            if len(top) < k:
+                heapq.heappush(top, score)
+            elif score > top[0]:
+                heapq.heapreplace(top, score)
+            if len(top) == k and top[0] > threshold:
+                threshold = top[0]
+                essential = first_essential()
+
+    profiler.count('daat_scored', scored)
+    return scores
+
+
+# {doc_id: score} of the docs that can be in the top k: the docs containing
+# every query term are scored first, the rest with daat from their k-th score
+# (plus prior)
+def conjunctive(index, planner, query_tokens, k, allowed = None):
+    fetched = index.fetch(query_tokens)
+    terms = [q for q in fetched if index.term_df(q)]
+    postings = sorted((fetched[q] for q in terms), key = len)
+    matching = [d for d in postings[0] if all(d in p for p in postings[1:])] if postings else []
+    if allowed is not None:
+        matching = [d for d in matching if d in allowed]
+    index.profiler.count('and_matches', len(matching))
+
+    scores = index.score(query_tokens, matching, fetched)
+    combined = scores.values() if index.prior is None else [s + index.prior[d] for d, s in scores.items()]
+    threshold = heapq.nlargest(k, combined)[-1] if len(scores) >= k else -math.inf
+    return daat(index, planner, query_tokens, k, allowed, threshold, scores, set(matching), fetched)
+
+
+# {doc_id: score} of a query with a strategy (taat: every candidate)
+def evaluate(index, planner, strategy, query_tokens, k, allowed = None):
+    if strategy == 'daat':
+        return daat(index, planner, query_tokens, k, allowed)
+    if strategy == 'conjunctive':
+        return conjunctive(index, planner, query_tokens, k, allowed)
+
+    fetched = index.fetch(query_tokens)
+    search_docs = set()
+    for postings in fetched.values():
+        search_docs.update(postings)
+    if allowed is not None:
+        search_docs &= allowed
+    return index.score(query_tokens, search_docs, fetched)
+
+
+# {strategy: coefficients} of an index and mode (only the default taat
+# coefficients if not calibrated: the planner then always runs taat)
+def load_costs(index_name, mode):
+    path = planner_path(index_name)
+    costs = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            costs = ast.literal_eval(f.read())
+    return costs.get(mode, {'taat': COSTS['taat']})
+
+
+# time every strategy on every query (best of repeat runs), after computing
+# the term bounds once; returns the features and {strategy: [ms]} per query
+def measure(index, planner, queries, k, repeat = 3):
+    tokenized = [index.analyze(query) for _, query in queries]
+    for tokens in tokenized:
+        evaluate(index, planner, 'daat', tokens, k)
+
+    rows = []
+    times = {s: [] for s in STRATEGIES}
+    for tokens in tokenized:
+        rows.append(features([index.term_df(q) for q in tokens if index.term_df(q)], index.N))
+        for strategy in STRATEGIES:
+            best = math.inf
+            for _ in range(repeat):
+                start = time.perf_counter()
+                index.rank(evaluate(index, planner, strategy, tokens, k), k)
+                best = min(best, (time.perf_counter() - start) * 1000)
+            times[strategy].append(best)
+    return np.array(rows, dtype=float), times
+
+
+# least squares cost coefficients of every strategy (negative ones set to 0)
+def fit(rows, times):
+    return {s: [max(0.0, float(c)) for c in np.linalg.lstsq(rows, np.array(times[s]), rcond=None)[0]] for s in STRATEGIES}
+
+
+def main():
+    import index_search
+
+    parser = argparse.ArgumentParser(description='Cost-based query planner', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('command', choices=['calibrate', 'report'], help='calibrate: fit the cost of every strategy on a query log and write it\nreport: compare every strategy and the planner on a query log')
+    parser.add_argument('index_name', help='Name of the index (e.g. index_stopped)')
+    parser.add_argument('-mode', default='BM25', help='Scoring mode (default: \"%(default)s\")')
+    parser.add_argument('-queries', default='test-collection/cacm.query.txt', help='CACM query file (default: \"%(default)s\")')
+    parser.add_argument('-k', type=int, default=10, help='Results per query (default: \"%(default)s\")')
+    parser.add_argument('-target', type=float, default=LATENCY_TARGET_MS, help='Latency target in ms (default: \"%(default)s\")')
+    args = parser.parse_args()
+    print("args:", args)
+
+    index = index_search.Index(args.index_name, None, args.mode)
+    queries = index_search.read_queries(args.queries)
+    planner = Planner(load_costs(index.index_name, args.mode), args.target)
+    rows, times = measure(index, planner, queries, args.k)
+
+    if args.command == 'calibrate':
+        path = planner_path(index.index_name)
+        costs = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                costs = ast.literal_eval(f.read())
+        costs[args.mode] = fit(rows, times)
+        with open(path, 'w') as f:
+            f.write(str(costs))
+        planner.costs = costs[args.mode]
+        print('costs written to {}: {}'.format(path, costs[args.mode]))
+
+    # strategies and the planner against the fastest strategy of every query
+    plans = [min(planner.costs, key = lambda s: float(np.dot(planner.costs[s], row))) for row in rows]
+    planned = [times[s][i] for i, s in enumerate(plans)]
+    oracle = [min(times[s][i] for s in STRATEGIES) for i in range(len(rows))]
+    print('{:<12} {:>10} {:>10} {:>10} {:>8}'.format('strategy', 'total ms', 'mean ms', 'max ms', 'chosen'))
+    for name, values in [(s, times[s]) for s in STRATEGIES] + [('planner', planned), ('fastest', oracle)]:
+        print('{:<12} {:>10.1f} {:>10.3f} {:>10.3f} {:>8}'.format(name, sum(values), sum(values) / len(values), max(values),
+              plans.count(name) if name in STRATEGIES else '-'))
+    print('{} of {} queries within {} ms with the planner'.format(sum(t <= args.target for t in planned), len(planned), args.target))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import json
+import time
+import sys
+
+# Upper bounds (in ms) of the latency buckets used for the end of run histograms
+BUCKETS_MS = [0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000]
+
+
+# Times a single stage and adds the duration to the current trace record
+class StageTimer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = (time.perf_counter() - self.start) * 1000
+        stages = self.profiler.current['stages']
+        stages[self.name] = stages.get(self.name, 0) + elapsed
+        return False
+
+
+# Opens a trace record for one query (nested calls share the outer record)
+class QueryTrace:
+    def __init__(self, profiler, label, info):
+        self.profiler = profiler
+        self.label = label
+        self.info = info
+
+    def __enter__(self):
+        p = self.profiler
+        if p.depth == 0:
+            p.current = {'query': str(self.label), 'stages': {}, 'counters': {}}
+            p.current.update(self.info)
+            self.start = time.perf_counter()
+        p.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        p = self.profiler
+        p.depth -= 1
+        if p.depth == 0:
+            p.current['total_ms'] = (time.perf_counter() - self.start) * 1000
+            p.finish()
+        return False
+
+
+# Shared no-op context manager used when profiling is disabled
+class NullContext:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_CONTEXT = NullContext()
+
+
+# Profiler used when -profile is not given. Every call is a constant time no-op
+# so the search code can stay instrumented without paying for it.
+class NullProfiler:
+    enabled = False
+
+    def query(self, label, **info):
+        return NULL_CONTEXT
+
+    def stage(self, name):
+        return NULL_CONTEXT
+
+    def count(self, name, n=1):
+        pass
+
+    def annotate(self, **info):
+        pass
+
+    def report(self, out=sys.stdout):
+        pass
+
+
+# Records per stage timings and counters for each query, writes one JSON line
+# per query to trace_file and aggregates histograms for the end of the run
+class QueryProfiler:
+    enabled = True
+
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        self.depth = 0
+        self.current = None
+
+        # stage / counter name -> list of values (one per query)
+        self.stage_values = {}
+        self.counter_values = {}
+
+        # clean trace file at beginning
+        with open(self.trace_file, 'w'):
+            pass
+
+    def query(self, label, **info):
+        return QueryTrace(self, label, info)
+
+    def stage(self, name):
+        if self.depth == 0:
+            return NULL_CONTEXT
+        return StageTimer(self, name)
+
+    def count(self, name, n=1):
+        if self.depth == 0:
+            return
+        counters = self.current['counters']
+        counters[name] = counters.get(name, 0) + n
+
+    # add fields (e.g. the query plan) to the current trace record
+    def annotate(self, **info):
+        if self.depth == 0:
+            return
+        self.current.update(info)
+
+    # write the finished record and add it to the aggregates
+    def finish(self):
+        record = self.current
+        self.current = None
+
+        with open(self.trace_file, 'a+') as f:
+            f.write(json.dumps(record) + '\n')
+
+        for name, ms in record['stages'].items():
+            self.stage_values.setdefault(name, []).append(ms)
+        self.stage_values.setdefault('total', []).append(record['total_ms'])
+        for name, n in record['counters'].items():
+            self.counter_values.setdefault(name, []).append(n)
+
+    # print aggregated latency histograms and counter summaries
+    def report(self, out=sys.stdout):
+        if not self.stage_values:
+            return
+
+        labels = ['<{}'.format(b) for b in BUCKETS_MS] + ['>={}'.format(BUCKETS_MS[-1])]
+        out.write('\nStage latency (ms) over {} traces\n'.format(len(self.stage_values['total'])))
+        out.write('{:<12} {:>6} {:>9} {:>9} {:>9} {:>9}  {}\n'.format(
+            'stage', 'n', 'mean', 'p50', 'p95', 'max', ' '.join('{:>6}'.format(l) for l in labels)))
+
+        for name, values in self.stage_values.items():
+            values = sorted(values)
+            hist = [0] * (len(BUCKETS_MS) + 1)
+            for v in values:
+                i = 0
+                while i < len(BUCKETS_MS) and v >= BUCKETS_MS[i]:
+                    i += 1
+                hist[i] += 1
+
+            out.write('{:<12} {:>6} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}  {}\n'.format(
+                name, len(values), sum(values) / len(values), percentile(values, 50),
+                percentile(values, 95), values[-1], ' '.join('{:>6}'.format(h) for h in hist)))
+
+        if self.counter_values:
+            out.write('\nCounters\n')
+            out.write('{:<16} {:>6} {:>12} {:>12} {:>12}\n'.format('counter', 'n', 'total', 'mean', 'max'))
+            for name, values in self.counter_values.items():
+                out.write('{:<16} {:>6} {:>12} {:>12.1f} {:>12}\n'.format(
+                    name, len(values), sum(values), sum(values) / len(values), max(values)))
+
+
+# nearest-rank percentile of an already sorted list
+def percentile(values, p):
+    if not values:
+        return 0
+    k = max(0, min(len(values) - 1, int(round(p / 100 * len(values))) - 1))
+    return values[k]
+
+
+# build the profiler for a -profile command line value (None = disabled)
+def get_profiler(trace_file):
+    if not trace_file:
+        return NullProfiler()
+    return QueryProfiler(trace_file)
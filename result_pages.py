@@ -0,0 +1,62 @@
+import json
+import heapq
+import base64
+
+# Result pagination (search-after)
+#
+# Results are served in pages of page_size. A page is selected from the scored
+# candidates in one pass with a bounded heap (heapq.nsmallest on a sort key),
+# skipping everything up to the cursor, so no more than page_size results are
+# ever sorted or kept, however deep the page.
+#
+# The cursor is an opaque string holding the sort key of the last result served
+# (e.g. its negated score and doc id) and the number of results served so far.
+# Sort keys must be a total order (ties broken by doc id) for pages not to skip
+# or repeat results.
+
+
+# cursor after the result with sort key key, served results so far
+def encode_cursor(key, served):
+    return base64.urlsafe_b64encode(json.dumps([served] + list(key)).encode('utf-8')).decode('ascii')
+
+
+# sort key and served count of a cursor
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return tuple(values[1:]), int(values[0])
+    except (ValueError, TypeError, IndexError):
+        raise ValueError('Invalid cursor: {}'.format(cursor))
+
+
+# number of results served before the page of a cursor
+def offset(cursor):
+    return decode_cursor(cursor)[1] if cursor else 0
+
+
+# the page_size smallest items (by key) that come after the cursor
+def top(items, page_size, key=None, cursor=None):
+    key = key or (lambda x: x)
+    if cursor:
+        after = decode_cursor(cursor)[0]
+        items = (x for x in items if key(x) > after)
+    return heapq.nsmallest(page_size, items, key=key)
+
+
+# cursor of the page after results (None if results was the last page)
+def next_cursor(results, page_size, key=None, cursor=None):
+    if len(results) < page_size or not results:
+        return None
+    key = key or (lambda x: x)
+    return encode_cursor(key(results[-1]), offset(cursor) + len(results))
+
+
+# stream results one at a time, page after page
+# (fetch(cursor) returns a page and the cursor of the next one)
+def stream(fetch):
+    cursor = None
+    while True:
+        results, cursor = fetch(cursor)
+        yield from results
+        if cursor is None:
+            return
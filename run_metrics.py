@@ -0,0 +1,72 @@
+# Effectiveness measures for in-memory runs
+# (same definitions as evaluation/evaluator.py, so numbers are comparable
+# with the evaluation/ reports)
+
+# Default location of the CACM relevance judgments
+RELEVANCY_FILE = 'test-collection/cacm.rel.txt'
+
+
+# Parse the relevancy file into {query_id: set of relevant doc ids}
+def read_relevance(relevancy_file_loc = RELEVANCY_FILE):
+    relevant_docs = {}
+    with open(relevancy_file_loc, 'r') as relevancy_file:
+        # EX: 19 Q0 CACM-3075 1
+        for l in relevancy_file:
+            terms = l.strip().split(' ')
+            if len(terms) < 3:
+                continue
+            relevant_docs.setdefault(int(terms[0]), set()).add(terms[2])
+    return relevant_docs
+
+
+# Parse a run file into {query_id: ranked list of doc ids}
+# (only the first k results of each query if k is given)
+def read_run(run_file_loc, k = None):
+    results = {}
+    with open(run_file_loc, 'r') as run_file:
+        # EX: Q1 1 CACM-1519 18.572
+        for l in run_file:
+            terms = l.strip().split(' ')
+            if len(terms) < 3:
+                continue
+            docs = results.setdefault(int(terms[0].lstrip('Q')), [])
+            if k is None or len(docs) < k:
+                docs.append(terms[2])
+    return results
+
+
+# Compute MAP, MRR, P@5 and P@20 of a run
+# results: {query_id: ranked list of doc ids}
+def evaluate(results, relevant_docs):
+    AP_values = []
+    RR_values = []
+    P5_values = []
+    P20_values = []
+
+    for q_id, q_relevant in relevant_docs.items():
+        q_results = results.get(q_id, [])
+
+        precision_vals = []
+        first_relevant_rank = None
+        relevant_count = 0
+
+        for i, doc_id in enumerate(q_results):
+            if doc_id in q_relevant:
+                relevant_count += 1
+                if not first_relevant_rank:
+                    first_relevant_rank = i + 1
+            precision_vals.append(relevant_count / (i+1))
+
+        # As in evaluator.py, AP averages precision over every retrieved rank
+        AP_values.append(sum(precision_vals) / len(precision_vals) if precision_vals else 0)
+        RR_values.append(1 / first_relevant_rank if first_relevant_rank else 0)
+        P5_values.append(precision_vals[4] if len(precision_vals) > 4 else relevant_count / 5)
+        P20_values.append(precision_vals[19] if len(precision_vals) > 19 else relevant_count / 20)
+
+    n = max(1, len(relevant_docs))
+    return {
+        'MAP': sum(AP_values) / n,
+        'MRR': sum(RR_values) / n,
+        'P@5': sum(P5_values) / n,
+        'P@20': sum(P20_values) / n
+        }
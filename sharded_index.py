@@ -0,0 +1,194 @@
+import ast
+import heapq
+import argparse
+import multiprocessing
+import index_search
+import query_profile
+
+# Document-sharded index
+#
+# An index is split into N doc-partitioned shards, each written in the usual
+# index format ([name]_shard[i].txt / _stats.txt). Collection wide statistics
+# (N, avdl, |C| and df / cf of every term) are written to [name]_shards.txt,
+# so every shard scores with the same numbers as the unsharded index.
+#
+# Queries are fanned out to one worker process per shard and the per-shard
+# top-k lists are merged. Workers only talk through a pipe, so they can be
+# moved to other nodes later by replacing the pipe with a socket.
+
+
+# name of shard i of an index
+def shard_name(index_name, i):
+    return '{}_shard{}'.format(index_name, i)
+
+
+# path of the global stats file of a sharded index
+def global_stats_path(index_name):
+    return '{}_shards.txt'.format(index_name)
+
+
+# split an existing index into num_shards doc-partitioned shards
+def build_shards(source_name, index_name, num_shards):
+    with open("{}_stats.txt".format(source_name), 'r') as stats_file:
+        stats = ast.literal_eval(stats_file.read())
+
+    # assign documents round-robin (in sorted order) to balance the shards
+    doc_shard = {}
+    for i, doc_id in enumerate(sorted(stats['doc_lengths'])):
+        doc_shard[doc_id] = i % num_shards
+
+    shard_index = [{} for _ in range(num_shards)]
+    df = {}
+    cf = {}
+
+    with open("{}.txt".format(source_name), 'r') as index_file:
+        for l in index_file:
+            if not l.strip():
+                continue
+            [term, freqs] = l.split(":", 1)
+            freqs = ast.literal_eval(freqs.split(",", 1)[1].strip())
+
+            df[term] = len(freqs)
+            cf[term] = sum(freqs.values())
+            for doc_id, f in freqs.items():
+                shard_index[doc_shard[doc_id]].setdefault(term, {})[doc_id] = f
+
+    for i in range(num_shards):
+        # local stats keep the text transformation flags of the source index
+        shard_stats = dict(stats)
+        shard_stats['doc_lengths'] = {d: n for d, n in stats['doc_lengths'].items() if doc_shard[d] == i}
+        shard_stats['num_docs'] = len(shard_stats['doc_lengths'])
+        shard_stats['corpus_len'] = sum(shard_stats['doc_lengths'].values())
+        shard_stats['avdl'] = shard_stats['corpus_len'] / max(1, shard_stats['num_docs'])
+
+        name = shard_name(index_name, i)
+        with open('{}.txt'.format(name), 'w') as index_file:
+            for t, d in shard_index[i].items():
+                index_file.write(t + ': ' + str(len(d)) + ', ')
+                index_file.write(str(d) + '\n')
+        with open("{}_stats.txt".format(name), 'w') as stats_file:
+            stats_file.write(str(shard_stats))
+
+    global_stats = {
+        'num_shards': num_shards,
+        'num_docs': stats['num_docs'],
+        'avdl': stats['avdl'],
+        'corpus_len': stats['corpus_len'],
+        'df': df,
+        'cf': cf
+        }
+    with open(global_stats_path(index_name), 'w') as f:
+        f.write(str(global_stats))
+
+
+# worker process: load one shard and answer queries until None is received
+def shard_worker(conn, name, mode, global_stats):
+    index = index_search.Index(name, None, mode)
+    index.set_global_stats(global_stats)
+    conn.send('ready')
+
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        query_num, query, limit, cursor = request
+        conn.send(index.search(query_num, query, limit, cursor))
+    conn.close()
+
+
+class ShardedIndex:
+    # start one worker process per shard
+    def __init__(self, index_name, output_file, mode, profiler=None):
+        self.output_file = output_file
+        self.mode = mode
+        self.profiler = profiler or query_profile.NullProfiler()
+
+        with open(global_stats_path(index_name), 'r') as f:
+            global_stats = ast.literal_eval(f.read())
+
+        self.connections = []
+        self.workers = []
+        for i in range(global_stats['num_shards']):
+            parent, child = multiprocessing.Pipe()
+            p = multiprocessing.Process(target=shard_worker, args=(child, shard_name(index_name, i), mode, global_stats))
+            p.daemon = True
+            p.start()
+            self.connections.append(parent)
+            self.workers.append(p)
+
+        # wait until every shard is loaded
+        for conn in self.connections:
+            conn.recv()
+
+    # scatter the query to every shard and merge the per-shard top results
+    # (every shard returns its own page after cursor, which covers the merged page)
+    def search(self, query_num, query, limit, cursor=None):
+        with self.profiler.query(query_num, mode=self.mode, shards=len(self.connections)):
+            with self.profiler.stage('scatter'):
+                for conn in self.connections:
+                    conn.send((query_num, query, limit, cursor))
+
+            with self.profiler.stage('gather'):
+                results = [conn.recv() for conn in self.connections]
+
+            with self.profiler.stage('merge'):
+                return heapq.nsmallest(limit, [r for shard in results for r in shard], key = index_search.rank_key)
+
+    # stop the worker processes
+    def close(self):
+        for conn in self.connections:
+            conn.send(None)
+        for p in self.workers:
+            p.join()
+
+    # clean file at beginning
+    def new_search_store(self):
+        with open(self.output_file, 'w'):
+            pass
+
+    # get search results and store to output file
+    def search_store(self, query_num, query, limit):
+        with self.profiler.query(query_num, mode=self.mode):
+            scores = self.search(query_num, query, limit)
+
+            # write scores to file
+            with self.profiler.stage('write'), open(self.output_file, 'a+') as f:
+                for rank, (doc_id, score) in enumerate(scores):
+                    f.write('Q{} {} {} {}\n'.format(query_num, rank+1, doc_id, score))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded index', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('command', choices=['build', 'search'], help='build: split an index into shards\nsearch: query a sharded index')
+    parser.add_argument('index_name', help='Name of the (unsharded) index')
+    parser.add_argument('output_file', nargs='?', help='Output file (search only).')
+    parser.add_argument('-shards', type=int, default=4, help="Number of shards (build only). (default: \"%(default)s\")")
+    parser.add_argument('-q', type=index_search.querypair, action='append', help='[Query ID]:[Query] pair (e.g. 25:"cow horse moon")')
+    parser.add_argument("-mode", default='TF-IDF', help="Scoring mode (BM25, TF-IDF, JM, Dirichlet) (default: \"%(default)s\")")
+    parser.add_argument("-limit", type=int, default=100, help="Limit. (default: \"%(default)s\")")
+    parser.add_argument('-new', action='store_true', help="Creates a new output file (otherwise appends to existing file).")
+    parser.add_argument('-profile', nargs='?', const='profile_trace.jsonl', help="Write a JSON-lines trace per query to this file (default: \"%(const)s\")\nand print stage histograms at the end of the run.")
+    args = parser.parse_args()
+    print("args:", args)
+
+    if args.command == 'build':
+        build_shards(args.index_name, args.index_name, args.shards)
+        return
+
+    if not args.output_file:
+        parser.error('search needs an output file')
+
+    profiler = query_profile.get_profiler(args.profile)
+    index = ShardedIndex(args.index_name, args.output_file, args.mode, profiler)
+
+    if args.new:
+        index.new_search_store()
+
+    for q_id, q in args.q or []:
+        index.search_store(q_id, q, args.limit)
+
+    index.close()
+    profiler.report()
+
+if __name__ == '__main__':
+    main()
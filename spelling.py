@@ -0,0 +1,131 @@
+import os
+
+# Character n-gram index over the term dictionary, used to suggest spelling
+# corrections for query terms that are not in the index.
+#
+# Each term is padded with n-1 '$' on both sides, so a term of length L has
+# L+n-1 n-grams and a single edit changes at most n of them. Two terms within
+# edit distance k therefore share at least max(La, Lb) + n - 1 - k*n grams
+# (the q-gram lemma), which lets us only verify terms that share enough grams
+# instead of scanning the whole vocabulary. The lemma counts grams with their
+# multiplicity ('nanana' has 'nan' twice), so the postings list a term once for
+# every occurrence of the gram in it.
+
+N_GRAM = 3
+
+
+# padded character n-grams of a term, repeated grams included
+def ngrams(term, n = N_GRAM):
+    padded = '$' * (n-1) + term + '$' * (n-1)
+    return [padded[i:i+n] for i in range(len(padded) - n + 1)]
+
+
+# only words are worth suggesting (numbers and codes are skipped)
+def is_word(term):
+    return any(c.isalpha() for c in term)
+
+
+# build gram -> list of terms (once per occurrence) for a vocabulary
+def build_ngram_index(terms, n = N_GRAM):
+    grams = {}
+    for term in terms:
+        if not is_word(term):
+            continue
+        for g in ngrams(term, n):
+            grams.setdefault(g, []).append(term)
+    return grams
+
+
+# write the n-gram index as "gram<TAB>term term ..." lines
+def write_ngram_index(grams, path):
+    with open(path, 'w') as f:
+        for g, terms in grams.items():
+            f.write('{}\t{}\n'.format(g, ' '.join(terms)))
+
+
+# read an n-gram index written by write_ngram_index
+def read_ngram_index(path):
+    grams = {}
+    with open(path, 'r') as f:
+        for l in f:
+            l = l.rstrip('\n')
+            if not l:
+                continue
+            g, terms = l.split('\t', 1)
+            grams[g] = terms.split(' ')
+    return grams
+
+
+# path of the n-gram index that belongs to an index
+def ngram_index_path(index_name):
+    return '{}_ngrams.txt'.format(index_name)
+
+
+# Levenshtein distance of a and b, or None if it is larger than k
+def bounded_edit_distance(a, b, k):
+    if abs(len(a) - len(b)) > k:
+        return None
+
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i-1] == b[j-1] else 1
+            cur[j] = min(prev[j] + 1, cur[j-1] + 1, prev[j-1] + cost)
+        # stop early if every alignment is already too far apart
+        if min(cur) > k:
+            return None
+        prev = cur
+
+    return prev[-1] if prev[-1] <= k else None
+
+
+class SpellingIndex:
+    # grams: gram -> list of terms (once per occurrence), df: function returning the document
+    # frequency of a term (used to prefer common corrections)
+    def __init__(self, grams, df, n = N_GRAM):
+        self.grams = grams
+        self.df = df
+        self.n = n
+
+    # return up to limit (term, distance) corrections within edit distance k,
+    # closest first and then most frequent first
+    def suggest(self, term, k = 2, limit = 5):
+        query_grams = {}
+        for g in ngrams(term, self.n):
+            query_grams[g] = query_grams.get(g, 0) + 1
+
+        # count the grams each vocabulary term shares with the query term,
+        # a repeated gram as often as it occurs in both terms
+        shared = {}
+        for g, query_count in query_grams.items():
+            occurrences = {}
+            for t in self.grams.get(g, []):
+                occurrences[t] = occurrences.get(t, 0) + 1
+            for t, count in occurrences.items():
+                shared[t] = shared.get(t, 0) + min(count, query_count)
+
+        suggestions = []
+        for t, count in shared.items():
+            # q-gram lemma (always require at least one shared gram)
+            if count < max(1, max(len(t), len(term)) + self.n - 1 - k * self.n):
+                continue
+            if t == term:
+                continue
+            dist = bounded_edit_distance(term, t, k)
+            if dist is not None:
+                suggestions.append((t, dist))
+
+        suggestions.sort(key = lambda x: (x[1], -self.df(x[0]), x[0]))
+        return suggestions[:limit]
+
+
+# load the n-gram index written next to an index, or build it from the
+# vocabulary if the index predates it
+def load_spelling_index(index_name, vocabulary, df):
+    path = ngram_index_path(index_name)
+    if os.path.exists(path):
+        grams = read_ngram_index(path)
+    else:
+        grams = build_ngram_index(vocabulary)
+    return SpellingIndex(grams, df)
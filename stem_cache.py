@@ -0,0 +1,44 @@
+import os
+from nltk.stem import PorterStemmer
+
+# Default location of the persistent stem cache
+STEM_CACHE_FILE = 'stem_cache.txt'
+
+
+# Memoizing Porter stemmer. Every distinct surface form is stemmed once; the
+# surface -> stem mapping is saved to disk so that later indexing and query
+# runs start with every form seen before.
+class StemCache:
+    def __init__(self, path = STEM_CACHE_FILE):
+        self.path = path
+        self.stemmer = PorterStemmer()
+        self.cache = {}
+        self.added = 0
+
+        # load the mapping saved by previous runs ("surface stem" per line)
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                for l in f:
+                    parts = l.split()
+                    if len(parts) == 2:
+                        self.cache[parts[0]] = parts[1]
+
+    def stem(self, word):
+        stemmed = self.cache.get(word)
+        if stemmed is None:
+            stemmed = self.stemmer.stem(word)
+            self.cache[word] = stemmed
+            self.added += 1
+        return stemmed
+
+    # write the cache back to disk if new forms were stemmed
+    # (written to a temporary file first so a concurrent reader never sees half of it)
+    def save(self):
+        if not self.path or not self.added:
+            return
+        tmp_path = '{}.tmp{}'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            for word, stemmed in self.cache.items():
+                f.write('{} {}\n'.format(word, stemmed))
+        os.replace(tmp_path, self.path)
+        self.added = 0
@@ -0,0 +1,125 @@
+import os
+from bisect import bisect_right
+
+# Sorted, front-coded term dictionary
+#
+# Terms are sorted and split into blocks of BLOCK_SIZE terms. Each block is
+# written on one line; the first term is stored in full and every following
+# term as "<shared prefix length>|<suffix>" relative to the previous term,
+# e.g.
+#   0|comput	6|e	7|r	7|rs	6|ing
+#
+# Only the first term and the file offset of each block are kept in memory.
+# Lookups binary search those heads and decode a single block from disk.
+
+BLOCK_SIZE = 16
+
+# default cap on the number of terms a single wildcard expands to
+MAX_EXPANSIONS = 50
+
+# prefix followed by a trailing wildcard in query text, e.g. comput*
+WILDCARD_REGEX = r'(\w[\w.,-]*)\*'
+
+
+# length of the common prefix of two strings
+def common_prefix(a, b):
+    i = 0
+    while i < len(a) and i < len(b) and a[i] == b[i]:
+        i += 1
+    return i
+
+
+# write the front-coded dictionary of a vocabulary
+def write_term_dictionary(terms, path, block_size = BLOCK_SIZE):
+    terms = sorted(terms)
+    with open(path, 'wb') as f:
+        for start in range(0, len(terms), block_size):
+            entries = []
+            prev = ''
+            for term in terms[start:start + block_size]:
+                lcp = common_prefix(prev, term)
+                entries.append('{}|{}'.format(lcp, term[lcp:]))
+                prev = term
+            f.write(('\t'.join(entries) + '\n').encode('utf-8'))
+
+
+# decode one block line into its terms
+def decode_block(line):
+    terms = []
+    prev = ''
+    for entry in line.rstrip('\n').split('\t'):
+        lcp, suffix = entry.split('|', 1)
+        prev = prev[:int(lcp)] + suffix
+        terms.append(prev)
+    return terms
+
+
+class TermDictionary:
+    # load the sparse block index (first term and offset of every block)
+    def __init__(self, path):
+        self.path = path
+        self.heads = []
+        self.offsets = []
+
+        with open(path, 'rb') as f:
+            offset = 0
+            for line in f:
+                head = line.decode('utf-8').split('\t', 1)[0].rstrip('\n')
+                self.heads.append(head.split('|', 1)[1])
+                self.offsets.append(offset)
+                offset += len(line)
+
+    # decode blocks from number i onwards
+    def blocks(self, i):
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[i])
+            for line in f:
+                yield decode_block(line.decode('utf-8'))
+
+    # index of the block that would contain term
+    def find_block(self, term):
+        return max(0, bisect_right(self.heads, term) - 1)
+
+    def __contains__(self, term):
+        if not self.heads:
+            return False
+        for terms in self.blocks(self.find_block(term)):
+            return term in terms
+        return False
+
+    # all terms starting with prefix (in sorted order, at most limit)
+    def prefix(self, prefix, limit = MAX_EXPANSIONS):
+        result = []
+        if not self.heads or not prefix:
+            return result
+
+        for terms in self.blocks(self.find_block(prefix)):
+            for term in terms:
+                if term.startswith(prefix):
+                    result.append(term)
+                    if limit and len(result) >= limit:
+                        return result
+                elif term > prefix:
+                    return result
+        return result
+
+
+# expand a trailing wildcard ("comput*") into the matching terms
+def expand_wildcard(dictionary, pattern, limit = MAX_EXPANSIONS):
+    return dictionary.prefix(pattern.rstrip('*'), limit)
+
+
+# path of the term dictionary that belongs to an index
+# (inside the folder for folder based indexes)
+def term_dictionary_path(index_name):
+    if os.path.isdir(index_name):
+        return os.path.join(index_name, 'terms.txt')
+    return '{}_terms.txt'.format(index_name)
+
+
+# load a term dictionary, writing it first from vocabulary() if the index
+# predates it
+def load_term_dictionary(path, vocabulary):
+    if not os.path.exists(path):
+        write_term_dictionary(vocabulary(), path)
+    return TermDictionary(path)
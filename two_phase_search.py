@@ -0,0 +1,99 @@
+import math
+import argparse
+import index_search
+import advanced_search
+import query_profile
+import postings_cache
+
+
+# Proximity feature of a document: log(1 + m / (window - m + 1)) where m is
+# the number of distinct query terms in the smallest window containing them.
+# It is log(1 + m) when the terms are adjacent and decays as gaps grow.
+def proximity_score(window, matched):
+    return math.log(1 + matched / (window - matched + 1))
+
+
+class TwoPhaseSearch:
+    # phase one ranks with the frequency index, phase two reranks the top k
+    # candidates with positions from the positional index
+    # (positions are read through a postings cache of cache_bytes if set)
+    def __init__(self, index_name, positional_name, output_file, k = 100, weight = 0.5, profiler = None, cache_bytes = None):
+        self.profiler = profiler or query_profile.NullProfiler()
+        self.index = index_search.Index(index_name, output_file, 'BM25', self.profiler)
+        self.positional = advanced_search.Search(positional_name, self.profiler, cache_bytes)
+        self.output_file = output_file
+        self.k = k
+        self.weight = weight
+
+    # search for a query and return top results
+    def search(self, query_num, query, limit):
+        profiler = self.profiler
+        with profiler.query(query_num, mode='two-phase'):
+            # Phase one: cheap BM25 candidates
+            candidates = self.index.search(query_num, query, self.k)
+            if not candidates:
+                return []
+
+            # Phase two: positions are only decoded for the k candidates
+            terms = list(set(self.index.analyze(query)))
+            with profiler.stage('positions'):
+                self.positional.fetch_relevant(terms, set(d for d, _ in candidates))
+
+            with profiler.stage('rerank'):
+                reranked = []
+                for doc_id, score in candidates:
+                    window = self.positional.min_cover_window(terms, doc_id)
+                    if window is not None:
+                        matched = len([t for t in terms if doc_id in self.positional.term_docs.get(t, {})])
+                        score += self.weight * proximity_score(window, matched)
+                    reranked.append((doc_id, score))
+                reranked.sort(key = lambda x: -x[1])
+            profiler.count('reranked_docs', len(candidates))
+
+            return reranked[:limit]
+
+    # clean file at beginning
+    def new_search_store(self):
+        with open(self.output_file, 'w'):
+            pass
+
+    # get search results and store to output file
+    def search_store(self, query_num, query, limit):
+        with self.profiler.query(query_num, mode='two-phase'):
+            scores = self.search(query_num, query, limit)
+
+            # write scores to file
+            with self.profiler.stage('write'), open(self.output_file, 'a+') as f:
+                for rank, (doc_id, score) in enumerate(scores):
+                    f.write('Q{} {} {} {}\n'.format(query_num, rank+1, doc_id, score))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Two-phase search (BM25 candidates, proximity rerank)', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('query_file', help='CACM query file')
+    parser.add_argument('-index', default='index_stopped', help='Frequency index for phase one (default: \"%(default)s\")')
+    parser.add_argument('-positional', default='positional', help='Positional index for phase two (default: \"%(default)s\")')
+    parser.add_argument('-output', default='result_tables/two_phase_BM25.txt', help='Output file (default: \"%(default)s\")')
+    parser.add_argument('-k', type=int, default=100, help='Number of candidates reranked per query (default: \"%(default)s\")')
+    parser.add_argument('-weight', type=float, default=0.5, help='Weight of the proximity feature (default: \"%(default)s\")')
+    parser.add_argument('-limit', type=int, default=100, help='Limit. (default: \"%(default)s\")')
+    parser.add_argument('-cache', type=float, nargs='?', const=postings_cache.CACHE_BYTES / 2**20, help="Cache decoded positions across queries, up to this many MB (default: \"%(const)s\")")
+    parser.add_argument('-profile', nargs='?', const='profile_trace.jsonl', help="Write a JSON-lines trace per query to this file (default: \"%(const)s\")\nand print stage histograms at the end of the run.")
+    args = parser.parse_args()
+    print("args:", args)
+
+    profiler = query_profile.get_profiler(args.profile)
+    cache_bytes = int(args.cache * 2**20) if args.cache else None
+    searcher = TwoPhaseSearch(args.index, args.positional, args.output, args.k, args.weight, profiler, cache_bytes)
+    searcher.new_search_store()
+
+    for query_id, query in index_search.read_queries(args.query_file):
+        searcher.search_store(query_id, query, args.limit)
+
+    if cache_bytes:
+        searcher.positional.cache.report()
+
+    profiler.report()
+
+if __name__ == '__main__':
+    main()
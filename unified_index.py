@@ -0,0 +1,201 @@
+import os
+import ast
+import argparse
+import baseline_indexer
+import term_dictionary
+import doc_metadata
+import citation_prior
+
+# Unified positional + frequency index
+#
+# One folder holds everything index_search and advanced_search need:
+#
+#   stats.txt      the stats dict of baseline_indexer (N, avdl, |C|, doc lengths, flags)
+#   postings.txt   one line per term:
+#                  term<TAB>df<TAB>cf<TAB>positions offset<TAB>doc:tf,doc:tf,...
+#   positions.txt  one line per term (at the offset above), with the delta
+#                  encoded positions of each doc in postings order:
+#                  3,5,1;17;0,2
+#
+# Ranking only reads postings.txt. positions.txt is read one term at a time,
+# and only when a phrase or proximity operator needs it.
+
+
+# True if index_name is a unified index folder
+def is_unified(index_name):
+    return os.path.isfile(os.path.join(index_name, 'postings.txt'))
+
+
+# the files a unified index is built from (used to key snapshots)
+def source_files(index_name):
+    return [os.path.join(index_name, 'postings.txt'), os.path.join(index_name, 'stats.txt')]
+
+
+class UnifiedIndexer(baseline_indexer.Indexer):
+    # Same tokens, stopping, stemming and statistics as the baseline indexer,
+    # plus the positions of every term occurrence
+    def __init__(self, html_dir, index_path, stopped=False, stemmed=False):
+        baseline_indexer.Indexer.__init__(self, html_dir, True, True, stopped, stemmed)
+        self.index_path = index_path
+        self.positions = {}
+
+    def create_index(self, output_file_name=None):
+        baseline_indexer.Indexer.create_index(self, output_file_name or self.index_path)
+
+    # Add the tokens of a document (positions count every token, including
+    # stopwords, as in the positional index)
+    def add_document(self, doc_id, tokens):
+        tokens = [str(t) for t in tokens]
+
+        # remove all numbers towards the end of documents
+        end = len(tokens)
+        while end > 0:
+            try:
+                int(tokens[end-1])
+                end -= 1
+            except ValueError:
+                break
+
+        for i, term in enumerate(tokens[:end]):
+            if term in self.stopwords:
+                continue
+            if self.stemmer:
+                term = self.stemmer.stem(term)
+
+            self.stats['corpus_len'] += 1
+            self.stats['doc_lengths'][doc_id] = self.stats['doc_lengths'].get(doc_id, 0) + 1
+            self.positions.setdefault(term, {}).setdefault(doc_id, []).append(i)
+
+        self.stats['avdl'] = self.stats['corpus_len'] / self.stats['num_docs']
+
+    # Write the stats, postings and positions streams
+    def write_index(self, output_file_name=None):
+        index_path = output_file_name or self.index_path
+        if not os.path.exists(index_path):
+            os.makedirs(index_path)
+
+        with open(os.path.join(index_path, 'postings.txt'), 'wb') as postings_file, \
+             open(os.path.join(index_path, 'positions.txt'), 'wb') as positions_file:
+            offset = 0
+            for term, doclist in self.positions.items():
+                docs = []
+                lists = []
+                cf = 0
+                for doc_id, idxlist in doclist.items():
+                    docs.append('{}:{}'.format(doc_id, len(idxlist)))
+                    cf += len(idxlist)
+                    # delta encode the positions
+                    prev = 0
+                    deltas = []
+                    for x in idxlist:
+                        deltas.append(str(x-prev))
+                        prev = x
+                    lists.append(','.join(deltas))
+
+                line = (';'.join(lists) + '\n').encode('utf-8')
+                positions_file.write(line)
+                postings_file.write('{}\t{}\t{}\t{}\t{}\n'.format(term, len(docs), cf, offset, ','.join(docs)).encode('utf-8'))
+                offset += len(line)
+
+        with open(os.path.join(index_path, 'stats.txt'), 'w') as stats_file:
+            stats_file.write(str(self.stats))
+
+        # sorted, front-coded term dictionary (for prefix and wildcard queries)
+        term_dictionary.write_term_dictionary(self.positions.keys(), term_dictionary.term_dictionary_path(index_path))
+
+        # date, CR categories and citation links of the documents (for filtered
+        # search), and the citation graph with its static priors
+        if self.metadata:
+            doc_metadata.write_metadata(self.metadata, doc_metadata.metadata_path(index_path))
+            citation_prior.write_prior(self.metadata, index_path)
+
+        if self.stemmer:
+            self.stemmer.save()
+
+
+# decode the doc:tf,doc:tf,... field of a postings line: {doc_id: tf}
+def decode_frequencies(docs):
+    freqs = {}
+    for entry in docs.split(','):
+        doc_id, tf = entry.rsplit(':', 1)
+        freqs[doc_id] = int(tf)
+    return freqs
+
+
+# decode the whole frequency stream of a unified index: {term: {doc_id: tf}}
+def read_postings(index_path):
+    index = {}
+    with open(os.path.join(index_path, 'postings.txt'), 'rb') as f:
+        for line in f:
+            term, _, _, _, docs = line.decode('utf-8').rstrip('\n').split('\t')
+            index[term] = decode_frequencies(docs)
+    return index
+
+
+class UnifiedIndex:
+    # read the stats and the term table of the frequency stream: df, cf and
+    # positions offset of every term. The postings of a term are decoded from
+    # its line on first use and kept in a PostingsCache (self.index), the
+    # positions stay on disk.
+    def __init__(self, index_path, budget = None):
+        # postings_cache imports this module
+        import postings_cache
+
+        self.index_path = index_path
+
+        with open(os.path.join(index_path, 'stats.txt'), 'r') as stats_file:
+            self.stats = ast.literal_eval(stats_file.read())
+
+        self.df = {}
+        self.cf = {}
+        self.offsets = {}
+        lines = {}
+        line_offset = 0
+        with open(os.path.join(index_path, 'postings.txt'), 'rb') as f:
+            for line in f:
+                term, df, cf, offset, _ = line.split(b'\t', 4)
+                term = term.decode('utf-8')
+                self.df[term] = int(df)
+                self.cf[term] = int(cf)
+                self.offsets[term] = int(offset)
+                lines[term] = line_offset
+                line_offset += len(line)
+
+        self.index = postings_cache.DiskPostings(index_path, budget or postings_cache.CACHE_BYTES, offsets=lines, dfs=self.df, cfs=self.cf)
+
+    # decode the positions of a term: {doc_id: [positions]}
+    # (only for the docs in doc_ids if given)
+    def positions(self, term, doc_ids=None):
+        if term not in self.offsets:
+            return {}
+
+        with open(os.path.join(self.index_path, 'positions.txt'), 'rb') as f:
+            f.seek(self.offsets[term])
+            lists = f.readline().decode('utf-8').rstrip('\n').split(';')
+
+        result = {}
+        for doc_id, deltas in zip(self.index[term], lists):
+            if doc_ids is not None and doc_id not in doc_ids:
+                continue
+            positions = [int(i) for i in deltas.split(',')]
+            # expand to normal positional indices
+            for i in range(1, len(positions)):
+                positions[i] += positions[i-1]
+            result[doc_id] = positions
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Unified positional + frequency indexer', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('input_folder', help='Folder for which index is generated.')
+    parser.add_argument('output_folder', help='Folder for the unified index.')
+    parser.add_argument("-stopped", action='store_true', help="Stopping.")
+    parser.add_argument("-stemmed", action='store_true', help="Stemming (Porter, with a persistent stem cache).")
+    args = parser.parse_args()
+    print("args:", args)
+
+    idxr = UnifiedIndexer(args.input_folder, args.output_folder, args.stopped, args.stemmed)
+    idxr.create_index()
+
+if __name__ == "__main__":
+    main()